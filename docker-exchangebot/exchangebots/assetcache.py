@@ -0,0 +1,212 @@
+from contextlib import contextmanager
+import json
+import os
+import time
+from logger import get_logger
+
+log = get_logger("assets")
+
+
+class AssetCache():
+    """ Cache of asset and bitasset metadata that is shared by all bots
+        and stored on disk so that restarts come up warm.
+
+        :param GrapheneExchange dex: The exchange to load the data from
+        :param str filename: File to persist the cache to (``None`` keeps
+                             the cache in memory only)
+        :param int ttl: Seconds after which the bitasset data (e.g. the
+                        backing asset) is loaded again and verified
+                        markets are verified again
+
+        Only fields that never change (``id``, ``symbol``,
+        ``precision``, ``bitasset_data_id``) are kept for the lifetime of
+        the cache. The bitasset options may be changed by the issuer and
+        are therefore reloaded after ``ttl`` seconds.
+
+        .. code-block:: python
+
+            assets = AssetCache(dex, "assets.json")
+            assets.get_asset("USD")["precision"]
+            assets.get_asset("1.3.121")["symbol"]
+            assets.backing_asset_id("USD")
+    """
+
+    #: Asset fields that are cached
+    asset_fields = ["id", "symbol", "precision", "bitasset_data_id"]
+
+    def __init__(self, dex, filename=None, ttl=60 * 60 * 24):
+        self.dex = dex
+        self.filename = filename
+        self.ttl = ttl
+        self.assets = {}
+        self.bitassets = {}
+        self.ids = {}
+        #: Checks that passed (``{key: time}``, see ``mark_verified()``)
+        self.verified = {}
+        #: Nesting of ``deferred()`` and whether a write is due after it
+        self._deferred = 0
+        self._dirty = False
+        self.restore()
+
+    def restore(self):
+        """ Restore the cache from disk
+        """
+        if self.filename and os.path.isfile(self.filename):
+            try:
+                with open(self.filename, 'r') as fp:
+                    data = json.load(fp)
+            except ValueError:
+                log.warning("Asset cache %s is corrupt, ignoring it", self.filename)
+                return
+            self.assets = data.get("assets", {})
+            self.bitassets = data.get("bitassets", {})
+            self.verified = data.get("verified", {})
+            self.ids = {asset["id"]: symbol for symbol, asset in self.assets.items()}
+
+    def store(self):
+        """ Store the cache on disk (at the end of ``deferred()``)
+        """
+        if not self.filename:
+            return
+        if self._deferred:
+            self._dirty = True
+            return
+        # Replace the file atomically, several workers share the cache
+        tmp = "%s.%d" % (self.filename, os.getpid())
+        with open(tmp, 'w') as fp:
+            json.dump({"assets": self.assets, "bitassets": self.bitassets,
+                       "verified": self.verified}, fp)
+        os.replace(tmp, self.filename)
+
+    @contextmanager
+    def deferred(self):
+        """ Write the cache once after all changes made within the
+            context instead of after every change (e.g. while the bots
+            verify their markets on startup)
+        """
+        self._deferred += 1
+        try:
+            yield
+        finally:
+            self._deferred -= 1
+            if not self._deferred and self._dirty:
+                self._dirty = False
+                self.store()
+
+    def invalidate(self, name=None):
+        """ Drop a single asset (by symbol or id) or, without argument,
+            all assets from the cache
+        """
+        if name is None:
+            self.assets = {}
+            self.bitassets = {}
+            self.ids = {}
+            self.verified = {}
+        else:
+            symbol = self.ids.get(name, name)
+            asset = self.assets.pop(symbol, None)
+            self.bitassets.pop(symbol, None)
+            if asset:
+                self.ids.pop(asset["id"], None)
+        self.store()
+
+    def _add_asset(self, data):
+        asset = {key: data[key] for key in self.asset_fields if key in data}
+        self.assets[asset["symbol"]] = asset
+        self.ids[asset["id"]] = asset["symbol"]
+        return asset
+
+    def prefetch(self, names):
+        """ Load all missing assets and expired bitassets of ``names``
+            with one ``lookup_asset_symbols`` and one ``get_objects`` call
+            on the websocket instead of one call per asset
+
+            :param list names: Symbols of the assets
+        """
+        missing = [name for name in names if self.ids.get(name, name) not in self.assets]
+        if missing:
+            for data in self.dex.ws.lookup_asset_symbols(missing):
+                if data:
+                    self._add_asset(data)
+        expired = [symbol for symbol in (self.ids.get(name, name) for name in names)
+                   if symbol in self.assets and "bitasset_data_id" in self.assets[symbol] and
+                   (symbol not in self.bitassets or
+                    time.time() - self.bitassets[symbol]["time"] > self.ttl)]
+        if expired:
+            objects = self.dex.ws.get_objects([self.assets[s]["bitasset_data_id"] for s in expired])
+            for symbol, data in zip(expired, objects):
+                self.bitassets[symbol] = {"options": data["options"], "time": time.time()}
+        if missing or expired:
+            self.store()
+
+    def is_verified(self, key):
+        """ Whether the check ``key`` passed within the last ``ttl``
+            seconds
+        """
+        return time.time() - self.verified.get(key, 0) <= self.ttl
+
+    def mark_verified(self, key):
+        """ Remember that the check ``key`` (e.g. of a market) passed so
+            that it can be skipped on the next start
+        """
+        self.verified[key] = time.time()
+        self.store()
+
+    def get_asset(self, name):
+        """ Return the asset ``name`` (symbol or id)
+
+            :param str name: Symbol or object id (``1.3.x``) of the asset
+            :return: ``id``, ``symbol``, ``precision`` and (for bitassets)
+                     ``bitasset_data_id`` of the asset
+            :rtype: json
+        """
+        symbol = self.ids.get(name, name)
+        if symbol not in self.assets:
+            asset = self._add_asset(self.dex.rpc.get_asset(name))
+            self.store()
+            symbol = asset["symbol"]
+        return self.assets[symbol]
+
+    def get_bitasset(self, name):
+        """ Return the bitasset options (``short_backing_asset``, ...)
+            of the bitasset ``name``
+
+            :param str name: Symbol or object id of the bitasset
+            :raises ValueError: if the asset is not a bitasset
+        """
+        asset = self.get_asset(name)
+        if "bitasset_data_id" not in asset:
+            raise ValueError("%s is not a bitasset!" % asset["symbol"])
+        symbol = asset["symbol"]
+        cached = self.bitassets.get(symbol)
+        if not cached or time.time() - cached["time"] > self.ttl:
+            data = self.dex.getObject(asset["bitasset_data_id"])
+            cached = {"options": data["options"], "time": time.time()}
+            self.bitassets[symbol] = cached
+            self.store()
+        return cached["options"]
+
+    def bitasset_symbol(self, bitasset_data_id):
+        """ Return the symbol of the cached bitasset whose bitasset data
+            object is ``bitasset_data_id`` (``None`` if there is none)
+        """
+        for symbol, asset in self.assets.items():
+            if asset.get("bitasset_data_id") == bitasset_data_id:
+                return symbol
+        return None
+
+    def backing_asset_id(self, name):
+        """ Return the id of the asset backing the bitasset ``name``
+        """
+        return self.get_bitasset(name)["short_backing_asset"]
+
+    def market_ids(self, market, separator):
+        """ Return the ids of quote and base of a market
+
+            :param str market: Market name, e.g. ``USD : BTS``
+            :param str separator: Market separator
+            :return: ``{"quote": quote_id, "base": base_id}``
+        """
+        quote_symbol, base_symbol = market.split(separator)
+        return {"quote": self.get_asset(quote_symbol)["id"],
+                "base": self.get_asset(base_symbol)["id"]}
@@ -0,0 +1,248 @@
+""" Backtest strategies against recorded market data
+
+    .. code-block:: sh
+
+        python backtest.py backtest.json
+
+    with ``backtest.json``:
+
+    .. code-block:: js
+
+        {
+            "strategy": "strategies.liquidity_wall.LiquiditySellBuyWalls",
+            "events": "eur_bts.jsonl.gz",
+            "assets": {"BTS": {"precision": 5},
+                       "EUR": {"precision": 4, "backing_asset": "BTS"}},
+            "balances": {"BTS": 100000},
+            "settings": {"markets": ["EUR : BTS"], ...},
+            "grid": {"spread_percentage": [1, 2, 3],
+                     "time_weight_factor": [0.1, 0.2]}
+        }
+
+    The events file contains one market data event (see
+    ``SimulatedExchange``) per line, ordered by ``time`` (unix timestamp
+    or ``%Y-%m-%dT%H:%M:%S``).
+"""
+from simulator import SimulatedExchange
+from snapshot import BlockSnapshot
+from assetcache import AssetCache
+from bot import BlockScheduler
+from contextlib import redirect_stdout
+import multiprocessing
+import importlib
+import itertools
+import calendar
+import gzip
+import json
+import time
+import sys
+import os
+
+
+class BacktestConfig():
+    """ Configuration handed to the strategy in a backtest
+    """
+
+    def __init__(self, name, settings, separator=" : ",
+                 batch_transactions=False):
+        self.market_separator = separator
+        self.safe_mode = False
+        self.batch_transactions = batch_transactions
+        self.bots = {name: settings}
+
+
+def load_events(filename):
+    """ Load the market data events of a (gzipped) JSON lines file
+    """
+    opener = gzip.open if filename.endswith(".gz") else open
+    events = []
+    with opener(filename, "rt") as fp:
+        for line in fp:
+            line = line.strip()
+            if not line:
+                continue
+            event = json.loads(line)
+            if isinstance(event["time"], str):
+                event["time"] = calendar.timegm(time.strptime(event["time"], "%Y-%m-%dT%H:%M:%S"))
+            events.append(event)
+    return events
+
+
+def blocks(events, block_interval=3):
+    """ Group the events into blocks of ``block_interval`` seconds
+
+        :return: ``(block_number, time, events)`` for every block from
+                 the first to the last event (including empty blocks)
+    """
+    if not events:
+        return
+    first = int(events[0]["time"] // block_interval)
+    last = int(events[-1]["time"] // block_interval)
+    i = 0
+    for number in range(first, last + 1):
+        block_events = []
+        while i < len(events) and events[i]["time"] < (number + 1) * block_interval:
+            block_events.append(events[i])
+            i += 1
+        yield number, number * block_interval, block_events
+
+
+class Backtest():
+    """ Replays market data through a single strategy
+
+        :param class strategy: The strategy (subclass of ``BaseStrategy``)
+        :param dict settings: Settings of the bot (as in ``config.bots``)
+        :param dict assets: Assets of the simulation (see
+                            ``SimulatedExchange``)
+        :param dict balances: Initial balances of the account
+        :param list events: Market data events ordered by time
+        :param bool quiet: Suppress the output of the strategy
+        :param bool batch_transactions: Let the strategy batch its
+                                        operations (see ``config.py``)
+
+        The strategy ticks every ``skip_blocks`` blocks (with the
+        offsets of ``BlockScheduler``) but never waits for the next
+        block, so the replay runs as fast as the strategy allows.
+    """
+
+    name = "backtest"
+
+    def __init__(self, strategy, settings, assets, balances, events,
+                 block_interval=3, quiet=True, batch_transactions=False):
+        self.strategy = strategy
+        self.settings = settings
+        self.assets = assets
+        self.balances = balances
+        self.events = events
+        self.block_interval = block_interval
+        self.quiet = quiet
+        self.batch_transactions = batch_transactions
+
+    def run(self):
+        """ Run the backtest
+
+            :return: Statistics of the run (see ``result()``)
+            :rtype: dict
+        """
+        if self.quiet:
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                return self._run()
+        return self._run()
+
+    def _run(self):
+        settings = dict(self.settings)
+        # The simulated account may trade
+        settings.setdefault("replace_orders", True)
+        dex = SimulatedExchange(self.assets, settings["markets"], self.balances)
+        config = BacktestConfig(self.name, settings,
+                                batch_transactions=self.batch_transactions)
+        started = time.time()
+        ticks = 0
+        start_value = None
+        bot = None
+        scheduler = None
+        for number, timestamp, events in blocks(self.events, self.block_interval):
+            dex.advance(number, timestamp, events)
+            if bot is None:
+                # Wait for prices before the strategy starts
+                if any(t["last"] <= 0 for t in dex.returnTicker().values()):
+                    continue
+                bot = self.strategy(config=config, name=self.name, dex=dex,
+                                    index=0, assets=AssetCache(dex),
+                                    filename=None)
+                bot.setSnapshot(BlockSnapshot(dex, dex.block()))
+                start_value = dex.value()
+                bot.beginBatch()
+                bot.init()
+                bot.commitBatch()
+                bot.store()
+                scheduler = BlockScheduler({self.name: bot})
+                continue
+            if self.name in scheduler.due(number):
+                bot.setSnapshot(BlockSnapshot(dex, dex.block()))
+                bot.loadMarket()
+                bot.beginBatch()
+                bot.tick()
+                bot.commitBatch()
+                bot.store()
+                ticks += 1
+        return self.result(dex, start_value, ticks, time.time() - started)
+
+    def result(self, dex, start_value, ticks, duration):
+        """ Statistics of a run: ticks, fills and traded volume of the
+            account, value of the account (in the core asset) at the
+            start and the end, and the runtime in seconds
+        """
+        end_value = dex.value() if start_value is not None else None
+        return {
+            "ticks": ticks,
+            "fills": len(dex.account_fills),
+            "volume": sum(f["amount"] for f in dex.account_fills),
+            "orders": dex.order_count,
+            "start_value": start_value,
+            "end_value": end_value,
+            "profit": end_value - start_value if start_value is not None else None,
+            "balances": {s: a for s, a in dex.balances.items() if a},
+            "duration": duration,
+        }
+
+
+_sweep = {}
+
+
+def _init_sweep(strategy, settings, assets, balances, events):
+    _sweep.update(strategy=strategy, settings=settings, assets=assets,
+                  balances=balances, events=events)
+
+
+def _run_sweep(parameters):
+    settings = dict(_sweep["settings"])
+    settings.update(parameters)
+    result = Backtest(_sweep["strategy"], settings, _sweep["assets"],
+                      _sweep["balances"], _sweep["events"]).run()
+    result["parameters"] = parameters
+    return result
+
+
+def sweep(strategy, settings, grid, assets, balances, events, processes=None):
+    """ Backtest every combination of the settings in ``grid`` in
+        parallel
+
+        :param dict grid: Values to try per setting, e.g.
+                          ``{"spread_percentage": [1, 2, 3]}``
+        :param int processes: Number of worker processes (default: one
+                              per CPU)
+        :return: Results of all runs (with their ``parameters``), most
+                 profitable first
+        :rtype: list
+    """
+    keys = sorted(grid)
+    combinations = [dict(zip(keys, values))
+                    for values in itertools.product(*(grid[k] for k in keys))]
+    with multiprocessing.Pool(processes, _init_sweep,
+                              (strategy, settings, assets, balances, events)) as pool:
+        results = pool.map(_run_sweep, combinations)
+    return sorted(results, key=lambda r: r["profit"] if r["profit"] is not None else float("-inf"),
+                  reverse=True)
+
+
+def load_strategy(path):
+    """ Import a strategy class given as ``module.Class``
+    """
+    module, name = path.rsplit(".", 1)
+    return getattr(importlib.import_module(module), name)
+
+
+if __name__ == '__main__':
+    with open(sys.argv[1]) as fp:
+        spec = json.load(fp)
+    strategy = load_strategy(spec["strategy"])
+    events = load_events(spec["events"])
+    if spec.get("grid"):
+        results = sweep(strategy, spec["settings"], spec["grid"],
+                        spec["assets"], spec["balances"], events,
+                        spec.get("processes"))
+    else:
+        results = [Backtest(strategy, spec["settings"], spec["assets"],
+                            spec["balances"], events).run()]
+    print(json.dumps(results, indent=4, sort_keys=True))
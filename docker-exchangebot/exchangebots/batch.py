@@ -0,0 +1,177 @@
+from datetime import datetime
+import time
+
+
+class TransactionBatch():
+    """ Collects cancel, limit-order-create and call-order-update
+        operations and broadcasts them as a **single** transaction
+        using the builder-transaction calls of the cli_wallet.
+
+        :param GrapheneExchange dex: The exchange (provides ``rpc``,
+                                     ``myAccount``, ``market_separator``
+                                     and ``safe_mode``)
+        :param AssetCache assets: Asset metadata (ids and precisions)
+
+        If the transaction is rejected, every operation is broadcast on
+        its own to find out which operations failed. ``broadcast()``
+        reports the outcome of every operation.
+
+        .. code-block:: python
+
+            batch = TransactionBatch(dex, assets)
+            batch.cancel("1.7.1234")
+            batch.sell("USD : BTS", 310.0, 10)
+            batch.buy("USD : BTS", 290.0, 10)
+            for result in batch.broadcast():
+                print(result["operation"], result["error"])
+
+        Since the operations are only executed on ``broadcast()``, the
+        batch keeps track of the balance changes the pending operations
+        will cause (see ``balance_deltas``).
+    """
+
+    #: Graphene operation ids
+    limit_order_create = 1
+    limit_order_cancel = 2
+    call_order_update = 3
+
+    #: Asset used to pay the fees
+    fee_asset = "1.3.0"
+
+    def __init__(self, dex, assets):
+        self.dex = dex
+        self.assets = assets
+        self.operations = []
+        #: Change of the free balance per asset once the batch is executed
+        self.balance_deltas = {}
+
+    def __len__(self):
+        return len(self.operations)
+
+    def _amount(self, amount, symbol):
+        asset = self.assets.get_asset(symbol)
+        return {"amount": int(amount * 10 ** asset["precision"]),
+                "asset_id": asset["id"]}
+
+    def _add(self, op_id, op, description, deltas):
+        op["fee"] = {"amount": 0, "asset_id": self.fee_asset}
+        op["extensions"] = []
+        self.operations.append({"op": [op_id, op],
+                                "description": description})
+        for symbol, delta in deltas.items():
+            self.balance_deltas[symbol] = self.balance_deltas.get(symbol, 0) + delta
+
+    def _expiration(self, secs):
+        return datetime.utcfromtimestamp(time.time() + int(secs)).strftime('%Y-%m-%dT%H:%M:%S')
+
+    def sell(self, market, price, amount, expiration=60 * 60 * 24):
+        """ Add a sell order (sell ``amount`` of quote at ``price`` base
+            per quote)
+        """
+        quote, base = market.split(self.dex.market_separator)
+        self._add(self.limit_order_create, {
+            "seller": self.dex.myAccount["id"],
+            "amount_to_sell": self._amount(amount, quote),
+            "min_to_receive": self._amount(amount * price, base),
+            "expiration": self._expiration(expiration),
+            "fill_or_kill": False,
+        }, "sell %f %s @%f %s/%s" % (amount, quote, price, base, quote),
+            {quote: -amount})
+
+    def buy(self, market, price, amount, expiration=60 * 60 * 24):
+        """ Add a buy order (buy ``amount`` of quote at ``price`` base
+            per quote)
+        """
+        quote, base = market.split(self.dex.market_separator)
+        self._add(self.limit_order_create, {
+            "seller": self.dex.myAccount["id"],
+            "amount_to_sell": self._amount(amount * price, base),
+            "min_to_receive": self._amount(amount, quote),
+            "expiration": self._expiration(expiration),
+            "fill_or_kill": False,
+        }, "buy %f %s @%f %s/%s" % (amount, quote, price, base, quote),
+            {base: -amount * price})
+
+    def cancel(self, orderNumber, release=None):
+        """ Add the cancelation of an order
+
+            :param str orderNumber: The order id (``1.7.x``)
+            :param json release: (optional) funds that are freed by the
+                                 cancelation, e.g. ``{"BTS": 1000}``
+        """
+        self._add(self.limit_order_cancel, {
+            "fee_paying_account": self.dex.myAccount["id"],
+            "order": orderNumber,
+        }, "cancel %s" % orderNumber, release or {})
+
+    def borrow(self, amount, symbol, collateral_ratio, settlement_price):
+        """ Add a debt position update that borrows ``amount`` of
+            ``symbol`` at ``collateral_ratio``
+
+            :param float amount: Amount to borrow (denoted in ``symbol``)
+            :param str symbol: Asset to borrow
+            :param float collateral_ratio: Collateral ratio to borrow at
+            :param float settlement_price: Feed price denoted in the
+                                           backing asset per ``symbol``
+        """
+        backing = self.assets.get_asset(self.assets.backing_asset_id(symbol))
+        collateral = amount * collateral_ratio * settlement_price
+        self._add(self.call_order_update, {
+            "funding_account": self.dex.myAccount["id"],
+            "delta_collateral": self._amount(collateral, backing["symbol"]),
+            "delta_debt": self._amount(amount, symbol),
+        }, "borrow %f %s" % (amount, symbol),
+            {symbol: amount, backing["symbol"]: -collateral})
+
+    def _broadcast(self, operations):
+        """ Build, sign and broadcast one transaction
+        """
+        rpc = self.dex.rpc
+        handle = rpc.begin_builder_transaction()
+        try:
+            for operation in operations:
+                rpc.add_operation_to_builder_transaction(handle, operation["op"])
+            rpc.set_fees_on_builder_transaction(handle, self.fee_asset)
+            return rpc.sign_builder_transaction(handle, not self.dex.safe_mode)
+        finally:
+            try:
+                rpc.remove_builder_transaction(handle)
+            except Exception:
+                pass
+
+    def broadcast(self, isolate=True):
+        """ Broadcast all operations and empty the batch
+
+            :param bool isolate: If the transaction is rejected, find the
+                                 failing operations (otherwise the error
+                                 is raised)
+            :return: One result per operation with keys ``operation``
+                     (description) and ``error`` (``None`` on success)
+            :rtype: list
+        """
+        operations, self.operations = self.operations, []
+        self.balance_deltas = {}
+        if not operations:
+            return []
+        try:
+            self._broadcast(operations)
+            return [{"operation": o["description"], "error": None}
+                    for o in operations]
+        except Exception as e:
+            if not isolate:
+                raise
+            if len(operations) == 1:
+                return [{"operation": operations[0]["description"],
+                         "error": str(e)}]
+
+        # Find out which operations failed
+        results = []
+        for operation in operations:
+            try:
+                self._broadcast([operation])
+                results.append({"operation": operation["description"],
+                                "error": None})
+            except Exception as e:
+                results.append({"operation": operation["description"],
+                                "error": str(e)})
+        return results
@@ -0,0 +1,284 @@
+""" Benchmark the block cycle (``loadMarket()``, ``tick()``, ``store()``)
+    of the strategies against the simulated exchange
+
+    .. code-block:: sh
+
+        python benchmark.py --markets 1,10,100,500 --orders 20 --fills 5 \\
+                            --output benchmark.json
+
+    Scenarios:
+
+    * ``walls``: ``LiquiditySellBuyWalls`` serving all markets, ``fills``
+      trades per market and block are added to the fill history
+    * ``collateral``: ``MaintainCollateralRatio`` serving all markets and
+      owning ``orders`` open orders per market of which ``fills`` are
+      filled (and replaced) every block
+
+    The results are written as JSON so that runs of different commits
+    can be compared.
+"""
+from simulator import SimulatedExchange
+from snapshot import BlockSnapshot
+from assetcache import AssetCache
+from backtest import BacktestConfig
+from strategies.liquidity_wall import LiquiditySellBuyWalls
+from strategies.maintain_collateral_ratio import MaintainCollateralRatio
+from contextlib import redirect_stdout
+from collections import Counter
+from datetime import datetime
+import subprocess
+import tracemalloc
+import argparse
+import platform
+import random
+import json
+import time
+import sys
+import os
+
+
+class CallCounter():
+    """ Proxy that counts the (public) method calls made on an object
+        and the objects returned by its ``rpc`` and ``ws`` attributes
+    """
+
+    def __init__(self, target, calls=None, prefix=""):
+        self._target = target
+        self._calls = calls if calls is not None else Counter()
+        self._prefix = prefix
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if name in ("rpc", "ws"):
+            return CallCounter(value, self._calls, name + ".")
+        if not callable(value) or name.startswith("_"):
+            return value
+        key = self._prefix + name
+
+        def call(*args, **kwargs):
+            self._calls[key] += 1
+            return value(*args, **kwargs)
+        return call
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def summarize(values):
+    return {"mean": sum(values) / len(values) if values else None,
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "max": max(values) if values else None}
+
+
+class Scenario():
+    """ A strategy serving ``markets`` markets on the simulated exchange
+
+        :param str name: ``walls`` or ``collateral``
+        :param int markets: Number of markets
+        :param int orders: Open orders per market (``collateral``)
+        :param int fills: Fills per market and block
+        :param int blocks: Number of blocks to measure
+    """
+
+    price = 300.0
+    base = "BTS"
+
+    def __init__(self, name, markets, orders, fills, blocks, seed=1):
+        self.name = name
+        self.markets = markets
+        self.orders = orders
+        self.fills = fills
+        self.blocks = blocks
+        self.random = random.Random(seed)
+        self.symbols = ["BENCH%d" % i for i in range(markets)]
+        self.market_names = ["%s : %s" % (s, self.base) for s in self.symbols]
+
+    def settings(self):
+        settings = {"markets": self.market_names, "skip_blocks": 1}
+        if self.name == "walls":
+            settings.update({
+                "borrow": False,
+                "borrow_percentages": {s: 0 for s in self.symbols},
+                "minimum_amounts": {s: 0.001 for s in self.symbols},
+                "target_price": {"filled_orders": 2, "last": 1, "feed": 1, "gap": 0.1},
+                "spread_percentage": 2,
+                "allowed_spread_percentage": 1,
+                "volume_percentage": 50,
+                "ratio": 2.5,
+                "filled_order_age": 60 * 60,
+                "time_weight_factor": 0.2,
+                "minimum_volume": 1,
+                "replace_orders": True,
+            })
+            return settings, LiquiditySellBuyWalls
+        settings.update({"target_ratio": 2.5, "lower_threshold": 2.0,
+                         "upper_threshold": 3.0})
+        return settings, MaintainCollateralRatio
+
+    def setup(self):
+        assets = {self.base: {"precision": 5}}
+        assets.update({s: {"precision": 4, "backing_asset": self.base} for s in self.symbols})
+        balances = {self.base: 10.0 ** 9}
+        balances.update({s: 10.0 ** 4 for s in self.symbols})
+        dex = SimulatedExchange(assets, self.market_names, balances, history_size=max(100, self.fills * 100))
+        now = time.time()
+        dex.advance(0, now, [{"type": "feed", "market": m, "settlement_price": self.price}
+                             for m in self.market_names])
+        for symbol in self.symbols:
+            dex.borrow(1, symbol, 2.5)
+        return dex
+
+    def place(self, dex, bot, market, count):
+        """ Place ``count`` orders for ``bot`` far away from the price
+        """
+        for _ in range(count):
+            oid = dex.sell(market, self.price * self.random.uniform(10, 20), 0.01)
+            bot.orders.add(market, oid)
+
+    def events(self, dex):
+        events = []
+        for market in self.market_names:
+            for _ in range(self.fills):
+                price = self.price * self.random.uniform(0.99, 1.01)
+                events.append({"type": "trade", "market": market, "price": price,
+                               "amount": self.random.uniform(0.1, 1),
+                               "side": self.random.choice(["buy", "sell"])})
+            if self.name == "collateral" and self.fills:
+                # Fill some of the orders of the bot
+                orders = [o for o in dex.orders.values() if o["market"] == market]
+                for o in self.random.sample(orders, min(self.fills, len(orders))):
+                    events.append({"type": "trade", "market": market, "price": o["rate"],
+                                   "amount": o["amount"], "side": "buy"})
+        return events
+
+    def run(self, measure_memory=False):
+        """ Run the scenario
+
+            :param bool measure_memory: Trace the allocations (slows the
+                                        run down, timings are not
+                                        representative)
+        """
+        dex = self.setup()
+        calls = Counter()
+        proxy = CallCounter(dex, calls)
+        settings, strategy = self.settings()
+        name = self.name
+        config = BacktestConfig(name, settings, batch_transactions=True)
+        bot = strategy(config=config, name=name, dex=proxy, index=0,
+                       assets=AssetCache(proxy), filename=None)
+        for market in self.market_names:
+            if self.name == "collateral":
+                self.place(dex, bot, market, self.orders)
+            dex.trade(market, self.price, 1)
+
+        bot.setSnapshot(BlockSnapshot(proxy, dex.block()))
+        bot.init()
+        bot.store()
+
+        phases = {"snapshot": [], "loadMarket": [], "tick": [], "store": [], "block": []}
+        rpc = []
+        allocated = []
+        if measure_memory:
+            tracemalloc.start()
+        for number in range(1, self.blocks + 1):
+            dex.advance(number, time.time(), self.events(dex))
+            calls.clear()
+            blocks_before = sys.getallocatedblocks()
+
+            start = time.perf_counter()
+            bot.setSnapshot(BlockSnapshot(proxy, dex.block()))
+            t1 = time.perf_counter()
+            bot.loadMarket()
+            t2 = time.perf_counter()
+            bot.beginBatch()
+            bot.tick()
+            bot.commitBatch()
+            t3 = time.perf_counter()
+            bot.store()
+            t4 = time.perf_counter()
+
+            phases["snapshot"].append(t1 - start)
+            phases["loadMarket"].append(t2 - t1)
+            phases["tick"].append(t3 - t2)
+            phases["store"].append(t4 - t3)
+            phases["block"].append(t4 - start)
+            allocated.append(sys.getallocatedblocks() - blocks_before)
+            rpc.append(dict(calls))
+
+            if self.name == "collateral":
+                # Keep the number of open orders constant
+                for market in self.market_names:
+                    missing = self.orders - len(bot.orders.ids(market))
+                    self.place(dex, bot, market, missing)
+
+        result = {"scenario": self.name, "markets": self.markets,
+                  "orders": self.orders, "fills": self.fills,
+                  "blocks": self.blocks}
+        if measure_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            result["peak_memory"] = peak
+            #: Change of the number of allocated memory blocks per block
+            result["allocated_blocks_per_block"] = summarize(allocated)
+            return result
+        methods = sorted(set(m for r in rpc for m in r))
+        result["seconds_per_block"] = {phase: summarize(values) for phase, values in phases.items()}
+        result["rpc_per_block"] = {m: sum(r.get(m, 0) for r in rpc) / len(rpc) for m in methods}
+        return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def run(scenarios, markets, orders, fills, blocks):
+    """ Run all combinations of scenarios and market counts
+
+        :return: Results with the timings, RPC calls and memory usage
+                 of every combination
+        :rtype: dict
+    """
+    results = []
+    for name in scenarios:
+        for count in markets:
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                result = Scenario(name, count, orders, fills, blocks).run()
+                result.update(Scenario(name, count, orders, fills, blocks).run(measure_memory=True))
+            print("%s | %s with %d markets: %.4fs per block" % (
+                datetime.now(), name, count, result["seconds_per_block"]["block"]["mean"]),
+                file=sys.stderr)
+            results.append(result)
+    return {"revision": git_revision(),
+            "python": platform.python_version(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()),
+            "results": results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the bots' block cycle")
+    parser.add_argument("--scenarios", default="walls,collateral")
+    parser.add_argument("--markets", default="1,10,100,500")
+    parser.add_argument("--orders", type=int, default=20)
+    parser.add_argument("--fills", type=int, default=5)
+    parser.add_argument("--blocks", type=int, default=20)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    report = run(args.scenarios.split(","),
+                 [int(m) for m in args.markets.split(",")],
+                 args.orders, args.fills, args.blocks)
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=4, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=4, sort_keys=True))
@@ -1,10 +1,37 @@
 from grapheneapi.graphenewsprotocol import GrapheneWebsocketProtocol
 from grapheneexchange import GrapheneExchange
+from snapshot import BlockSnapshot
+from assetcache import AssetCache
+from ledger import AccountLedger
+from router import NotificationRouter
+from orderbook import OrderBooks
+from metrics import Metrics
+from profiler import BlockProfiler
+from cassette import CassetteRecorder, Recording, ReplayExchange
+from startup import StartupTimer, prefetch_markets, wait_for
+from nodepool import NodePool, RoutedWebsocket
+from bulkcancel import BulkCancel
+from fillstore import FillStore
+from logger import get_logger
+import json
 import time
 
 config = None
 bots = {}
 dex = None
+snapshot = None
+assets = None
+ledger = None
+router = None
+books = None
+scheduler = None
+metrics = None
+profiler = None
+cassette = None
+pool = None
+fill_store = None
+log = get_logger("bot")
+stream = None
 
 
 class BotProtocol(GrapheneWebsocketProtocol):
@@ -13,40 +40,224 @@ class BotProtocol(GrapheneWebsocketProtocol):
     """
 
     def onAccountUpdate(self, data):
-        """ If the account updates, reload every market
+        """ If an object of the account (see ``onMessage()``) updates,
+            mark the bots serving the affected markets for a reload on
+            the next block
         """
-        print("Account Update! Notifying bots:")
-        for name in bots:
-            print(" - %s" % name)
-            bots[name].loadMarket()
-            bots[name].store()
+        if cassette:
+            cassette.event("account", data)
+        router.route_account(data)
 
     def onMarketUpdate(self, data):
-        """ If a Market updates upgrades, reload every market
+        """ If a Market updates, mark the bots serving that market for a
+            reload on the next block
         """
-        print("Market Update! Notifying bots:")
-        for name in bots:
-            print(" - %s" % name)
-            bots[name].loadMarket()
-            bots[name].store()
+        if cassette:
+            cassette.event("market", data)
+        if books:
+            books.update(data)
+        router.route_market(data)
+
+    def onMarketDelta(self, data):
+        """ Removed orders and fills of the market subscriptions (see
+            ``onMessage()``)
+        """
+        if cassette:
+            cassette.event("market_delta", data)
+        if books:
+            books.apply(data)
+        for item in data:
+            if isinstance(item, str):
+                router.route_removed(item)
+
+    def onAssetUpdate(self, data):
+        """ Hand new settlement prices to the bots that watch the
+            collateral of their markets
+        """
+        if cassette:
+            cassette.event("asset", data)
+        router.route_asset(data)
+
+    def onMessage(self, payload, isBinary):
+        """ ``GrapheneWebsocketProtocol`` only dispatches the objects of
+            a notification and only the account objects (``1.2.x`` and
+            ``2.6.x``) of an account. The removed objects and the fills
+            of the subscriptions are handed to ``onMarketDelta()`` and
+            the limit orders (``1.7.x``), call orders (``1.8.x``) and
+            balances (``2.5.x``) of the account to ``onAccountUpdate()``
+            first, so that only the bots of the affected markets are
+            reloaded. Notices are parsed once and dispatched here,
+            everything else (the answers to the calls of the
+            subscriptions) is left to ``GrapheneWebsocketProtocol``.
+        """
+        res = json.loads(payload.decode('utf8'))
+        if "error" in res or res.get("method") != "notice":
+            return super().onMessage(payload, isBinary)
+        items = [item for items in res["params"][1] if isinstance(items, list)
+                 for item in items]
+        delta = [item for item in items if not isinstance(item, dict)]
+        if delta:
+            self.onMarketDelta(delta)
+        account = dex.myAccount["id"]
+        for item in items:
+            if isinstance(item, dict) and account in (item.get("seller"), item.get("borrower"),
+                                                      item.get("owner")):
+                self.onAccountUpdate(item)
+        # As in ``GrapheneWebsocketProtocol.onMessage()``
+        notices = [notice for notice in res["params"][1][0] if "id" in notice]
+        for notice in notices:
+            self.setObject(notice["id"], notice)
+        for notice in notices:
+            self.dispatchNotice(notice)
 
     def onBlock(self, data) :
         """ Every block let the bots know via ``tick()``
         """
-        for name in bots:
-            bots[name].loadMarket()
-            bots[name].tick()
-            bots[name].store()
+        if cassette:
+            cassette.event("block", data)
+        process_block(data)
+
+    def onOpen(self):
+        """ Remember the connection of the subscriptions so that it can
+            be closed if its witness node falls behind
+        """
+        global stream
+        stream = self
+        super().onOpen()
+
+    def onClose(self, wasClean, code, reason):
+        """ Resubscribe on the best witness node of the pool (once
+            ``run_forever()`` reconnects)
+        """
+        global stream
+        stream = None
+        if books:
+            # The notifications until the resubscription are lost
+            books.invalidate()
+        if pool:
+            url = pool.best().url
+            if url != dex.ws.url:
+                log.warning("Switching the subscriptions to %s", url)
+                dex.ws.switch(url)
+        super().onClose(wasClean, code, reason)
 
     def onRegisterDatabase(self):
-        print("Websocket successfully iInitialized!")
+        """ Load the order books again right before the markets are
+            subscribed (on the first connection and after every
+            reconnect)
+        """
+        log.info("Websocket successfully iInitialized!")
+        # The notifications since the last connection are lost
+        router.touch_all()
+        if books:
+            reseed_books()
+
+
+class BlockScheduler():
+    """ Decides which bots tick in which block
+
+        :param dict bots: The bots (``{name: strategy}``)
+        :param float tick_budget: Seconds the ticks of one block may take
+                                  before the remaining ticks are deferred
+                                  to the next block
+        :param float max_block_age: Blocks that are older than this (in
+                                    seconds) when they are processed are
+                                    considered stale and not ticked
+                                    (``None`` ticks all blocks)
+
+        A bot ticks every ``skip_blocks`` blocks (setting of the bot).
+        Bots with the same ``skip_blocks`` are spread across different
+        block offsets so that their work does not land in the same
+        block. Ticks that are missed (skipped block numbers, stale blocks
+        or ticks deferred because the budget was exhausted) are coalesced
+        into a single tick in the next block that is processed. All bots
+        are due in the first block (their first tick after ``init()``).
+    """
+
+    def __init__(self, bots, tick_budget=2.0, max_block_age=6):
+        self.bots = bots
+        self.tick_budget = tick_budget
+        self.max_block_age = max_block_age
+        self.last_block = None
+        #: Bots that are due but have not ticked yet
+        self.pending = []
+        #: Number of ticks per bot that exceeded ``tick_budget``
+        self.overruns = {name: 0 for name in bots}
+        #: Number of ticks that were deferred to the next block
+        self.deferred = 0
+        #: Number of stale blocks that were not ticked
+        self.stale_blocks = 0
+
+        self.offsets = {}
+        groups = {}
+        for name in bots:
+            groups.setdefault(self.skip_blocks(name), []).append(name)
+        for skip, names in groups.items():
+            for i, name in enumerate(names):
+                self.offsets[name] = i % skip
+
+    def skip_blocks(self, name):
+        return max(1, int(self.bots[name].settings.get("skip_blocks", 1)))
+
+    def due(self, block_number):
+        """ Return the names of the bots that are due in ``block_number``
+            (including the ticks missed since the last processed block)
+        """
+        if self.last_block is None:
+            self.last_block = block_number
+            return list(self.bots)
+        if block_number <= self.last_block:
+            missed = 0
+        else:
+            missed = block_number - self.last_block - 1
+        self.last_block = block_number
+
+        due = list(self.pending)
+        for name in self.bots:
+            if name in due:
+                continue
+            # Is any block in [block_number - missed, block_number] due?
+            if (block_number - self.offsets[name]) % self.skip_blocks(name) <= missed:
+                due.append(name)
+        return due
+
+    def run(self, block_number, block_time, tick):
+        """ Call ``tick(name)`` for every bot that is due in this block
+
+            :param int block_number: Number of the block
+            :param float block_time: Timestamp of the block
+            :param function tick: Executes the tick of a single bot
+        """
+        due = self.due(block_number)
+        self.pending = []
+
+        if self.max_block_age and time.time() - block_time > self.max_block_age:
+            self.stale_blocks += 1
+            self.pending = due
+            log.warning("Block %d is stale, deferring %d ticks", block_number, len(due))
+            return
+
+        start = time.time()
+        for i, name in enumerate(due):
+            if time.time() - start > self.tick_budget:
+                self.pending = due[i:]
+                self.deferred += len(self.pending)
+                log.warning("Tick budget exhausted in block %d, deferring %s", block_number, ", ".join(self.pending))
+                return
+            tick_start = time.time()
+            tick(name)
+            duration = time.time() - tick_start
+            if duration > self.tick_budget:
+                self.overruns[name] += 1
+                log.warning("Tick of %s took %.2fs (%d overruns)", name, duration, self.overruns[name],
+                            extra={"bot": name, "duration": duration})
 
 
 def init(conf, **kwargs):
     """ Initialize the Bot Infrastructure and setup connection to the
         network
     """
-    global dex, bots, config
+    global dex, bots, config, assets, ledger, router, books, scheduler, metrics, profiler, cassette, pool, fill_store
 
     botProtocol = BotProtocol
 
@@ -57,53 +268,261 @@ def init(conf, **kwargs):
     # within the configuration file!
     [setattr(botProtocol, key, conf.__dict__[key]) for key in conf.__dict__.keys()]
 
-    # Additionally store the whole configuration
+    # Subscribe to the assets of the bots that watch the collateral to
+    # receive their settlement prices (``onAssetUpdate()``)
+    if not hasattr(conf, "watch_assets"):
+        watch_assets = set()
+        for settings in conf.bots.values():
+            if settings["bot"].watch_collateral:
+                for market in settings["markets"]:
+                    watch_assets.update(market.split(conf.market_separator))
+        if watch_assets:
+            botProtocol.watch_assets = sorted(watch_assets)
+
+    # Additionally store the whole configuration (the entry points set
+    # up the logging, see ``logger.setup()``)
     config = conf
+    timer = StartupTimer()
+    timeout = getattr(config, "startup_timeout", 120)
 
-    # Connect to the DEX
-    dex    = GrapheneExchange(botProtocol, safe_mode=config.safe_mode)
+    cassette_mode = getattr(config, "cassette_mode", None)
 
-    if dex.rpc.is_locked():
-        raise Exception("Your wallet is LOCKED! Please unlock it manually!")
+    # Send the calls to the fastest of several witness nodes and
+    # subscribe on it
+    witness_urls = getattr(config, "witness_urls", None)
+    if witness_urls and cassette_mode != "replay":
+        with timer.phase("nodes"):
+            pool = NodePool(witness_urls,
+                            user=getattr(config, "witness_user", ""),
+                            password=getattr(config, "witness_password", ""),
+                            timeout=getattr(config, "node_timeout", 5),
+                            max_lag=getattr(config, "node_max_lag", 3),
+                            probe_interval=getattr(config, "node_probe_interval", 30))
+            wait_for(pool.ready, "the witness nodes", timeout)
+            botProtocol.witness_url = pool.best().url
+            log.info("Witness nodes: %s", pool.status())
+
+    # Connect to the DEX (or replay a recorded session without network)
+    # as soon as the wallet and the witness node accept connections
+    with timer.phase("connect"):
+        if cassette_mode == "replay":
+            dex = ReplayExchange(botProtocol, config.cassette,
+                                 getattr(config, "cassette_strict", False))
+        else:
+            dex = wait_for(lambda: GrapheneExchange(botProtocol, safe_mode=config.safe_mode),
+                           "the wallet and the witness node", timeout)
+        if pool:
+            dex.ws = RoutedWebsocket(dex.ws, pool)
+            pool.start()
+
+    # Profile the next blocks on SIGUSR1 (or right from the start)
+    profiler = BlockProfiler(getattr(config, "profile_dir", "profiles"),
+                             getattr(config, "profile_blocks", 10),
+                             getattr(config, "profile_mode", "deterministic"),
+                             getattr(config, "profile_interval", 0.005),
+                             getattr(config, "profile_min_share", 0.001))
+    profiler.install_signal()
+    if getattr(config, "profile_on_start", False):
+        profiler.enable()
+
+    # Record all calls to the wallet, the witness node and the exchange
+    metrics = Metrics(getattr(config, "metrics_payload_size", False))
+    dex = metrics.instrument_exchange(dex)
+    if getattr(config, "metrics_port", None):
+        metrics.serve(config.metrics_port,
+                      getattr(config, "metrics_host", "127.0.0.1"))
+
+    # Record the calls of the bots (outside of the metrics so that the
+    # recording does not show up in the latencies)
+    if cassette_mode == "record":
+        cassette = CassetteRecorder(config.cassette, dex)
+        dex = Recording(dex, cassette)
+
+    with timer.phase("wallet"):
+        if dex.rpc.is_locked():
+            raise Exception("Your wallet is LOCKED! Please unlock it manually!")
+
+    # Asset metadata shared by all bots (and persisted across restarts).
+    # A cassette contains all asset lookups, so the cache starts empty
+    # and is not persisted while recording or replaying.
+    assets = AssetCache(dex,
+                        None if cassette_mode else getattr(config, "asset_cache", "assets.json"),
+                        getattr(config, "asset_cache_ttl", 60 * 60 * 24))
+
+    # Funds of the account shared by all bots
+    ledger = AccountLedger(config.market_separator,
+                           getattr(config, "ledger_reconcile_blocks", 100))
+
+    # Fills of all markets (persisted across restarts). A cassette only
+    # contains the fills of its session, so the store starts empty and
+    # is not persisted while recording or replaying.
+    if getattr(config, "fill_store", None):
+        fill_store = FillStore(":memory:" if cassette_mode else config.fill_store,
+                               getattr(config, "fill_store_retention", 60 * 60 * 24 * 30),
+                               getattr(config, "fill_store_prune_interval", 60 * 60))
 
     # Initialize all bots
     for index, name in enumerate(config.bots, 1):
         botClass = config.bots[name]["bot"]
-        bots[name] = botClass(config=config, name=name,
-                              dex=dex, index=index)
-        # Maybe the strategy/bot has some additional customized
-        # initialized besides the basestrategy's __init__()
-        bots[name].init()
+        if cassette_mode == "replay":
+            # Start from the recorded state and leave the state files alone
+            bots[name] = botClass(config=config, name=name, dex=dex,
+                                  index=index, assets=assets, ledger=ledger,
+                                  fill_store=fill_store, filename=None)
+            bots[name].setFullState(dex.states.get(name, {"orders": {}}))
+        else:
+            bots[name] = botClass(config=config, name=name, dex=dex,
+                                  index=index, assets=assets, ledger=ledger,
+                                  fill_store=fill_store)
+        if cassette:
+            cassette.state(name, bots[name].getState())
 
+    # Load the assets of all markets at once instead of one lookup per
+    # asset while the router is set up and the bots verify their markets
+    with timer.phase("assets"):
+        prefetch_markets(assets, bots, config.market_separator)
+    router = NotificationRouter(bots, assets, config.market_separator)
 
-def wait_block():
-    """ This is sooo dirty! FIXIT!
+    # Keep the order books of all markets in memory instead of pulling
+    # the ticker of all markets on every block
+    if getattr(config, "order_books", False):
+        with timer.phase("books"):
+            markets = sorted(set(m for name in bots for m in bots[name].settings["markets"]))
+            books = OrderBooks(dex, assets, markets, config.market_separator,
+                               getattr(config, "order_book_depth", 100),
+                               getattr(config, "order_book_reseed_interval", 60 * 60))
+            books.seed()
+
+    # Write the verified markets to the asset cache once
+    with timer.phase("init"), assets.deferred():
+        new_snapshot()
+        for name in bots:
+            # Maybe the strategy/bot has some additional customized
+            # initialized besides the basestrategy's __init__()
+            with metrics.context(name):
+                bots[name].beginBatch()
+                bots[name].init()
+                bots[name].commitBatch()
+
+    # The bots' settings (``skip_blocks``) are complete after ``init()``
+    # Replayed blocks are old by definition
+    scheduler = BlockScheduler(bots,
+                               getattr(config, "tick_budget", 2.0),
+                               None if cassette_mode == "replay" else getattr(config, "max_block_age", 6))
+    timer.report()
+
+
+def process_block(data):
+    """ Tick the bots that are due in the block ``data`` (the block
+        notification, object ``2.1.0``)
     """
-    time.sleep(6)
+    global stream
+    with profiler.block("onBlock"):
+        if books and books.stale():
+            reseed_books()
+        new_snapshot(data)
+        # Bots touched by notifications since the last block
+        router.flush()
+
+        def tick(name):
+            with metrics.context(name), profiler.section("tick:%s" % name):
+                # Reload if a bot ticking before placed orders in the
+                # markets of this bot (``store()`` takes new orders
+                # from the market) or a notification arrived meanwhile.
+                # Without notifications (worker processes) every tick.
+                if router.take(name) or not getattr(config, "notifications", True):
+                    bots[name].loadMarket()
+                bots[name].beginBatch()
+                bots[name].tick()
+                bots[name].commitBatch()
+                bots[name].store()
+                router.touch(bots[name].settings["markets"], name)
+
+        scheduler.run(snapshot.block_number, snapshot.time, tick)
+
+        # Resubscribe on another node if the node of the subscriptions
+        # fell behind (see ``onClose()``)
+        if pool and stream and pool.lagging(dex.ws.url):
+            log.warning("Witness node %s is behind, reconnecting", dex.ws.url)
+            stream.sendClose()
+            stream = None
+
+        if fill_store:
+            with profiler.section("prune"):
+                fill_store.maybe_prune(snapshot.time)
+    metrics.maybe_summary(getattr(config, "metrics_summary_interval", 60))
+
+
+def reseed_books():
+    """ Load the order books again, on failure they stay stale and are
+        loaded on the next block
+    """
+    try:
+        with profiler.section("books"):
+            books.seed()
+    except Exception as e:
+        books.invalidate()
+        log.warning("Loading the order books failed: %s", e)
+
+
+def new_snapshot(block=None):
+    """ Take a new snapshot of the DEX and hand it to all bots so that
+        every dataset is only fetched once per block
+
+        :param json block: The block notification (optional)
+    """
+    global snapshot
+    snapshot = BlockSnapshot(dex, block, books)
+    for name in bots:
+        bots[name].setSnapshot(snapshot)
+    return snapshot
 
 
 def cancel_all():
     """ Cancel all orders of all markets that are served by the bots
+        at once (see ``BulkCancel``)
+
+        :rtype: CancelReport
     """
+    new_snapshot()
+    bulk = BulkCancel.configured(dex, assets, config)
+    for name in bots:
+        for market in bots[name].settings["markets"]:
+            for order in snapshot.open_orders.get(market, []):
+                bulk.add(order["orderNumber"])
+    report = bulk.run()
+    for orderNumber in report.canceled:
+        ledger.cancelled(orderNumber)
+
+    new_snapshot()
     for name in bots:
         bots[name].loadMarket(False)
-        bots[name].cancel_this_markets()
         bots[name].store()
+    return report
 
 
 def execute():
     """ Execute the core unit of the bot
     """
-    for name in bots:
-        print("Executing bot %s" % name)
-        bots[name].loadMarket()
-        bots[name].init()
-        bots[name].place_orders()
-        bots[name].store()
+    with profiler.block("execute"):
+        new_snapshot()
+        for name in bots:
+            log.info("Executing bot %s", name)
+            with profiler.section("tick:%s" % name):
+                bots[name].loadMarket()
+                bots[name].beginBatch()
+                bots[name].init()
+                bots[name].place_orders()
+                bots[name].commitBatch()
+                bots[name].store()
 
 
 def run():
     """ This call will run the bot in **continous mode** and make it
         receive notification from the network
     """
-    dex.run()
+    try:
+        dex.run()
+    finally:
+        if cassette:
+            cassette.close()
@@ -0,0 +1,178 @@
+from concurrent.futures import ThreadPoolExecutor
+from batch import TransactionBatch
+from logger import get_logger
+import time
+
+log = get_logger("cancel")
+
+
+class CancelReport():
+    """ Outcome of a ``BulkCancel``
+    """
+
+    def __init__(self):
+        #: Orders that have been canceled
+        self.canceled = []
+        #: Orders that were gone (filled or canceled elsewhere) before
+        #: they could be canceled
+        self.gone = []
+        #: Orders that could not be canceled (``{orderNumber: error}``)
+        self.failed = {}
+        #: ``(attempt, orders, seconds)`` per round
+        self.rounds = []
+        self.duration = 0
+
+    def __str__(self):
+        return "%d canceled, %d gone, %d failed in %.2fs (%s)%s" % (
+            len(self.canceled), len(self.gone), len(self.failed), self.duration,
+            ", ".join("round %d: %d orders %.2fs" % r for r in self.rounds),
+            "".join("\n  %s: %s" % f for f in sorted(self.failed.items())))
+
+
+class BulkCancel():
+    """ Cancels many orders as fast as possible
+
+        :param GrapheneExchange dex: The exchange
+        :param AssetCache assets: Asset metadata
+        :param int batch_size: Cancelations per transaction
+        :param int workers: Transactions broadcast at the same time
+        :param int retries: Rounds in which failed cancelations are
+                            repeated
+        :param float retry_delay: Seconds between two rounds
+
+        All orders are collected first (``add()``), ``run()`` then
+        broadcasts them in transactions of ``batch_size`` cancelations
+        (see ``TransactionBatch``), up to ``workers`` transactions at
+        the same time. If a transaction is rejected, the orders that no
+        longer exist are dropped (one ``get_objects`` call) and the rest
+        are broadcast again. Orders that still fail are repeated one per
+        transaction in up to ``retries`` further rounds.
+
+        Only the broadcasts (calls to the wallet) run on the worker
+        threads, the lookups on the websocket, which cannot be shared
+        between threads, are made by the calling thread between them.
+
+        .. code-block:: python
+
+            bulk = BulkCancel(dex, assets)
+            for order in orders:
+                bulk.add(order["orderNumber"])
+            report = bulk.run()
+            print(report)
+    """
+
+    def __init__(self, dex, assets, batch_size=50, workers=4, retries=2, retry_delay=0.5):
+        self.dex = dex
+        self.assets = assets
+        self.batch_size = max(1, batch_size)
+        self.workers = max(1, workers)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.orders = []
+        self._added = set()
+
+    @classmethod
+    def configured(cls, dex, assets, config):
+        """ Create a ``BulkCancel`` with the settings of the
+            configuration (``cancel_batch_size``, ``cancel_workers``,
+            ``cancel_retries`` and ``cancel_retry_delay``)
+        """
+        return cls(dex, assets,
+                   getattr(config, "cancel_batch_size", 50),
+                   getattr(config, "cancel_workers", 4),
+                   getattr(config, "cancel_retries", 2),
+                   getattr(config, "cancel_retry_delay", 0.5))
+
+    def __len__(self):
+        return len(self.orders)
+
+    def add(self, orderNumber):
+        """ Add an order (orders that are added twice are canceled once)
+        """
+        if orderNumber not in self._added:
+            self._added.add(orderNumber)
+            self.orders.append(orderNumber)
+
+    def _broadcast(self, orders):
+        batch = TransactionBatch(self.dex, self.assets)
+        for orderNumber in orders:
+            batch.cancel(orderNumber)
+        batch.broadcast(isolate=False)
+
+    def _existing(self, orders):
+        """ The orders that still exist on the chain
+        """
+        objects = self.dex.ws.get_objects(orders)
+        return [o for o, obj in zip(orders, objects) if obj]
+
+    def _try(self, orders):
+        """ Broadcast the cancelation of a chunk of orders (on a worker
+            thread)
+
+            :return: The error (``None`` on success)
+        """
+        try:
+            self._broadcast(orders)
+            return None
+        except Exception as e:
+            return str(e)
+
+    def _cancel(self, executor, chunks, report):
+        """ Cancel chunks of orders in parallel
+
+            :return: ``{orderNumber: error}`` of the orders that failed
+        """
+        errors = list(executor.map(self._try, chunks))
+        rejected = [(chunk, error) for chunk, error in zip(chunks, errors) if error]
+        report.canceled.extend(o for chunk, error in zip(chunks, errors) if not error for o in chunk)
+        if not rejected:
+            return {}
+        try:
+            existing = set(self._existing([o for chunk, _ in rejected for o in chunk]))
+        except Exception:
+            existing = set(o for chunk, _ in rejected for o in chunk)
+        failed = {}
+        retry = []
+        for chunk, error in rejected:
+            gone = [o for o in chunk if o not in existing]
+            rest = [o for o in chunk if o in existing]
+            report.gone.extend(gone)
+            if gone and rest:
+                retry.append(rest)
+            else:
+                failed.update((o, error) for o in rest)
+        for chunk, error in zip(retry, executor.map(self._try, retry)):
+            if error:
+                failed.update((o, error) for o in chunk)
+            else:
+                report.canceled.extend(chunk)
+        return failed
+
+    def run(self):
+        """ Cancel all orders
+
+            :rtype: CancelReport
+        """
+        report = CancelReport()
+        start = time.time()
+        pending = list(self.orders)
+        batch_size = self.batch_size
+        with ThreadPoolExecutor(self.workers) as executor:
+            for attempt in range(self.retries + 1):
+                if not pending:
+                    break
+                if attempt:
+                    time.sleep(self.retry_delay)
+                round_start = time.time()
+                chunks = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+                failed = self._cancel(executor, chunks, report)
+                report.rounds.append((attempt + 1, len(pending), time.time() - round_start))
+                pending = [o for o in pending if o in failed]
+                report.failed = failed
+                # Find the failing orders by canceling one per transaction
+                batch_size = 1
+        report.duration = time.time() - start
+        (log.warning if report.failed else log.info)(
+            "Bulk cancel: %s", report,
+            extra={"canceled": report.canceled, "gone": report.gone, "failed": report.failed})
+        return report
@@ -1,5 +1,11 @@
 import bot
 import config
+import logger
+import sys
 if __name__ == '__main__':
+    logger.setup(config)
     bot.init(config)
-    bot.cancel_all()
+    report = bot.cancel_all()
+    print(report)
+    if report.failed:
+        sys.exit(1)
@@ -0,0 +1,328 @@
+""" Record the traffic of the bots with the wallet and the witness node
+    and replay it without network
+
+    Set ``cassette`` and ``cassette_mode`` (``record`` or ``replay``) in
+    ``config.py`` or replay a cassette from the command line:
+
+    .. code-block:: sh
+
+        python cassette.py replay traffic.jsonl.gz
+        python cassette.py events traffic.jsonl.gz > events.jsonl
+
+    A cassette is a gzipped JSON lines file. The first line holds the
+    properties of the exchange, every further line is a notification
+    (``{"t": "event", "name": "block", "data": ...}``), a call with its
+    result (``{"t": "call", "m": "dex.returnTicker", "a": [...], "k":
+    {...}, "r": ...}`` or ``"e": error``) or the state a bot was started
+    with (``{"t": "state", "name": ..., "state": ...}``). Every line
+    carries the number of the last block (``b``). Both recording and
+    replay stream the file, only the calls since the last notification
+    are held in memory.
+"""
+from collections import deque
+from datetime import datetime
+import calendar
+import gzip
+import json
+import threading
+import time
+import sys
+
+
+def _dump(data):
+    return json.dumps(data, separators=(",", ":"), default=str)
+
+
+class CassetteRecorder():
+    """ Writes the calls made through ``Recording`` proxies and the
+        notifications to a cassette
+
+        :param str filename: The cassette
+        :param GrapheneExchange dex: The exchange (its properties are
+                                     stored in the header)
+    """
+
+    def __init__(self, filename, dex):
+        self.fp = gzip.open(filename, "wt")
+        self.block = None
+        # Calls may be recorded from several threads (``BulkCancel``)
+        self.lock = threading.Lock()
+        self._write({"t": "header",
+                     "myAccount": dex.myAccount,
+                     "market_separator": dex.market_separator,
+                     "safe_mode": dex.safe_mode})
+
+    def _write(self, record):
+        with self.lock:
+            record["b"] = self.block
+            self.fp.write(_dump(record) + "\n")
+
+    def event(self, name, data):
+        """ Record a notification (``block``, ``market``,
+            ``market_delta``, ``account`` or ``asset``)
+        """
+        if name == "block":
+            self.block = data.get("head_block_number")
+        self._write({"t": "event", "name": name, "data": data})
+        # Make the cassette usable up to the last block if the bot dies
+        if name == "block":
+            self.fp.flush()
+
+    def state(self, name, state):
+        """ Record the persisted state of a bot so that the replay does
+            not depend on the state files
+        """
+        self._write({"t": "state", "name": name, "state": state})
+
+    def call(self, method, args, kwargs, result=None, error=None):
+        record = {"t": "call", "m": method, "a": args, "k": kwargs}
+        if error is not None:
+            record["e"] = error
+        else:
+            record["r"] = result
+        self._write(record)
+
+    def close(self):
+        self.fp.close()
+
+
+class Recording():
+    """ Proxy that records every call made through it (and through its
+        ``rpc`` and ``ws`` attributes) in ``recorder``. Calls the
+        exchange makes internally are not recorded, only the ones the
+        bots make (including helpers such as ``_get_price_filled`` that
+        look up assets through the exchange).
+    """
+
+    #: Calls that run the websocket subsystem and never return
+    unrecorded = ["run", "connect", "run_forever"]
+
+    def __init__(self, target, recorder, prefix="dex."):
+        self._target = target
+        self._recorder = recorder
+        self._prefix = prefix
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if name in ("rpc", "ws"):
+            return Recording(value, self._recorder, name + ".")
+        if not callable(value) or name.startswith("__") or name in self.unrecorded:
+            return value
+        method = self._prefix + name
+        recorder = self._recorder
+
+        def call(*args, **kwargs):
+            try:
+                result = value(*args, **kwargs)
+            except Exception as e:
+                recorder.call(method, args, kwargs, error=str(e))
+                raise
+            recorder.call(method, args, kwargs, result=result)
+            return result
+        return call
+
+
+class ReplayError(Exception):
+    pass
+
+
+class ReplayMismatch(Exception):
+    pass
+
+
+class ReplayedCalls():
+    """ ``rpc``/``ws`` of a ``ReplayExchange`` """
+
+    def __init__(self, exchange, prefix):
+        self._exchange = exchange
+        self._prefix = prefix
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        method = self._prefix + name
+        return lambda *args, **kwargs: self._exchange._replay(method, args, kwargs)
+
+
+class ReplayExchange():
+    """ Serves the calls recorded in a cassette instead of connecting
+        to the network and delivers the recorded notifications on
+        ``run()``
+
+        :param BotProtocol protocol: Receives the notifications
+                                     (``onBlock``, ``onMarketUpdate``,
+                                     ``onAccountUpdate``)
+        :param str filename: The cassette
+        :param bool strict: Raise ``ReplayMismatch`` for calls whose
+                            arguments were not recorded
+
+        The cassette is read one notification at a time. A call is
+        answered with the first unanswered recorded call with the same
+        method and arguments since the last notification. If there is
+        none (e.g. an order price that depends on the current time), the
+        first unanswered call of the same method is used and the call is
+        counted in ``mismatches`` unless ``strict`` is set. Recorded
+        errors are raised as ``ReplayError``.
+    """
+
+    handlers = {"block": "onBlock", "market": "onMarketUpdate",
+                "market_delta": "onMarketDelta",
+                "account": "onAccountUpdate", "asset": "onAssetUpdate"}
+
+    def __init__(self, protocol, filename, strict=False):
+        self.protocol = protocol
+        self.strict = strict
+        self.fp = gzip.open(filename, "rt")
+        header = json.loads(self.fp.readline())
+        self.myAccount = header["myAccount"]
+        self.market_separator = header["market_separator"]
+        self.safe_mode = header["safe_mode"]
+        self.rpc = ReplayedCalls(self, "rpc.")
+        self.ws = ReplayedCalls(self, "ws.")
+        #: Persisted states of the bots when the recording started
+        self.states = {}
+        self.calls = {}
+        self.methods = {}
+        self.next_event = None
+        self.replayed_blocks = 0
+        self.mismatches = 0
+        # Calls made before the first notification (``bot.init()``)
+        self._load_segment()
+
+    def _key(self, method, args, kwargs):
+        return method + _dump([list(args), kwargs])
+
+    def _load_segment(self):
+        """ Load the calls up to the next notification
+        """
+        self.calls = {}
+        self.methods = {}
+        self.next_event = None
+        for line in self.fp:
+            record = json.loads(line)
+            if record["t"] == "event":
+                self.next_event = record
+                return
+            if record["t"] == "state":
+                self.states[record["name"]] = record["state"]
+                continue
+            record["used"] = False
+            self.calls.setdefault(self._key(record["m"], record["a"], record["k"]), deque()).append(record)
+            self.methods.setdefault(record["m"], deque()).append(record)
+
+    def _next(self, records):
+        while records and records[0]["used"]:
+            records.popleft()
+        return records.popleft() if records else None
+
+    def _replay(self, method, args, kwargs):
+        # Compare the arguments the way they were recorded (as JSON)
+        args, kwargs = json.loads(_dump([list(args), kwargs]))
+        record = self._next(self.calls.get(self._key(method, args, kwargs)))
+        if record is None:
+            if self.strict:
+                raise ReplayMismatch("%s%s was not recorded" % (method, _dump(args)))
+            record = self._next(self.methods.get(method))
+            if record is None:
+                raise ReplayMismatch("No call of %s was recorded" % method)
+            self.mismatches += 1
+        record["used"] = True
+        if "e" in record:
+            raise ReplayError(record["e"])
+        return record["r"]
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        method = "dex." + name
+        return lambda *args, **kwargs: self._replay(method, args, kwargs)
+
+    def run(self):
+        """ Deliver all notifications of the cassette
+        """
+        while self.next_event is not None:
+            event = self.next_event
+            self._load_segment()
+            getattr(self.protocol, self.handlers[event["name"]])(None, event["data"])
+            if event["name"] == "block":
+                self.replayed_blocks += 1
+        self.fp.close()
+
+
+def events(filename):
+    """ Turn the trades, tickers and price feeds recorded in a cassette
+        into market data events for ``SimulatedExchange`` (e.g. for
+        ``backtest.py``)
+
+        Trades are taken from the fill histories
+        (``ws.get_fill_order_history``), tickers and feeds from
+        ``dex.returnTicker`` at the time of the block they were recorded
+        in. The events are ordered by time.
+    """
+    assets = {}
+    seen = set()
+    now = None
+    last = 0
+    with gzip.open(filename, "rt") as fp:
+        separator = json.loads(fp.readline())["market_separator"]
+        for line in fp:
+            record = json.loads(line)
+            if record["t"] == "event" and record["name"] == "block":
+                now = calendar.timegm(time.strptime(record["data"]["time"], "%Y-%m-%dT%H:%M:%S"))
+            if record["t"] != "call" or "r" not in record:
+                continue
+            if record["m"] == "rpc.get_asset":
+                assets[record["r"]["id"]] = record["r"]
+            elif record["m"] == "dex.returnTicker" and now is not None:
+                last = max(last, now)
+                for market, ticker in record["r"].items():
+                    if ticker.get("highestBid", 0) > 0 and ticker.get("lowestAsk", 0) > 0:
+                        yield {"time": last, "type": "ticker", "market": market,
+                               "highestBid": ticker["highestBid"],
+                               "lowestAsk": ticker["lowestAsk"]}
+                    if ticker.get("settlement_price"):
+                        yield {"time": last, "type": "feed", "market": market,
+                               "settlement_price": ticker["settlement_price"]}
+            elif record["m"] == "ws.get_fill_order_history":
+                quote, base = assets.get(record["a"][0]), assets.get(record["a"][1])
+                if quote is None or base is None:
+                    continue
+                market = quote["symbol"] + separator + base["symbol"]
+                for fill in reversed(record["r"]):
+                    op = fill["op"]
+                    key = _dump(fill.get("key", op))
+                    # Every trade appears once for each side, use the seller of the quote
+                    if key in seen or op["pays"]["asset_id"] != quote["id"]:
+                        continue
+                    seen.add(key)
+                    amount = int(op["pays"]["amount"]) / 10 ** quote["precision"]
+                    if not amount:
+                        continue
+                    price = int(op["receives"]["amount"]) / 10 ** base["precision"] / amount
+                    # Fills show up in the history after the block they happened in
+                    last = max(last, calendar.timegm(time.strptime(fill["time"], "%Y-%m-%dT%H:%M:%S")))
+                    # The seller took the bids unless its order was the maker
+                    yield {"time": last, "type": "trade", "market": market,
+                           "price": price, "amount": amount,
+                           "side": "buy" if op.get("is_maker") else "sell"}
+
+
+if __name__ == '__main__':
+    command, filename = sys.argv[1], sys.argv[2]
+    if command == "events":
+        for event in events(filename):
+            print(_dump(event))
+    elif command == "replay":
+        import bot
+        import config
+        import logger
+        config.cassette = filename
+        config.cassette_mode = "replay"
+        logger.setup(config)
+        started = time.time()
+        bot.init(config)
+        bot.run()
+        duration = time.time() - started
+        print("%s | Replayed %d blocks in %.2fs (%.4fs per block)" % (
+            datetime.now(), bot.dex.replayed_blocks, duration,
+            duration / max(1, bot.dex.replayed_blocks)))
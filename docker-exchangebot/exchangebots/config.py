@@ -17,6 +17,20 @@ account = "liquidity-bot-mauritso"  # prefix liquidity-bot-
 
 # Websocket URL
 witness_url = "wss://bitshares.openledger.info/ws"
+# Several witness nodes (replaces witness_url): the calls go to the node
+# with the lowest round-trip time and the subscriptions to the same node
+# on startup. Nodes that fail or are more than node_max_lag blocks behind
+# the others are skipped (the calls fail over to the next node, the
+# subscriptions reconnect), all nodes are probed every
+# node_probe_interval seconds and calls time out after node_timeout
+# seconds.
+# witness_urls = [
+#     "wss://bitshares.openledger.info/ws",
+#     "wss://node.bitshares.eu/ws",
+# ]
+node_max_lag = 3
+node_probe_interval = 30
+node_timeout = 5
 
 # Set of ALL markets that you inted to serve
 watch_markets = [
@@ -30,6 +44,128 @@ market_separator = " : "  # separator between assets
 # If this flag is set to True, nothing will be done really
 safe_mode = False
 
+# File the asset metadata (ids, precisions, backing assets) is cached in
+asset_cache = "assets.json"
+# Seconds after which the bitasset data (backing asset) is reloaded and
+# the markets of the bots are verified again on startup
+asset_cache_ttl = 60 * 60 * 24
+# Seconds to wait on startup for the cli_wallet and the witness node to
+# accept connections
+startup_timeout = 120
+
+# Mirror the order books of the markets in memory (loaded with
+# order_book_depth orders per side and kept current from the market
+# notifications) and take the bid/ask, the last price and the
+# settlement price from them instead of pulling the full ticker (not in
+# the worker processes, see workers below). The books are loaded again
+# on every (re)connect of the subscriptions, every
+# order_book_reseed_interval seconds and once a side is down to half of
+# the orders it was loaded with.
+order_books = False
+order_book_depth = 100
+order_book_reseed_interval = 60 * 60
+
+# The free, committed and collateral funds of the account are kept up to
+# date from the open orders and debt positions; the balances are only
+# fetched every ledger_reconcile_blocks blocks to correct the ledger
+ledger_reconcile_blocks = 100
+
+# Logs are written as JSON lines ("json") or as "<time> | <message>"
+# ("text") by a background thread. log_levels overrides log_level per
+# subsystem (bot, router, ledger, nodepool, orderbook, startup, metrics,
+# profiler, assets, supervisor, strategy or strategy.<bot name>).
+# Identical messages are logged at most log_rate_burst times per
+# log_rate_interval seconds. Once log_queue_size records are waiting to
+# be written, new records are dropped instead of stalling the bots.
+log_format = "json"
+log_level = "INFO"
+log_levels = {
+    # "router": "DEBUG",
+    # "strategy.LiquidityWall": "DEBUG",
+}
+log_rate_burst = 10
+log_rate_interval = 60
+log_queue_size = 10000
+
+# The fills of all markets are stored in the SQLite database fill_store
+# (remove it to keep the fills in memory only), so the price of the
+# filled orders survives restarts and may be taken over windows longer
+# than the last 1000 fills. Fills older than fill_store_retention
+# seconds are deleted every fill_store_prune_interval seconds.
+fill_store = "fills.sqlite"
+fill_store_retention = 60 * 60 * 24 * 30
+fill_store_prune_interval = 60 * 60
+
+# Broadcast all orders, cancelations and debt updates of a bot's tick
+# as a single transaction
+batch_transactions = True
+
+# cancel_all.py and the cancel_* methods of the bots cancel the orders
+# in transactions of cancel_batch_size cancelations, broadcasting up to
+# cancel_workers transactions at the same time. Failed cancelations are
+# repeated one per transaction in up to cancel_retries rounds,
+# cancel_retry_delay seconds apart.
+cancel_batch_size = 50
+cancel_workers = 4
+cancel_retries = 2
+cancel_retry_delay = 0.5
+
+# Seconds the ticks of all bots may take per block, remaining ticks are
+# deferred to the next block
+tick_budget = 2.0
+# Blocks older than this (in seconds) are not ticked, their ticks are
+# coalesced into the next block
+max_block_age = 6
+
+# Port of the HTTP endpoint serving the call metrics in the Prometheus
+# text format (None disables it)
+metrics_port = None
+metrics_host = "127.0.0.1"
+# Seconds between two summaries of the call metrics in the log
+metrics_summary_interval = 60
+# Measure the size of the call results (serializes every result once
+# more, only turn it on to look into the payloads)
+metrics_payload_size = False
+
+# Profile the next profile_blocks blocks when the process receives
+# SIGUSR1 (or right after the start if profile_on_start is set).
+# "deterministic" uses cProfile, "sampling" samples the stack every
+# profile_interval seconds. Both write pstats (.pstats) and collapsed
+# stacks (.collapsed, for flamegraph.pl/speedscope) to profile_dir. The
+# stacks of a deterministic profile stop at paths with less than
+# profile_min_share of the profiled time
+profile_blocks = 10
+profile_mode = "deterministic"
+profile_interval = 0.005
+profile_min_share = 0.001
+profile_on_start = False
+profile_dir = "profiles"
+
+# Record all calls of the bots to the wallet and the witness node (and
+# the notifications) in the cassette (gzipped JSON lines), or replay a
+# recorded cassette without network ("record", "replay" or None).
+# cassette_strict fails the replay on calls with arguments that were not
+# recorded instead of answering them with the next call of the method.
+cassette = "cassette.jsonl.gz"
+cassette_mode = None
+cassette_strict = False
+
+# Run the bots in this many worker processes (1 runs them all in this
+# process). Bots that trade the same market run in the same worker; a bot
+# with the setting "markets_per_worker" is split into shards of at most
+# that many markets; every shard may only use the part of the free funds
+# of an asset that its markets make up of the bot's markets trading it.
+# Every worker locks its account/market pairs in lock_dir (and waits up
+# to lock_timeout seconds for a lock). Crashed
+# workers are restarted after restart_delay seconds (doubled per crash
+# in a row). With metrics_port set, worker N serves on metrics_port + N.
+# The workers only receive the blocks: order_books is off in them and
+# the bots reload their data instead of following notifications.
+workers = 1
+lock_dir = "locks"
+lock_timeout = 60
+restart_delay = 1
+
 
 # Load the strategies
 from strategies.liquidity_wall import LiquiditySellBuyWalls
@@ -67,8 +203,20 @@ bots["LiquidityWall"] = {
         },
     # the percentage the order will be placed at in relation to target_price
     "spread_percentage": 2,
+    # number of orders per side, level_spacing_percentage apart from each other
+    "levels": 1,
+    "level_spacing_percentage": 1,
+    # how the funds of a side are divided across its levels ("flat", "linear"
+    # or "exponential"), level_factor is the size of the outermost level
+    # relative to the innermost one
+    "level_distribution": "flat",
+    "level_factor": 1,
+    # Maximum total amount of the orders of one side (optional)
+    # "maximum_amounts": {"EUR": 100},
     # the percentage the order may drift from spread_percentage.
     "allowed_spread_percentage": 1,
+    # the percentage the amount of an order may differ from the desired amount before it gets replaced
+    "allowed_amount_percentage": 10,
     # the percentage of the available funds to put on the market
     "volume_percentage": 70,
     # expiration time for the orders placed by the bot in seconds
@@ -77,6 +225,9 @@ bots["LiquidityWall"] = {
     "skip_blocks": 5,
     # collateral ratio for the debts placed by the bot (same as target_ratio below)
     "ratio": 2.5,
+    # replace the walls as the price changes on every tick (off: the bot
+    # only logs the target prices)
+    "replace_orders": False,
 
     # The maximum age (in seconds) a filled order can be to be included in the price calculation.
     "filled_order_age": 60 * 60 * 12,
@@ -96,4 +247,8 @@ bots["LiquidityWall"] = {
 #    "lower_threshold" : 2.3,
 #    "upper_threshold" : 2.7,
 #    "skip_blocks" : 1,
+#    # reload the debt positions every resync_ticks ticks, in between they
+#    # follow the notifications of the call orders and price feeds (in
+#    # worker processes, which get no notifications, on every tick)
+#    "resync_ticks" : 20,
 #}
@@ -0,0 +1,211 @@
+from logger import get_logger
+import hashlib
+import sqlite3
+import time
+
+log = get_logger("fillstore")
+
+
+class FillStore():
+    """ Keeps the fills of all markets in a SQLite database so that the
+        price of the fills can be taken over windows longer than the
+        fill history API returns and survives restarts
+
+        :param str filename: The database (``:memory:`` for none)
+        :param int retention: Seconds fills are kept for
+        :param int prune_interval: Seconds between two prunings (see
+                                   ``maybe_prune()``)
+
+        The fills are stored in a table clustered by ``(market, time,
+        seq)`` (``WITHOUT ROWID``) that also carries the price and the
+        volume, so the aggregates over a time window of a market are a
+        single range scan of the primary key that never touches another
+        index. ``seq`` is derived from the identity of the fill, so the
+        same fill is only stored once no matter how often it is loaded.
+
+        .. code-block:: python
+
+            store = FillStore("fills.sqlite")
+            store.add("1.3.121:1.3.0", [(1700000000, 301.5, 12.5, key)])
+            store.aggregates("1.3.121:1.3.0", time.time() - 3600)
+    """
+
+    def __init__(self, filename="fills.sqlite", retention=60 * 60 * 24 * 30,
+                 prune_interval=60 * 60):
+        self.filename = filename
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self.last_prune = None
+        # Worker processes may share the database
+        self.db = sqlite3.connect(filename, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS fills (
+                market TEXT NOT NULL,
+                time INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                price REAL NOT NULL,
+                volume REAL NOT NULL,
+                PRIMARY KEY (market, time, seq)
+            ) WITHOUT ROWID""")
+        self.db.commit()
+
+    @staticmethod
+    def seq(key):
+        """ Signed 64 bit id of a fill derived from its identity
+        """
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big", signed=True)
+
+    def add(self, market, fills):
+        """ Store fills (fills that are stored already are ignored)
+
+            :param list fills: ``(time, price, volume, key)`` per fill
+            :return: Number of new fills
+        """
+        before = self.db.total_changes
+        with self.db:
+            self.db.executemany(
+                "INSERT OR IGNORE INTO fills (market, time, seq, price, volume) VALUES (?, ?, ?, ?, ?)",
+                [(market, int(t), self.seq(key), price, volume) for t, price, volume, key in fills])
+        return self.db.total_changes - before
+
+    def newest(self, market):
+        """ Time of the newest fill of ``market`` (``None`` if there is
+            none)
+        """
+        return self.db.execute("SELECT MAX(time) FROM fills WHERE market = ?", (market,)).fetchone()[0]
+
+    def aggregates(self, market, since, now=None):
+        """ Aggregates of the fills of ``market`` since ``since``
+
+            :param float now: Time the time weights are relative to
+                              (default: the current time)
+            :return: ``count``, ``volume``, ``vwap`` (volume weighted
+                     price) and ``price`` (weighted by volume and by
+                     ``1 / seconds_ago`` as ``FillPriceEstimator``); the
+                     prices are ``None`` without fills
+            :rtype: dict
+        """
+        if now is None:
+            now = time.time()
+        count, volume, price_volume, price_weight, weight = self.db.execute("""
+            SELECT COUNT(*), SUM(volume), SUM(price * volume),
+                   SUM(price * volume / MAX(? - time, 1)), SUM(volume / MAX(? - time, 1))
+            FROM fills WHERE market = ? AND time >= ?""",
+            (now, now, market, since)).fetchone()
+        return {"count": count,
+                "volume": volume or 0,
+                "vwap": price_volume / volume if volume else None,
+                "price": price_weight / weight if weight else None}
+
+    def candles(self, market, since, interval=60 * 60):
+        """ Open, high, low, close, volume and volume weighted price per
+            ``interval`` seconds since ``since``
+
+            :return: ``[(start, open, high, low, close, volume, vwap)]``
+                     oldest first
+        """
+        # The open and the close are single lookups of the primary key
+        return self.db.execute("""
+            SELECT start,
+                   (SELECT price FROM fills f WHERE f.market = :market AND f.time >= MAX(start, :since)
+                    ORDER BY f.time, f.seq LIMIT 1),
+                   high, low,
+                   (SELECT price FROM fills f WHERE f.market = :market AND f.time < start + :interval
+                    ORDER BY f.time DESC, f.seq DESC LIMIT 1),
+                   volume, vwap
+            FROM (SELECT time / :interval * :interval AS start, MAX(price) AS high, MIN(price) AS low,
+                         SUM(volume) AS volume, SUM(price * volume) / SUM(volume) AS vwap
+                  FROM fills WHERE market = :market AND time >= :since
+                  GROUP BY start)
+            ORDER BY start""",
+            {"market": market, "since": since, "interval": int(interval)}).fetchall()
+
+    def prune(self, now=None):
+        """ Delete the fills older than ``retention``
+
+            :return: Number of deleted fills
+        """
+        if now is None:
+            now = time.time()
+        self.last_prune = now
+        cutoff = int(now - self.retention)
+        deleted = 0
+        markets = [m for m, in self.db.execute("SELECT DISTINCT market FROM fills")]
+        for market in markets:
+            with self.db:
+                deleted += self.db.execute(
+                    "DELETE FROM fills WHERE market = ? AND time < ?", (market, cutoff)).rowcount
+        if deleted:
+            log.info("Pruned %d fills older than %ds", deleted, self.retention)
+        return deleted
+
+    def maybe_prune(self, now=None):
+        """ ``prune()`` if ``prune_interval`` seconds have passed since
+            the last pruning
+        """
+        if now is None:
+            now = time.time()
+        if self.last_prune is None or now - self.last_prune >= self.prune_interval:
+            self.prune(now)
+
+    def estimator(self, quote_id, base_id):
+        """ A ``StoredEstimator`` of a market for the ``FillTracker``
+        """
+        return StoredEstimator(self, "%s:%s" % (quote_id, base_id))
+
+    def close(self):
+        self.db.close()
+
+
+class StoredEstimator():
+    """ Provides the interface of ``FillPriceEstimator`` on top of a
+        ``FillStore``: the ``FillTracker`` appends the fills, which are
+        written to the store on ``expire()``, and the prices are
+        aggregated by the database over the window since the last
+        ``expire()`` (one query per window and query time)
+
+        :param FillStore store: The store
+        :param str market: Market key (``quote_id:base_id``)
+    """
+
+    def __init__(self, store, market):
+        self.store = store
+        self.market = market
+        self.oldest = 0
+        self.pending = []
+        self._cache = None
+
+    def append(self, timestamp, price, volume, key=None):
+        if key is None:
+            key = "%s %s %s" % (timestamp, price, volume)
+        self.pending.append((timestamp, price, volume, key))
+        self._cache = None
+
+    def expire(self, oldest):
+        """ Write the appended fills and move the window (the store
+            prunes the old fills itself)
+        """
+        if self.pending:
+            self.store.add(self.market, self.pending)
+            self.pending = []
+        self.oldest = oldest
+        self._cache = None
+
+    def _aggregates(self, now=None):
+        # The volume and the VWAP do not depend on the query time
+        if self._cache is None or (now is not None and self._cache[0] != now):
+            self._cache = (now, self.store.aggregates(self.market, self.oldest, now))
+        return self._cache[1]
+
+    @property
+    def volume(self):
+        return self._aggregates()["volume"]
+
+    def vwap(self):
+        return self._aggregates()["vwap"]
+
+    def price(self, now):
+        return self._aggregates(now)["price"]
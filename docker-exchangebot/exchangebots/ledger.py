@@ -0,0 +1,283 @@
+from logger import get_logger
+
+log = get_logger("ledger")
+
+
+class AccountLedger():
+    """ Keeps the funds of the account per asset: ``free`` (the account
+        balance), ``committed`` (for sale in open orders), ``collateral``
+        (locked in debt positions) and ``debt``.
+
+        :param str separator: Market separator
+        :param int reconcile_blocks: Number of blocks after which the
+                                     ledger is rebuilt from a full fetch
+                                     of the balances
+
+        Instead of fetching the balances and summing up all open orders
+        and debt positions whenever the funds are needed, the ledger
+        follows the changes of the open orders and debt positions that
+        are loaded once per block anyway:
+
+        * a placed order (see ``placed()``) moves its amount from free
+          to pending right away. Once the order shows up in the open
+          orders, its remaining amount moves to committed and the amount
+          it was filled with on placement is credited. An order that has not shown up after
+          ``placement_blocks`` blocks was either filled completely or
+          never made it into a block, so the ledger is reconciled with
+          the balances instead of guessing. Orders placed by others move
+          their amount once they show up.
+        * a (partially) filled order moves the filled amount out of
+          committed and credits the proceeds at the order's rate
+        * a canceled order (see ``cancelled()``) moves its remaining
+          amount back to free, any other order that disappears is
+          considered filled
+        * a changed debt position moves the changed debt and collateral
+          between free and the position
+
+        Expired orders, margin calls and better prices of orders that are
+        filled on placement are only corrected by the next
+        reconciliation. All lookups are O(1).
+
+        .. code-block:: python
+
+            ledger = AccountLedger(" : ")
+            ledger.sync(snapshot)
+            ledger.free["BTS"], ledger.total("BTS")
+    """
+
+    #: Differences (in units of the asset) that are reported on
+    #: reconciliation
+    tolerance = 1e-6
+
+    #: Blocks a placed order may take to show up in the open orders
+    #: before the ledger is reconciled
+    placement_blocks = 3
+
+    def __init__(self, separator, reconcile_blocks=100):
+        self.separator = separator
+        self.reconcile_blocks = reconcile_blocks
+        self.free = {}
+        self.committed = {}
+        self.collateral = {}
+        self.debt = {}
+        #: Funds for sale per market (``{market: {symbol: amount}}``)
+        self.committed_markets = {}
+        #: Open orders (``{orderNumber: record}``)
+        self.orders = {}
+        #: Debt positions (``{symbol: (collateral_asset, collateral, debt)}``)
+        self.positions = {}
+        #: Orders canceled by the bots that may still show up as open
+        self.cancelling = set()
+        #: Orders placed by the bots that have not shown up yet
+        self.placing = []
+        #: Funds of the orders in ``placing``
+        self.pending = {}
+        self.snapshot = None
+        self.open_orders = None
+        self.debt_positions = None
+        self.blocks = None
+        #: Number of reconciliations that found a difference
+        self.drifts = 0
+
+    def _add(self, funds, symbol, amount):
+        funds[symbol] = funds.get(symbol, 0) + amount
+
+    def _commit(self, market, symbol, amount):
+        self._add(self.committed, symbol, amount)
+        self._add(self.committed_markets.setdefault(market, {}), symbol, amount)
+
+    def _record(self, market, order):
+        quote, base = market.split(self.separator)
+        if order["type"] == "sell":
+            sells, receives = quote, base
+        else:
+            sells, receives = base, quote
+        for_sale = order.get("amount_to_sell",
+                             order["amount"] if order["type"] == "sell" else order["total"])
+        return {"market": market, "type": order["type"], "rate": order["rate"],
+                "sells": sells, "receives": receives, "for_sale": for_sale}
+
+    def _proceeds(self, record, amount):
+        """ What ``amount`` of the sold asset buys at the order's rate
+        """
+        if record["type"] == "sell":
+            return amount * record["rate"]
+        return amount / record["rate"] if record["rate"] else 0
+
+    def placed(self, market, type, rate, amount):
+        """ Tell the ledger that an order has been placed
+
+            :param str type: ``buy`` or ``sell``
+            :param float rate: Price in base per quote
+            :param float amount: Amount of quote
+        """
+        record = self._record(market, {"type": type, "rate": rate, "amount": amount,
+                                       "total": amount * rate})
+        self._add(self.free, record["sells"], -record["for_sale"])
+        self._add(self.pending, record["sells"], record["for_sale"])
+        record["block"] = self.blocks or 0
+        self.placing.append(record)
+
+    def _placement(self, record):
+        """ Find (and remove) the placement of a new order
+        """
+        candidates = [p for p in self.placing
+                      if p["market"] == record["market"] and p["type"] == record["type"]]
+        if not candidates:
+            return None
+        # An order only shrinks (by fills) after its placement
+        placement = min(candidates, key=lambda p: (
+            abs(p["rate"] - record["rate"]),
+            p["for_sale"] < record["for_sale"] * (1 - self.tolerance),
+            abs(p["for_sale"] - record["for_sale"])))
+        self.placing.remove(placement)
+        return placement
+
+    def cancelled(self, orderNumber):
+        """ Tell the ledger that an order has been canceled (and not
+            filled) so that its funds are returned to free once it
+            disappears
+        """
+        self.cancelling.add(orderNumber)
+
+    def sync(self, snapshot):
+        """ Bring the ledger up to date with a block snapshot. Every
+            ``reconcile_blocks`` blocks (and on the first call), the
+            ledger is rebuilt from the balances, otherwise only the
+            changes of the open orders and debt positions are applied.
+        """
+        if snapshot is not self.snapshot:
+            self.snapshot = snapshot
+            self.blocks = 0 if self.blocks is None else self.blocks + 1
+            if self.blocks == 0 or self.blocks >= self.reconcile_blocks:
+                self.reconcile(snapshot.balances, snapshot.open_orders,
+                               snapshot.debt_positions)
+                self.blocks = 0
+                return
+        self.sync_orders(snapshot.open_orders)
+        self.sync_debts(snapshot.debt_positions)
+        if any(self.blocks - p["block"] >= self.placement_blocks for p in self.placing):
+            self.reconcile(snapshot.balances, snapshot.open_orders,
+                           snapshot.debt_positions)
+            self.blocks = 0
+
+    def sync_orders(self, open_orders):
+        """ Apply the changes of the open orders (as returned by
+            ``returnOpenOrders``)
+        """
+        if open_orders is self.open_orders:
+            return
+        self.open_orders = open_orders
+        seen = set()
+        for market, orders in open_orders.items():
+            for order in orders:
+                oid = order["orderNumber"]
+                seen.add(oid)
+                record = self._record(market, order)
+                old = self.orders.get(oid)
+                if old is None:
+                    old = self._placement(record)
+                    if old is None:
+                        self._add(self.free, record["sells"], -record["for_sale"])
+                    else:
+                        self._add(self.pending, record["sells"], -old["for_sale"])
+                        filled = old["for_sale"] - record["for_sale"]
+                        if filled > 0:
+                            self._add(self.free, record["receives"], self._proceeds(old, filled))
+                        else:
+                            # Rounded to the precision of the asset
+                            self._add(self.free, record["sells"], filled)
+                    self._commit(market, record["sells"], record["for_sale"])
+                elif old["for_sale"] != record["for_sale"]:
+                    filled = old["for_sale"] - record["for_sale"]
+                    self._commit(market, record["sells"], -filled)
+                    self._add(self.free, record["receives"], self._proceeds(old, filled))
+                self.orders[oid] = record
+        for oid in [oid for oid in self.orders if oid not in seen]:
+            record = self.orders.pop(oid)
+            self._commit(record["market"], record["sells"], -record["for_sale"])
+            if oid in self.cancelling:
+                self.cancelling.discard(oid)
+                self._add(self.free, record["sells"], record["for_sale"])
+            else:
+                self._add(self.free, record["receives"], self._proceeds(record, record["for_sale"]))
+        # Placed orders that have not shown up stay pending (see
+        # ``sync()``)
+
+    def sync_debts(self, debt_positions):
+        """ Apply the changes of the debt positions (as returned by
+            ``list_debt_positions``)
+        """
+        if debt_positions is self.debt_positions:
+            return
+        self.debt_positions = debt_positions
+        for symbol in set(self.positions) | set(debt_positions):
+            old_asset, old_collateral, old_debt = self.positions.get(symbol, (None, 0, 0))
+            if symbol in debt_positions:
+                position = debt_positions[symbol]
+                asset, collateral, debt = (position["collateral_asset"],
+                                           position["collateral"], position["debt"])
+                self.positions[symbol] = (asset, collateral, debt)
+            else:
+                asset, collateral, debt = old_asset, 0, 0
+                del self.positions[symbol]
+            if collateral != old_collateral:
+                self._add(self.collateral, asset, collateral - old_collateral)
+                self._add(self.free, asset, old_collateral - collateral)
+            if debt != old_debt:
+                self._add(self.debt, symbol, debt - old_debt)
+                self._add(self.free, symbol, debt - old_debt)
+
+    def reconcile(self, balances, open_orders, debt_positions):
+        """ Rebuild the ledger from a full fetch of the balances, open
+            orders and debt positions and report the funds that were off
+        """
+        expected = dict(self.free)
+        self.free = dict(balances)
+        self.committed = {}
+        self.committed_markets = {}
+        self.collateral = {}
+        self.debt = {}
+        self.orders = {}
+        self.positions = {}
+        self.cancelling = set()
+        self.placing = []
+        self.pending = {}
+        for market, orders in open_orders.items():
+            for order in orders:
+                record = self._record(market, order)
+                self._commit(market, record["sells"], record["for_sale"])
+                self.orders[order["orderNumber"]] = record
+        for symbol, position in debt_positions.items():
+            asset = position["collateral_asset"]
+            self.positions[symbol] = (asset, position["collateral"], position["debt"])
+            self._add(self.collateral, asset, position["collateral"])
+            self._add(self.debt, symbol, position["debt"])
+        self.open_orders = open_orders
+        self.debt_positions = debt_positions
+
+        if expected:
+            drift = {symbol: self.free.get(symbol, 0) - expected.get(symbol, 0)
+                     for symbol in set(self.free) | set(expected)}
+            drift = {s: d for s, d in drift.items() if abs(d) > self.tolerance}
+            if drift:
+                self.drifts += 1
+                log.warning("Ledger reconciled: %s", ", ".join(
+                    "%s %+f" % (s, d) for s, d in sorted(drift.items())), extra={"drift": drift})
+
+    def balances(self):
+        """ Free funds per asset (like ``returnBalances``)
+        """
+        return {symbol: amount for symbol, amount in self.free.items()
+                if amount > self.tolerance}
+
+    def total(self, symbol):
+        """ Free, pending, committed and collateral funds of ``symbol``
+        """
+        return (self.free.get(symbol, 0) + self.pending.get(symbol, 0) +
+                self.committed.get(symbol, 0) + self.collateral.get(symbol, 0))
+
+    def committed_in(self, market):
+        """ Funds for sale in the open orders of ``market`` per asset
+        """
+        return self.committed_markets.get(market, {})
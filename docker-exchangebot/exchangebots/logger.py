@@ -0,0 +1,233 @@
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+#: Name of the logger all subsystem loggers derive from
+ROOT = "exchangebot"
+
+#: Attributes of every ``LogRecord`` (everything else came with ``extra``)
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener = None
+_handler = None
+_pid = None
+
+
+def get_logger(subsystem):
+    """ Return the logger of a subsystem (``router``, ``ledger``,
+        ``strategy.<bot>``, ...)
+
+        .. code-block:: python
+
+            log = get_logger("router")
+            log.info("Notifying bots: %s", names, extra={"bots": names})
+
+        The arguments are only formatted on the background thread (see
+        ``setup()``), so messages should pass their values as arguments
+        instead of formatting them first (and not pass objects that
+        change afterwards).
+    """
+    return logging.getLogger("%s.%s" % (ROOT, subsystem))
+
+
+class TextFormatter(logging.Formatter):
+    """ ``<time> | <message>`` like the log lines of the bots always were
+    """
+
+    def format(self, record):
+        line = "%s | %s" % (datetime.fromtimestamp(record.created), record.getMessage())
+        if getattr(record, "suppressed", 0):
+            line += " (repeated %d more times)" % record.suppressed
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class JSONFormatter(logging.Formatter):
+    """ One JSON object per line with the time, level, subsystem, message
+        and all fields passed with ``extra``
+    """
+
+    def format(self, record):
+        entry = {"time": datetime.fromtimestamp(record.created).isoformat(),
+                 "level": record.levelname,
+                 "subsystem": record.name[len(ROOT) + 1:] if record.name.startswith(ROOT + ".") else record.name,
+                 "message": record.getMessage()}
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class StdoutHandler(logging.Handler):
+    """ Writes to the current ``sys.stdout`` (which may be redirected
+        after the handler has been created)
+    """
+
+    def emit(self, record):
+        try:
+            sys.stdout.write(self.format(record) + "\n")
+            sys.stdout.flush()
+        except Exception:
+            self.handleError(record)
+
+
+class RateLimit(logging.Filter):
+    """ Lets at most ``burst`` records with the same logger, level,
+        message template and arguments through per ``interval`` seconds.
+        The number of records suppressed in between is attached to the
+        next record that passes (``suppressed``).
+    """
+
+    #: Number of windows above which the expired ones are dropped
+    max_windows = 1000
+
+    def __init__(self, burst=10, interval=60):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.lock = threading.Lock()
+        #: ``{(logger, level, template, args): [window start, count, suppressed]}``
+        self.windows = {}
+
+    def filter(self, record):
+        if not self.burst:
+            return True
+        key = (record.name, record.levelno, record.msg, record.args)
+        try:
+            hash(key)
+        except TypeError:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                if len(self.windows) > self.max_windows:
+                    self.windows = {k: w for k, w in self.windows.items()
+                                    if now - w[0] < self.interval}
+                self.windows[key] = [now, 1, 0]
+            elif window[1] < self.burst:
+                window[1] += 1
+                suppressed, window[2] = window[2], 0
+            else:
+                window[2] += 1
+                return False
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """ Hands the records to the background thread as they are (without
+        formatting them) and drops them if the queue is full instead of
+        blocking the caller
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        #: Number of records dropped because the queue was full
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class Listener(QueueListener):
+    """ ``QueueListener`` that reports the records that were dropped
+    """
+
+    def __init__(self, log_queue, handler, producer):
+        super().__init__(log_queue, handler, respect_handler_level=False)
+        self.producer = producer
+        self.reported = 0
+
+    def enqueue_sentinel(self):
+        # The queue may be full, wait for the thread to make room
+        self.queue.put(self._sentinel)
+
+    def handle(self, record):
+        dropped = self.producer.dropped
+        if dropped > self.reported:
+            warning = logging.LogRecord(
+                ROOT + ".logger", logging.WARNING, __file__, 0,
+                "Log queue full, dropped %d records", (dropped - self.reported,), None)
+            self.reported = dropped
+            super().handle(warning)
+        super().handle(record)
+
+
+# Until ``setup()`` is called, log synchronously to stdout like ``print()``
+_default = StdoutHandler()
+_default.setFormatter(TextFormatter())
+logging.getLogger(ROOT).addHandler(_default)
+logging.getLogger(ROOT).setLevel(logging.INFO)
+logging.getLogger(ROOT).propagate = False
+
+
+def setup(config):
+    """ Move the formatting and the output of the logs to a background
+        thread
+
+        :param config: The configuration (``log_format``, ``log_level``,
+                       ``log_levels``, ``log_rate_burst``,
+                       ``log_rate_interval`` and ``log_queue_size``)
+
+        The bots only put the records into a bounded queue, so a slow
+        consumer of stdout never stalls the block processing: if the
+        queue is full, records are dropped (and counted). Calling
+        ``setup()`` again in the same process does nothing, a forked
+        worker process starts its own background thread.
+    """
+    global _listener, _handler, _pid
+    if _pid == os.getpid():
+        return
+    _pid = os.getpid()
+
+    root = logging.getLogger(ROOT)
+    root.setLevel(getattr(config, "log_level", "INFO"))
+    for subsystem, level in getattr(config, "log_levels", {}).items():
+        get_logger(subsystem).setLevel(level)
+
+    output = StdoutHandler()
+    if getattr(config, "log_format", "json") == "json":
+        output.setFormatter(JSONFormatter())
+    else:
+        output.setFormatter(TextFormatter())
+
+    log_queue = queue.Queue(getattr(config, "log_queue_size", 10000))
+    handler = DroppingQueueHandler(log_queue)
+    handler.addFilter(RateLimit(getattr(config, "log_rate_burst", 10),
+                                getattr(config, "log_rate_interval", 60)))
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+
+    _handler = handler
+    _listener = Listener(log_queue, output, handler)
+    _listener.start()
+    atexit.register(shutdown)
+
+
+def shutdown():
+    """ Write the queued records and stop the background thread
+    """
+    global _listener
+    if _listener is not None and _pid == os.getpid():
+        _listener.stop()
+        _listener = None
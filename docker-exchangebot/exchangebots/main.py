@@ -1,22 +1,31 @@
 import bot
+import supervisor
 import json
-import time
 import requests
-from datetime import datetime
 from grapheneapi import GrapheneAPI
 from grapheneapi.grapheneapi import RPCError
+from startup import wait_for
+from logger import get_logger
+import logger
 import config
 
+log = get_logger("main")
+
 
 def run_bot(bot=bot):
     rpc = GrapheneAPI(config.wallet_host, config.wallet_port, "", "")
     if rpc.is_locked():
         rpc.unlock(config.wallet_password)
 
-    print(str(datetime.now()) + "| Starting bot...")
+    if getattr(config, "workers", 1) > 1:
+        log.info("Starting %d workers...", config.workers)
+        supervisor.Supervisor(config, config.workers,
+                              getattr(config, "restart_delay", 1)).run()
+        return
+
+    log.info("Starting bot...")
     bot.init(config)
-    time.sleep(6)
-    print(str(datetime.now()) + "| Running the bot")
+    log.info("Running the bot")
     bot.run()
 
 def register_account_faucet(account, public_key, referrer=config.referrer, faucet=config.faucet):
@@ -40,8 +49,10 @@ def register_account_faucet(account, public_key, referrer=config.referrer, fauce
 
 
 if __name__ == '__main__':
-    time.sleep(5) # sleep to give the cli_wallet time to start
+    logger.setup(config)
     rpc = GrapheneAPI(config.wallet_host, config.wallet_port, "", "")
+    # wait until the cli_wallet accepts connections
+    wait_for(rpc.info, "the cli_wallet", getattr(config, "startup_timeout", 120))
     try:
         rpc.set_password(config.wallet_password) # try to set password
     except RPCError: # if RCPError the password is already set
@@ -55,25 +66,26 @@ if __name__ == '__main__':
         if account_registered:
             rpc.import_key(config.account, brain_key['wif_priv_key'])
 
-            print("Account: %s successfully registered" % config.account)
-            print(rpc.list_my_accounts())
+            log.info("Account: %s successfully registered", config.account)
+            log.info("My accounts: %s", rpc.list_my_accounts())
 
-            print("Brain key: %s" % brain_key['brain_priv_key'])
-            print("Write it down/back it up ^")
+            log.warning("Brain key: %s", brain_key['brain_priv_key'])
+            log.warning("Write it down/back it up ^")
 
-            print("Send funds to %s and start the bot again" % config.account)
+            log.info("Send funds to %s and start the bot again", config.account)
         else:
-            print("Account creation failed")
-            print(brain_key)
-            print(config.faucet + " response: ", account_registration_response)
+            log.error("Account creation failed")
+            log.error("Brain key: %s", brain_key)
+            log.error("%s response: %s", config.faucet, account_registration_response)
     else:
         account_balances = rpc.list_account_balances(config.account)
         bot_configs = {}
         for bot_config in config.bots:
             bot_configs[bot_config] = {key:config.bots[bot_config][key] for key in config.bots[bot_config] if key != 'bot'}
 
-        print("%s | Account name: %s" % (datetime.now(), config.account))
-        print("%s | Account balances: %s" % (datetime.now(), json.dumps(account_balances, indent=4, sort_keys=True)))
-        print("%s | Bot config: %s" % (datetime.now(), json.dumps(bot_configs, indent=4, sort_keys=True)))
-        
+        log.info("Account name: %s", config.account)
+        log.info("Account balances: %s", json.dumps(account_balances, indent=4, sort_keys=True),
+                 extra={"balances": account_balances})
+        log.info("Bot config: %s", json.dumps(bot_configs, indent=4, sort_keys=True, default=str))
+
         run_bot()
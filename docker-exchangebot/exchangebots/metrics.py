@@ -0,0 +1,253 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from contextlib import contextmanager
+from logger import get_logger
+import threading
+import json
+import time
+
+log = get_logger("metrics")
+
+
+class Histogram():
+    """ Latency histogram with fixed buckets (upper bounds in seconds)
+    """
+
+    buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """ Upper bound of the bucket that contains the quantile ``q``
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        total = 0
+        for i, count in enumerate(self.counts):
+            total += count
+            if total >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+
+
+class MethodStats():
+    """ Statistics of the calls of one method by one bot
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.payload = 0
+        self.latency = Histogram()
+
+
+class Metrics():
+    """ Collects call counts, error counts, payload sizes and latency
+        histograms per method and per bot.
+
+        :param bool payload_size: Measure the size of the results (as
+                                  JSON, in bytes). Every result is
+                                  serialized once more for it, so it is
+                                  off by default.
+
+        The calls are attributed to the bot that is set with
+        ``context()`` while the call is made.
+
+        .. code-block:: python
+
+            metrics = Metrics()
+            dex = metrics.instrument_exchange(dex)
+            with metrics.context("LiquidityWall"):
+                dex.returnTicker()
+            metrics.serve(9102)
+            print(metrics.prometheus())
+    """
+
+    #: Calls that run the websocket subsystem and never return
+    uninstrumented = ["run", "connect", "run_forever", "switch"]
+
+    def __init__(self, payload_size=False):
+        self.payload_size = payload_size
+        self.bot = ""
+        self.lock = threading.Lock()
+        #: Statistics since the start (``{(method, bot): MethodStats}``)
+        self.stats = {}
+        #: Statistics since the last summary
+        self.window = {}
+        self.window_start = time.time()
+
+    @contextmanager
+    def context(self, bot):
+        """ Attribute the calls made within the context to ``bot``
+        """
+        previous, self.bot = self.bot, bot
+        try:
+            yield
+        finally:
+            self.bot = previous
+
+    def _size(self, result):
+        try:
+            return len(json.dumps(result, default=str))
+        except (TypeError, ValueError):
+            return 0
+
+    def observe(self, method, duration, error=False, result=None):
+        """ Record a call of ``method``
+        """
+        payload = self._size(result) if self.payload_size and not error else 0
+        key = (method, self.bot)
+        with self.lock:
+            for stats in (self.stats, self.window):
+                if key not in stats:
+                    stats[key] = MethodStats()
+                s = stats[key]
+                s.calls += 1
+                s.errors += int(error)
+                s.payload += payload
+                s.latency.observe(duration)
+
+    def wrap(self, method, function):
+        """ Return ``function`` wrapped so that its calls are recorded
+            as ``method``
+        """
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            except Exception:
+                self.observe(method, time.perf_counter() - start, error=True)
+                raise
+            self.observe(method, time.perf_counter() - start, result=result)
+            return result
+        return call
+
+    def instrument_exchange(self, dex):
+        """ Instrument the ``rpc`` (cli_wallet) and ``ws`` (witness node)
+            connections of ``dex`` in place and return a proxy of ``dex``
+            that records the calls of its helper methods (``returnTicker``,
+            ``buy``, ...)
+        """
+        for name in ("rpc", "ws"):
+            if hasattr(dex, name) and not isinstance(getattr(dex, name), Instrumented):
+                setattr(dex, name, Instrumented(getattr(dex, name), self, name + "."))
+        return Instrumented(dex, self, "dex.")
+
+    def prometheus(self):
+        """ Return the statistics in the Prometheus text format
+        """
+        with self.lock:
+            stats = sorted(self.stats.items())
+            lines = []
+            for name, kind, help, value in [
+                    ("calls_total", "counter", "Number of calls", lambda s: s.calls),
+                    ("call_errors_total", "counter", "Number of failed calls", lambda s: s.errors),
+                    ("call_payload_bytes_total", "counter", "Size of the results", lambda s: s.payload)]:
+                lines.append("# HELP exchangebot_%s %s" % (name, help))
+                lines.append("# TYPE exchangebot_%s %s" % (name, kind))
+                for (method, bot), s in stats:
+                    lines.append('exchangebot_%s{method="%s",bot="%s"} %d' % (name, method, bot, value(s)))
+            lines.append("# HELP exchangebot_call_duration_seconds Latency of the calls")
+            lines.append("# TYPE exchangebot_call_duration_seconds histogram")
+            for (method, bot), s in stats:
+                labels = 'method="%s",bot="%s"' % (method, bot)
+                total = 0
+                for bound, count in zip(Histogram.buckets + ["+Inf"], s.latency.counts):
+                    total += count
+                    lines.append('exchangebot_call_duration_seconds_bucket{%s,le="%s"} %d' % (labels, bound, total))
+                lines.append("exchangebot_call_duration_seconds_sum{%s} %f" % (labels, s.latency.sum))
+                lines.append("exchangebot_call_duration_seconds_count{%s} %d" % (labels, s.latency.count))
+        return "\n".join(lines) + "\n"
+
+    def summary(self, top=5):
+        """ Return a one-line summary of the calls since the last
+            summary (the ``top`` methods by total time) and start a new
+            window
+        """
+        with self.lock:
+            window, self.window = self.window, {}
+            elapsed, self.window_start = time.time() - self.window_start, time.time()
+        methods = {}
+        for (method, bot), s in window.items():
+            m = methods.setdefault(method, MethodStats())
+            m.calls += s.calls
+            m.errors += s.errors
+            m.latency.sum += s.latency.sum
+            m.latency.count += s.latency.count
+            m.latency.counts = [a + b for a, b in zip(m.latency.counts, s.latency.counts)]
+        calls = sum(m.calls for m in methods.values())
+        errors = sum(m.errors for m in methods.values())
+        slowest = sorted(methods.items(), key=lambda i: -i[1].latency.sum)[:top]
+        return "%d calls (%d errors) in %ds; %s" % (calls, errors, elapsed, ", ".join(
+            "%s: %d calls %.1fms avg p95<=%.0fms %.2fs total" % (
+                method, m.calls, m.latency.sum / m.calls * 1000,
+                m.latency.quantile(0.95) * 1000, m.latency.sum)
+            for method, m in slowest))
+
+    def maybe_summary(self, interval):
+        """ Print the summary if ``interval`` seconds have passed since
+            the last one
+        """
+        if interval and time.time() - self.window_start >= interval:
+            log.info("RPC summary: %s", self.summary())
+
+    def serve(self, port, host="127.0.0.1"):
+        """ Serve the statistics in the Prometheus text format on
+            ``http://host:port/metrics`` (in a background thread)
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer((host, port), Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        return server
+
+
+class Instrumented():
+    """ Transparent proxy that records the calls of the public methods of
+        ``target`` in ``metrics`` (as ``prefix + name``)
+    """
+
+    def __init__(self, target, metrics, prefix):
+        self._target = target
+        self._metrics = metrics
+        self._prefix = prefix
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if (not callable(value) or name.startswith("_") or
+                name in self._metrics.uninstrumented or
+                isinstance(value, Instrumented)):
+            return value
+        return self._metrics.wrap(self._prefix + name, value)
+
+    def __setattr__(self, name, value):
+        if name.startswith("_"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._target, name, value)
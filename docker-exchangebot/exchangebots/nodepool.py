@@ -0,0 +1,281 @@
+from logger import get_logger
+import threading
+import time
+
+log = get_logger("nodepool")
+
+
+class Node():
+    """ State of a single witness node of a ``NodePool``
+    """
+
+    def __init__(self, url):
+        self.url = url
+        #: Connection for the calls (``None`` while disconnected)
+        self.connection = None
+        #: Serializes the calls of the bots and of the probes
+        self.lock = threading.Lock()
+        #: Smoothed round-trip time in seconds (``None`` until measured)
+        self.latency = None
+        #: Head block of the last probe
+        self.head_block = None
+        #: Blocks behind the highest head block of all nodes
+        self.lag = 0
+        #: Error of the last call or probe (``None`` if it succeeded)
+        self.error = None
+        #: Number of failed calls and probes
+        self.failures = 0
+
+    @property
+    def healthy(self):
+        return self.connection is not None and self.error is None
+
+    def __repr__(self):
+        return "%s (%s, %s, lag %d)" % (
+            self.url, "healthy" if self.healthy else "down: %s" % self.error,
+            "%.0fms" % (self.latency * 1000) if self.latency is not None else "n/a", self.lag)
+
+
+class NodePool():
+    """ Sends the calls to the witness node API to the fastest healthy
+        node out of several and fails over to the next one if a node
+        drops the connection or falls behind
+
+        :param list urls: Websocket URLs of the witness nodes
+        :param function connect: Opens a connection to a url and returns
+                                 an object whose attributes are the API
+                                 methods (default: ``GrapheneWebsocketRPC``)
+        :param class rpc_error: Exception of the connections for errors
+                                returned by a node (default: ``RPCError``
+                                of ``grapheneapi``)
+        :param float timeout: Seconds a node may take to answer a call
+        :param int max_lag: Blocks a node may be behind the highest head
+                            block of all nodes before it is skipped
+        :param float probe_interval: Seconds between two probes of the
+                                     nodes in the background (see
+                                     ``start()``)
+        :param float smoothing: Weight of a new round-trip time in the
+                                smoothed latency of a node
+
+        Every probe asks all nodes for ``get_dynamic_global_properties``
+        and takes the round-trip time and the head block of every node,
+        reconnecting nodes that are down. The calls of the bots
+        additionally feed the latency of the node that answered them.
+        Errors returned by a node (``rpc_error``) are raised, any other
+        error marks the node as down and the call is repeated on the next
+        node.
+
+        .. code-block:: python
+
+            pool = NodePool(["wss://node1/ws", "wss://node2/ws"])
+            pool.probe()
+            pool.start()
+            pool.get_objects(["2.1.0"])
+    """
+
+    def __init__(self, urls, connect=None, user="", password="", timeout=5,
+                 max_lag=3, probe_interval=30, smoothing=0.3, rpc_error=None):
+        if rpc_error is None:
+            from grapheneapi.graphenewsrpc import RPCError as rpc_error
+        self.nodes = [Node(url) for url in urls]
+        self.user = user
+        self.password = password
+        self.timeout = timeout
+        self.max_lag = max_lag
+        self.probe_interval = probe_interval
+        self.smoothing = smoothing
+        self._connect = connect or self.connect_websocket
+        self._rpc_error = rpc_error
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def connect_websocket(self, url):
+        """ Open a ``GrapheneWebsocketRPC`` connection that fails instead
+            of reconnecting (the pool reconnects on the next probe)
+        """
+        from grapheneapi.graphenewsrpc import GrapheneWebsocketRPC
+        connection = GrapheneWebsocketRPC(url, self.user, self.password, num_retries=0)
+        connection.ws.settimeout(self.timeout)
+        return connection
+
+    def _disconnect(self, node, error):
+        if node.error is None:
+            log.warning("Witness node %s is down: %s", node.url, error)
+        node.error = str(error) or error.__class__.__name__
+        node.failures += 1
+        connection, node.connection = node.connection, None
+        try:
+            if connection is not None and hasattr(connection, "close"):
+                connection.close()
+            elif connection is not None and hasattr(connection, "ws"):
+                connection.ws.close()
+        except Exception:
+            pass
+
+    def _observe(self, node, duration):
+        if node.latency is None:
+            node.latency = duration
+        else:
+            node.latency += self.smoothing * (duration - node.latency)
+
+    def _execute(self, node, name, args, kwargs):
+        """ Call ``name`` on ``node`` (connecting it first if necessary)
+        """
+        with node.lock:
+            if node.connection is None:
+                node.connection = self._connect(node.url)
+            start = time.time()
+            try:
+                result = getattr(node.connection, name)(*args, **kwargs)
+            except self._rpc_error:
+                self._observe(node, time.time() - start)
+                raise
+            self._observe(node, time.time() - start)
+            return result
+
+    def probe(self):
+        """ Measure the round-trip time and the head block of all nodes
+        """
+        for node in self.nodes:
+            try:
+                properties = self._execute(node, "get_dynamic_global_properties", (), {})
+            except Exception as e:
+                self._disconnect(node, e)
+                continue
+            if node.error is not None:
+                log.info("Witness node %s is back", node.url)
+            node.error = None
+            node.head_block = properties["head_block_number"]
+        heads = [node.head_block for node in self.nodes
+                 if node.healthy and node.head_block is not None]
+        for node in self.nodes:
+            node.lag = max(heads) - node.head_block if heads and node.head_block is not None else 0
+        return self.nodes
+
+    def ready(self):
+        """ Probe the nodes and raise unless one of them is healthy
+        """
+        self.probe()
+        if not self.best().healthy:
+            raise Exception("No witness node is reachable: %s" % self.status())
+
+    def ranked(self):
+        """ The nodes in the order they are tried: healthy nodes that are
+            not behind by their latency, then lagging and finally
+            disconnected nodes
+        """
+        def rank(node):
+            return (not node.healthy, node.lag > self.max_lag,
+                    node.latency if node.latency is not None else float("inf"),
+                    node.failures)
+        return sorted(self.nodes, key=rank)
+
+    def best(self):
+        """ The node the calls (and the subscriptions) should go to
+        """
+        return self.ranked()[0]
+
+    def lagging(self, url):
+        """ Whether the node of ``url`` is down or behind while another
+            node is healthy and current
+        """
+        best = self.best()
+        for node in self.nodes:
+            if node.url == url:
+                return (node is not best and best.healthy and best.lag <= self.max_lag and
+                        (not node.healthy or node.lag > self.max_lag))
+        return False
+
+    def call(self, name, *args, **kwargs):
+        """ Execute the API method ``name`` on the best node, failing
+            over to the next node on connection errors
+        """
+        error = None
+        for node in self.ranked():
+            try:
+                return self._execute(node, name, args, kwargs)
+            except self._rpc_error:
+                raise
+            except Exception as e:
+                self._disconnect(node, e)
+                error = e
+        raise error
+
+    def __getattr__(self, name):
+        """ Map all other attributes to API methods
+        """
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def method(*args, **kwargs):
+            return self.call(name, *args, **kwargs)
+        return method
+
+    def start(self):
+        """ Probe the nodes every ``probe_interval`` seconds in a
+            background thread
+        """
+        def run():
+            while not self._stopped.wait(self.probe_interval):
+                try:
+                    self.probe()
+                except Exception as e:
+                    log.warning("Probing the witness nodes failed: %s", e)
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def status(self):
+        return ", ".join(repr(node) for node in self.ranked())
+
+
+class RoutedWebsocket():
+    """ Proxy of the websocket (``GrapheneWebsocket``) of the exchange
+        that sends the calls to the witness node API to a ``NodePool``
+        and leaves the subscriptions (``objectMap``, ``connect()``,
+        ``run_forever()``, ...) with the websocket
+
+        :param GrapheneWebsocket ws: The websocket of the subscriptions
+        :param NodePool pool: The witness nodes for the calls
+    """
+
+    #: Helpers of ``GrapheneWebsocketRPC`` that only wrap API calls
+    routed = ("get_object", "get_objects", "get_asset", "get_account")
+
+    def __init__(self, ws, pool):
+        self._ws = ws
+        self._pool = pool
+
+    def __getattr__(self, name):
+        ws = self._ws
+        # Everything ``GrapheneWebsocketRPC.__getattr__`` would turn into
+        # an API call goes to the pool
+        if name in self.routed or not (hasattr(type(ws), name) or name in vars(ws)):
+            return getattr(self._pool, name)
+        return getattr(ws, name)
+
+    def __setattr__(self, name, value):
+        if name.startswith("_"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._ws, name, value)
+
+    def switch(self, url):
+        """ Connect the subscriptions to ``url`` on the next reconnect of
+            ``run_forever()``
+        """
+        ws = self._ws
+        scheme, _, rest = url.partition("://")
+        host = rest.split("/")[0]
+        if ":" in host:
+            host, port = host.rsplit(":", 1)
+            port = int(port)
+        else:
+            port = 443 if scheme == "wss" else 80
+        ws.url = url
+        ws.ssl = scheme == "wss"
+        ws.host = host
+        ws.port = port
+        ws.connect()
@@ -0,0 +1,325 @@
+from bisect import bisect_left, bisect_right, insort
+from logger import get_logger
+import time
+
+log = get_logger("orderbook")
+
+
+class OrderBook():
+    """ Aggregated (L2) order book of a single market
+
+        :param dict quote: The quote asset (``id`` and ``precision``)
+        :param dict base: The base asset (``id`` and ``precision``)
+
+        Prices are denoted in base per quote, amounts in quote. Every
+        side keeps the amount per price level in a dictionary and the
+        prices in a sorted list, so that the best bid/ask and the depth
+        at a price are O(1), placing or removing an order is O(1) for an
+        existing price level and O(log n) (plus moving the list) for a
+        new one. The cumulative depth is O(log n) once the running sums
+        of a side have been rebuilt after a change.
+    """
+
+    def __init__(self, quote, base):
+        self.quote = quote
+        self.base = base
+        #: ``{side: {price: amount}}``
+        self.levels = {"bids": {}, "asks": {}}
+        #: Number of orders per price level (``{side: {price: count}}``)
+        self.counts = {"bids": {}, "asks": {}}
+        #: Prices per side in ascending order
+        self.prices = {"bids": [], "asks": []}
+        #: ``{orderNumber: (side, price, amount)}``
+        self.orders = {}
+        #: Price of the last fill (``None`` until there was one)
+        self.last = None
+        self._cumulative = {"bids": None, "asks": None}
+
+    @staticmethod
+    def _round(price):
+        # Orders at the same price but with different amounts may lead to
+        # slightly different floats
+        return float("%.12g" % price)
+
+    def _amount(self, amount, asset):
+        return float(amount) / 10 ** asset["precision"]
+
+    def parse(self, order):
+        """ Return ``(side, price, amount)`` of a limit order object
+            (``1.7.x``)
+        """
+        sell_price = order["sell_price"]
+        if sell_price["base"]["asset_id"] == self.base["id"]:
+            base = self._amount(sell_price["base"]["amount"], self.base)
+            quote = self._amount(sell_price["quote"]["amount"], self.quote)
+            price = base / quote
+            return "bids", self._round(price), self._amount(order["for_sale"], self.base) / price
+        base = self._amount(sell_price["quote"]["amount"], self.base)
+        quote = self._amount(sell_price["base"]["amount"], self.quote)
+        return "asks", self._round(base / quote), self._amount(order["for_sale"], self.quote)
+
+    def _change(self, side, price, amount, count):
+        levels = self.levels[side]
+        counts = self.counts[side]
+        if price in levels:
+            counts[price] += count
+            if not counts[price]:
+                del levels[price]
+                del counts[price]
+                prices = self.prices[side]
+                del prices[bisect_left(prices, price)]
+            else:
+                levels[price] += amount
+        else:
+            levels[price] = amount
+            counts[price] = count
+            insort(self.prices[side], price)
+        self._cumulative[side] = None
+
+    def update(self, order):
+        """ Add or change an order (limit order object)
+        """
+        self.remove(order["id"])
+        side, price, amount = self.parse(order)
+        if amount <= 0:
+            return
+        self.orders[order["id"]] = (side, price, amount)
+        self._change(side, price, amount, 1)
+
+    def remove(self, orderNumber):
+        """ Remove an order (unknown orders are ignored)
+        """
+        if orderNumber in self.orders:
+            side, price, amount = self.orders.pop(orderNumber)
+            self._change(side, price, -amount, -1)
+
+    def fill(self, op):
+        """ Take the last price from a fill operation
+        """
+        if op["pays"]["asset_id"] == self.quote["id"]:
+            quote, base = op["pays"], op["receives"]
+        else:
+            quote, base = op["receives"], op["pays"]
+        quote_amount = self._amount(quote["amount"], self.quote)
+        if quote_amount > 0:
+            self.last = self._amount(base["amount"], self.base) / quote_amount
+
+    def clear(self):
+        self.levels = {"bids": {}, "asks": {}}
+        self.counts = {"bids": {}, "asks": {}}
+        self.prices = {"bids": [], "asks": []}
+        self.orders = {}
+        self._cumulative = {"bids": None, "asks": None}
+
+    @property
+    def highest_bid(self):
+        prices = self.prices["bids"]
+        return prices[-1] if prices else None
+
+    @property
+    def lowest_ask(self):
+        prices = self.prices["asks"]
+        return prices[0] if prices else None
+
+    def depth(self, side, price):
+        """ Amount (quote) offered at exactly ``price``
+
+            :param str side: ``bids`` or ``asks``
+        """
+        return self.levels[side].get(self._round(price), 0)
+
+    def cumulative_depth(self, side, price):
+        """ Amount (quote) offered at ``price`` or better, i.e. bids at
+            or above and asks at or below ``price``
+
+            :param str side: ``bids`` or ``asks``
+        """
+        prices = self.prices[side]
+        if self._cumulative[side] is None:
+            running = 0
+            sums = []
+            levels = self.levels[side]
+            for p in prices:
+                running += levels[p]
+                sums.append(running)
+            self._cumulative[side] = sums
+        sums = self._cumulative[side]
+        if not sums:
+            return 0
+        if side == "asks":
+            i = bisect_right(prices, price)
+            return sums[i - 1] if i else 0
+        i = bisect_left(prices, price)
+        return sums[-1] - (sums[i - 1] if i else 0)
+
+
+class OrderBooks():
+    """ Mirrors the order books of the markets the bots serve
+
+        :param GrapheneExchange dex: The exchange
+        :param AssetCache assets: Asset metadata
+        :param list markets: The markets
+        :param str separator: Market separator
+        :param int depth: Number of orders per side loaded on ``seed()``
+        :param float reseed_interval: Seconds after which the books are
+                                      stale and have to be loaded again
+
+        The books are loaded with ``get_limit_orders`` and then kept
+        current from the notifications of the market subscriptions:
+        changed limit orders (``update()``), removed orders and fills
+        (``apply()``, these are dropped by ``GrapheneWebsocketProtocol``
+        and have to be taken from the raw messages). ``ticker()``
+        provides the fields of ``returnTicker`` the bots use without
+        loading the market history.
+
+        Notifications missed while the subscriptions reconnect and the
+        orders beyond ``depth`` are not mirrored, so the books have to be
+        loaded again after every (re)connect of the subscriptions, every
+        ``reseed_interval`` seconds and once a side that was cut off at
+        ``depth`` is down to half of its orders (see ``stale()``).
+
+        .. code-block:: python
+
+            books = OrderBooks(dex, assets, ["USD : BTS"], " : ")
+            books.seed()
+            books["USD : BTS"].highest_bid
+            if books.stale():
+                books.seed()
+    """
+
+    def __init__(self, dex, assets, markets, separator, depth=100,
+                 reseed_interval=60 * 60):
+        self.dex = dex
+        self.assets = assets
+        self.depth = depth
+        self.reseed_interval = reseed_interval
+        #: Time of the last ``seed()`` (``None``: not loaded or invalid)
+        self.seeded = None
+        #: Sides that had more than ``depth`` orders on ``seed()``
+        #: (``{market: set(sides)}``)
+        self.truncated = {}
+        self.books = {}
+        #: Markets per pair of asset ids
+        self.pairs = {}
+        #: Bitasset data objects that carry the settlement price of a
+        #: market (``{market: bitasset_data_id}``)
+        self.feeds = {}
+        for market in markets:
+            quote_name, base_name = market.split(separator)
+            quote = assets.get_asset(quote_name)
+            base = assets.get_asset(base_name)
+            self.books[market] = OrderBook(quote, base)
+            self.pairs[frozenset([quote["id"], base["id"]])] = market
+            for asset, other in ((quote, base), (base, quote)):
+                if ("bitasset_data_id" in asset and
+                        assets.backing_asset_id(asset["symbol"]) == other["id"]):
+                    self.feeds[market] = asset["bitasset_data_id"]
+
+    def __getitem__(self, market):
+        return self.books[market]
+
+    def __contains__(self, market):
+        return market in self.books
+
+    def seed(self):
+        """ Load the books and the last fill of every market
+        """
+        self.seeded = None
+        for market, book in self.books.items():
+            book.clear()
+            for order in self.dex.ws.get_limit_orders(book.quote["id"], book.base["id"], self.depth):
+                book.update(order)
+            self.truncated[market] = set(side for side in ("bids", "asks")
+                                         if self._orders(book, side) >= self.depth)
+            filled = self.dex.ws.get_fill_order_history(book.quote["id"], book.base["id"], 1, api="history")
+            if filled:
+                book.fill(filled[0]["op"])
+        self.seeded = time.time()
+        log.info("Order books loaded: %s", ", ".join(
+            "%s (%d orders)" % (m, len(b.orders)) for m, b in sorted(self.books.items())))
+
+    @staticmethod
+    def _orders(book, side):
+        return sum(book.counts[side].values())
+
+    def invalidate(self):
+        """ Mark the books as stale (e.g. after notifications were lost)
+        """
+        self.seeded = None
+
+    def stale(self):
+        """ Whether the books have to be loaded again: they were never
+            loaded or invalidated, are older than ``reseed_interval`` or
+            a side that was cut off at ``depth`` is down to half of its
+            orders (the orders behind it are unknown)
+        """
+        if self.seeded is None or time.time() - self.seeded >= self.reseed_interval:
+            return True
+        return any(self._orders(self.books[market], side) < self.depth / 2
+                   for market, sides in self.truncated.items() for side in sides)
+
+    def update(self, order):
+        """ Apply a changed limit order (object ``1.7.x``)
+
+            :return: The market of the order (``None`` if not mirrored)
+        """
+        if "sell_price" not in order:
+            return None
+        price = order["sell_price"]
+        market = self.pairs.get(frozenset([price["base"]["asset_id"], price["quote"]["asset_id"]]))
+        if market is not None:
+            self.books[market].update(order)
+        return market
+
+    def apply(self, items):
+        """ Apply the removals (order ids) and fills (``[[4, op],
+            result]``) of a market notification
+        """
+        for item in items:
+            if isinstance(item, str):
+                if item.startswith("1.7."):
+                    for book in self.books.values():
+                        if item in book.orders:
+                            book.remove(item)
+                            break
+            elif isinstance(item, list) and item and isinstance(item[0], list):
+                op_type, op = item[0][0], item[0][1]
+                market = self.pairs.get(frozenset([op["pays"]["asset_id"], op["receives"]["asset_id"]]))
+                if op_type == 4 and market is not None:
+                    self.books[market].fill(op)
+
+    def _feed_price(self, market, feed):
+        """ Settlement price of a feed in base per quote
+        """
+        book = self.books[market]
+        price = feed["settlement_price"]
+        if price["base"]["asset_id"] == book.base["id"]:
+            base, quote = price["base"], price["quote"]
+        else:
+            base, quote = price["quote"], price["base"]
+        quote_amount = book._amount(quote["amount"], book.quote)
+        if quote_amount > 0:
+            return book._amount(base["amount"], book.base) / quote_amount
+        return None
+
+    def ticker(self):
+        """ ``highestBid``, ``lowestAsk``, ``last`` and
+            ``settlement_price`` of all markets (as in ``returnTicker``,
+            -1 if there is no bid, ask or fill). The settlement prices
+            are loaded with a single ``get_objects`` call.
+        """
+        ids = sorted(set(self.feeds.values()))
+        objects = dict(zip(ids, self.dex.ws.get_objects(ids))) if ids else {}
+        r = {}
+        for market, book in self.books.items():
+            data = {"highestBid": book.highest_bid or -1,
+                    "lowestAsk": book.lowest_ask or -1,
+                    "last": book.last if book.last is not None else -1}
+            if market in self.feeds:
+                bitasset = objects.get(self.feeds[market])
+                if bitasset and bitasset.get("current_feed"):
+                    price = self._feed_price(market, bitasset["current_feed"])
+                    if price:
+                        data["settlement_price"] = price
+            r[market] = data
+        return r
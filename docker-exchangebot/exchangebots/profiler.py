@@ -0,0 +1,228 @@
+from contextlib import contextmanager
+from collections import Counter
+from logger import get_logger
+import cProfile
+import marshal
+import signal
+import time
+import os
+
+log = get_logger("profiler")
+
+
+class BlockProfiler():
+    """ Profiles the block loop of the bots on demand
+
+        :param str directory: Directory the profiles are written to
+        :param int blocks: Number of blocks to profile once enabled
+        :param str mode: ``deterministic`` (``cProfile``) or
+                         ``sampling`` (stack samples)
+        :param float interval: Seconds between two samples (wall clock)
+        :param float min_share: Share of the profiled time below which
+                                the stacks of a deterministic profile
+                                are cut off
+
+        Both modes write the profile as ``.pstats`` (for ``pstats`` and
+        ``snakeviz``) and as collapsed stacks (``.collapsed``, for
+        flamegraphs, in microseconds). A deterministic profile only
+        knows the callers of every function, so its stacks are
+        reconstructed by splitting the time of a function between its
+        callees (down to ``min_share`` of the profiled time); the
+        stacks of a sampling profile carry the sections (``section()``),
+        its ``.pstats`` is derived from the samples.
+
+        The profiler is armed with ``enable()`` (e.g. from a signal
+        handler) and then profiles the next ``blocks`` calls of
+        ``block()``. While it is off, ``block()`` and ``section()`` only
+        check a flag.
+
+        .. code-block:: python
+
+            profiler = BlockProfiler("profiles", 10)
+            profiler.install_signal()      # kill -USR1 <pid>
+            with profiler.block("onBlock"):
+                with profiler.section("tick:LiquidityWall"):
+                    bot.tick()
+    """
+
+    def __init__(self, directory="profiles", blocks=10, mode="deterministic",
+                 interval=0.005, min_share=0.001):
+        if mode not in ("deterministic", "sampling"):
+            raise ValueError("Unknown profiling mode %s" % mode)
+        self.directory = directory
+        self.blocks = blocks
+        self.mode = mode
+        self.interval = interval
+        self.min_share = min_share
+        #: Blocks left to profile (0: off)
+        self.remaining = 0
+        self.running = False
+        self.profile = None
+        self.samples = Counter()
+        self.sections = []
+
+    def enable(self, blocks=None):
+        """ Profile the next ``blocks`` blocks
+        """
+        self.remaining = blocks or self.blocks
+
+    def install_signal(self, signum=getattr(signal, "SIGUSR1", None)):
+        """ Enable the profiler when the process receives ``signum``
+        """
+        if signum is not None:
+            signal.signal(signum, lambda *args: self.enable())
+
+    @contextmanager
+    def block(self, name):
+        """ Profile the enclosed code if the profiler is enabled. Every
+            call counts as one block.
+        """
+        if not self.remaining or self.sections:
+            # Off or nested in a block that is profiled already
+            yield
+            return
+        if not self.running:
+            self._start()
+        self.sections.append(name)
+        if self.profile:
+            self.profile.enable()
+        try:
+            yield
+        finally:
+            if self.profile:
+                self.profile.disable()
+            self.sections.pop()
+            self.remaining -= 1
+            if not self.remaining:
+                self._stop()
+
+    @contextmanager
+    def section(self, name):
+        """ Label the samples taken in the enclosed code with ``name``
+        """
+        if not self.running:
+            yield
+            return
+        self.sections.append(name)
+        try:
+            yield
+        finally:
+            self.sections.pop()
+
+    def _start(self):
+        self.running = True
+        if self.mode == "deterministic":
+            self.profile = cProfile.Profile()
+        else:
+            self.samples = Counter()
+            signal.signal(signal.SIGALRM, self._sample)
+            signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+
+    def _sample(self, signum, frame):
+        if not self.sections:
+            # Between two blocks
+            return
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+            frame = frame.f_back
+        self.samples[(tuple(self.sections), tuple(stack[::-1]))] += 1
+
+    @staticmethod
+    def _label(function):
+        filename, line, name = function
+        return "%s:%s:%d" % (os.path.basename(filename), name, line)
+
+    def _sampled_stats(self):
+        """ ``pstats`` data (``{function: (cc, nc, tt, ct, callers)}``)
+            of the samples, every sample counts ``interval`` seconds
+        """
+        stats = {}
+
+        def entry(function):
+            if function not in stats:
+                stats[function] = [0, 0, 0.0, 0.0, {}]
+            return stats[function]
+
+        for (_, stack), count in self.samples.items():
+            seconds = count * self.interval
+            entry(stack[-1])[2] += seconds
+            # Recursive functions count once per sample
+            for function in set(stack):
+                e = entry(function)
+                e[0] += count
+                e[1] += count
+                e[3] += seconds
+            for caller, function in set(zip(stack, stack[1:])):
+                edge = entry(function)[4].setdefault(caller, [0, 0, 0.0, 0.0])
+                edge[0] += count
+                edge[1] += count
+                edge[3] += seconds
+                if function == stack[-1]:
+                    edge[2] += seconds
+        return {function: (cc, nc, tt, ct, {caller: tuple(edge) for caller, edge in callers.items()})
+                for function, (cc, nc, tt, ct, callers) in stats.items()}
+
+    def _collapse(self, stats):
+        """ Collapsed stacks (microseconds) of a deterministic profile
+
+            The time of a function is split between its callees by the
+            edges of the call graph. Paths with less than ``min_share`` of
+            the profiled time are not followed further, their time counts
+            for the frame they branch off, so the number of stacks is
+            bounded by the depth times ``1 / min_share``.
+        """
+        labels = {function: self._label(function) for function in stats}
+        # Per function: share of its time spent in itself and per callee
+        # (the cumulative times of recursive calls overlap, so the shares
+        # of the callees are scaled to the time not spent in the function)
+        own = {function: min(tt / ct, 1.0) if ct else 1.0 for function, (_, _, tt, ct, _) in stats.items()}
+        callees = {}
+        for function, (_, _, _, _, callers) in stats.items():
+            for caller, edge in callers.items():
+                if caller in stats:
+                    callees.setdefault(caller, []).append((function, edge[3]))
+        for caller, edges in callees.items():
+            total = sum(ct for _, ct in edges)
+            callees[caller] = [(function, (1 - own[caller]) * ct / total if total else 0.0)
+                               for function, ct in edges]
+        roots = [function for function, entry in stats.items() if not entry[4]]
+        minimum = self.min_share * sum(stats[function][3] for function in roots)
+        stacks = Counter()
+        pending = [(labels[function], (function,), stats[function][3]) for function in roots]
+        while pending:
+            stack, functions, seconds = pending.pop()
+            remainder = seconds * own[functions[-1]]
+            for callee, share in callees.get(functions[-1], ()):
+                part = seconds * share
+                if part < minimum or callee in functions or len(functions) >= 200:
+                    remainder += part
+                else:
+                    pending.append((stack + ";" + labels[callee], functions + (callee,), part))
+            stacks[stack] += remainder * 1e6
+        return {stack: round(us) for stack, us in stacks.items() if round(us)}
+
+    def _stop(self):
+        self.running = False
+        os.makedirs(self.directory, exist_ok=True)
+        filename = os.path.join(self.directory, time.strftime("profile_%Y%m%d_%H%M%S"))
+        if self.mode == "deterministic":
+            self.profile.create_stats()
+            stats = self.profile.stats
+            stacks = self._collapse(stats)
+            self.profile = None
+        else:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, signal.SIG_DFL)
+            stats = self._sampled_stats()
+            stacks = Counter()
+            for (sections, stack), count in self.samples.items():
+                stacks[";".join(list(sections) + [self._label(f) for f in stack])] += \
+                    round(count * self.interval * 1e6)
+        with open(filename + ".pstats", "wb") as fp:
+            marshal.dump(stats, fp)
+        with open(filename + ".collapsed", "w") as fp:
+            for stack, value in sorted(stacks.items()):
+                fp.write("%s %d\n" % (stack, value))
+        log.info("Profile written to %s.pstats and %s.collapsed", filename, filename)
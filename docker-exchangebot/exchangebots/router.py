@@ -0,0 +1,172 @@
+from logger import get_logger
+
+log = get_logger("router")
+
+
+class NotificationRouter():
+    """ Routes websocket notifications to the bots that serve the
+        affected markets.
+
+        :param dict bots: The bots (``{name: strategy}``)
+        :param AssetCache assets: Asset metadata to map asset ids to
+                                  markets
+        :param str separator: Market separator
+
+        Notifications only mark the affected bots as *dirty*. All
+        notifications that arrive within one block are coalesced and
+        every dirty bot is refreshed (``loadMarket()`` and ``store()``)
+        only once on ``flush()``, which is called on the next block.
+        A bot that ticks marks the other bots of its markets as dirty
+        (``touch()``), they reload before their tick (``take()``) so that
+        they do not take its new orders for their own.
+
+        .. code-block:: python
+
+            router = NotificationRouter(bots, assets, " : ")
+            router.route_market(notice)
+            router.route_account(notice)
+            router.flush()
+            if router.take(name):
+                bots[name].loadMarket()
+    """
+
+    def __init__(self, bots, assets, separator):
+        self.bots = bots
+        self.dirty = set()
+        #: Names of the bots per market (pair of asset ids)
+        self.markets = {}
+        #: Names of the bots per market name
+        self.market_bots = {}
+        #: Names of the bots per asset id
+        self.asset_bots = {}
+        #: Names of the bots that watch the collateral per bitasset data
+        #: object (``2.4.x``)
+        self.bitasset_bots = {}
+        #: Names of the bots that watch the collateral
+        self.collateral_bots = set()
+        for name, bot in bots.items():
+            for market in bot.settings.get("markets", []):
+                ids = assets.market_ids(market, separator)
+                pair = frozenset([ids["quote"], ids["base"]])
+                self.markets.setdefault(pair, set()).add(name)
+                self.market_bots.setdefault(market, set()).add(name)
+                for asset_id in pair:
+                    self.asset_bots.setdefault(asset_id, set()).add(name)
+                if bot.watch_collateral:
+                    self.collateral_bots.add(name)
+                    for asset_id in pair:
+                        asset = assets.get_asset(asset_id)
+                        if "bitasset_data_id" in asset:
+                            self.bitasset_bots.setdefault(asset["bitasset_data_id"], set()).add(name)
+
+    def _price_assets(self, price):
+        return frozenset([price["base"]["asset_id"], price["quote"]["asset_id"]])
+
+    def route_market(self, notice):
+        """ Mark the bots that serve the market of a limit order
+            notification (``1.7.x``) as dirty
+
+            :return: Names of the affected bots
+            :rtype: set
+        """
+        if "sell_price" not in notice:
+            return set()
+        affected = self.markets.get(self._price_assets(notice["sell_price"]), set())
+        self.dirty |= affected
+        return affected
+
+    def route_account(self, notice):
+        """ Mark the bots affected by an object of the account as dirty
+
+            Limit orders (``1.7.x``) and call orders (``1.8.x``) touch
+            their market, balances (``2.5.x``) touch every market of
+            their asset. The account (``1.2.x``) and its statistics
+            (``2.6.x``) change with every operation of the account, the
+            orders and balances the operation touched are notified on
+            their own, so they do not mark any bot.
+
+            :return: Names of the affected bots
+            :rtype: set
+        """
+        if "sell_price" in notice:
+            return self.route_market(notice)
+        if "call_price" in notice:
+            affected = self.markets.get(self._price_assets(notice["call_price"]), set())
+            self._notify_collateral(affected, notice)
+        elif "asset_type" in notice:
+            affected = self.asset_bots.get(notice["asset_type"], set())
+        else:
+            affected = set()
+        self.dirty |= affected
+        return affected
+
+    def route_asset(self, notice):
+        """ Hand the notification of a bitasset data object (``2.4.x``,
+            e.g. a new settlement price) to the bots that watch the
+            collateral of its markets
+
+            :return: Names of the notified bots
+            :rtype: set
+        """
+        affected = self.bitasset_bots.get(notice.get("id"), set())
+        self._notify_collateral(affected, notice)
+        return affected
+
+    def route_removed(self, oid):
+        """ Mark the bots of the market of a removed (filled or
+            canceled) limit order of a bot (``1.7.x``) as dirty and hand
+            the id of a removed call order (``1.8.x``) to the bots that
+            watch the collateral
+
+            :return: Names of the affected bots
+            :rtype: set
+        """
+        affected = set()
+        if oid.startswith("1.7."):
+            for name, bot in self.bots.items():
+                for market in bot.settings.get("markets", []):
+                    if oid in bot.orders.ids(market):
+                        affected |= self.market_bots[market]
+            self.dirty |= affected
+        elif oid.startswith("1.8."):
+            self._notify_collateral(self.collateral_bots, oid)
+        return affected
+
+    def touch(self, markets, exclude=None):
+        """ Mark the bots serving ``markets`` (except ``exclude``) as
+            dirty, e.g. after a bot placed orders in them
+        """
+        for market in markets:
+            self.dirty |= self.market_bots.get(market, set()) - {exclude}
+
+    def touch_all(self):
+        """ Mark all bots as dirty (e.g. after notifications were lost)
+        """
+        self.dirty |= set(self.bots)
+
+    def take(self, name):
+        """ Whether ``name`` is dirty (it is no longer afterwards)
+        """
+        if name in self.dirty:
+            self.dirty.discard(name)
+            return True
+        return False
+
+    def _notify_collateral(self, names, notice):
+        for name in names:
+            if name in self.collateral_bots:
+                self.bots[name].onCollateralNotice(notice)
+
+    def flush(self):
+        """ Refresh every dirty bot once
+
+            :return: Names of the refreshed bots
+            :rtype: set
+        """
+        dirty, self.dirty = self.dirty, set()
+        if dirty:
+            log.debug("Market/Account Update! Notifying bots: %s", ", ".join(sorted(dirty)))
+        for name in dirty:
+            self.bots[name].loadMarket()
+            self.bots[name].store()
+        return dirty
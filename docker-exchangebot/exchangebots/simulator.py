@@ -0,0 +1,509 @@
+from collections import deque
+import calendar
+import copy
+import threading
+import time
+
+
+class SimulationError(Exception):
+    pass
+
+
+class SimulatedRPC():
+    """ The parts of the cli_wallet API (``dex.rpc``) the bots use:
+        asset lookups and builder transactions (see ``TransactionBatch``)
+    """
+
+    def __init__(self, exchange):
+        self.exchange = exchange
+        self.transactions = {}
+        self.handles = 0
+        # Transactions may be broadcast concurrently (see ``BulkCancel``)
+        self.lock = threading.Lock()
+
+    def is_locked(self):
+        return False
+
+    def get_asset(self, name):
+        return dict(self.exchange.get_asset(name))
+
+    def begin_builder_transaction(self):
+        with self.lock:
+            self.handles += 1
+            self.transactions[self.handles] = []
+            return self.handles
+
+    def add_operation_to_builder_transaction(self, handle, operation):
+        self.transactions[handle].append(operation)
+
+    def set_fees_on_builder_transaction(self, handle, asset):
+        pass
+
+    def sign_builder_transaction(self, handle, broadcast=True):
+        operations = self.transactions[handle]
+        if broadcast:
+            with self.lock:
+                self.exchange.apply_operations(operations)
+        return {"operations": operations}
+
+    def remove_builder_transaction(self, handle):
+        self.transactions.pop(handle, None)
+
+
+class SimulatedWebsocket():
+    """ The parts of the websocket API (``dex.ws``) the bots use
+    """
+
+    def __init__(self, exchange):
+        self.exchange = exchange
+
+    def lookup_asset_symbols(self, symbols):
+        return [dict(self.exchange.get_asset(s)) for s in symbols]
+
+    def get_objects(self, ids):
+        return [self.exchange.getObject(i) for i in ids]
+
+    def get_fill_order_history(self, a, b, limit, api=None):
+        history = self.exchange.history.get(frozenset([a, b]), [])
+        return list(reversed(list(history)[-limit:]))
+
+
+class SimulatedExchange():
+    """ In-memory exchange with the interface of ``GrapheneExchange``
+        that the bots use (``returnTicker``, ``returnOpenOrders(Ids)``,
+        ``returnBalances``, ``list_debt_positions``, ``buy``, ``sell``,
+        ``cancel``, ``borrow``, ``adjust_debt``, the fill history and
+        builder transactions).
+
+        :param dict assets: Assets of the simulation, e.g. ``{"BTS":
+                            {"precision": 5}, "USD": {"precision": 4,
+                            "backing_asset": "BTS"}}`` (bitassets name
+                            their ``backing_asset``)
+        :param list markets: Markets of the simulation (``quote : base``)
+        :param dict balances: Initial balances of the account
+        :param str separator: Market separator
+        :param int history_size: Number of fills kept per market
+
+        Only the orders of the account are kept in the order book. The
+        rest of the market is given by the recorded market data that is
+        replayed with ``advance()``:
+
+        * ``{"type": "trade", "market", "price", "amount", "side"}``: a
+          trade of the market. ``side`` is the side of the taker
+          (``buy`` takes asks, ``sell`` takes bids). The trade fills
+          the account's orders that are priced at least as good as the
+          trade, up to ``amount``.
+        * ``{"type": "ticker", "market", "highestBid", "lowestAsk"}``:
+          the top of the order book. Orders of the account that cross
+          it are filled completely at their own price. Until the first
+          ticker event of a market, bid and ask follow the last trade.
+        * ``{"type": "feed", "market", "settlement_price"}``: a new
+          price feed (``base`` per ``quote``) of the bitasset ``quote``
+
+        New orders that cross the top of the book are filled completely
+        at the best bid/ask. Fees and margin calls are not simulated.
+    """
+
+    core_asset = "BTS"
+
+    def __init__(self, assets, markets, balances, separator=" : ",
+                 account="simulated-bot", history_size=1000):
+        self.market_separator = separator
+        self.safe_mode = False
+        self.myAccount = {"id": "1.2.100", "name": account}
+        self.rpc = SimulatedRPC(self)
+        self.ws = SimulatedWebsocket(self)
+
+        self.assets = {}
+        self.asset_ids = {}
+        self.bitassets = {}
+        symbols = sorted(assets, key=lambda s: (s != self.core_asset, s))
+        for i, symbol in enumerate(symbols):
+            asset = {"id": "1.3.%d" % i, "symbol": symbol,
+                     "precision": assets[symbol].get("precision", 5)}
+            if "backing_asset" in assets[symbol]:
+                asset["bitasset_data_id"] = "2.4.%d" % i
+                self.bitassets[asset["bitasset_data_id"]] = symbol
+            self.assets[symbol] = asset
+            self.asset_ids[asset["id"]] = symbol
+        self.backing = {symbol: options["backing_asset"]
+                        for symbol, options in assets.items()
+                        if "backing_asset" in options}
+
+        self.markets = list(markets)
+        self.balances = {symbol: 0.0 for symbol in self.assets}
+        self.balances.update(balances)
+        self.time = time.time()
+        self.block_number = 0
+
+        #: Open orders of the account by id
+        self.orders = {}
+        self.order_count = 0
+        #: Debt positions of the account (``{symbol: {"debt", "collateral"}}``)
+        self.debts = {}
+        #: Feed prices (backing asset per bitasset)
+        self.feeds = {}
+        self.tickers = {market: {"last": -1, "highestBid": -1, "lowestAsk": -1,
+                                 "baseVolume": 0, "quoteVolume": 0, "percentChange": 0}
+                        for market in self.markets}
+        self.has_book = set()
+        self.history = {}
+        self.history_size = history_size
+        self.fill_count = 0
+        #: Fills of the account's orders
+        self.account_fills = []
+
+    # Assets
+    def get_asset(self, name):
+        symbol = self.asset_ids.get(name, name)
+        if symbol not in self.assets:
+            raise SimulationError("Unknown asset %s" % name)
+        return self.assets[symbol]
+
+    def getObject(self, oid):
+        if oid in self.bitassets:
+            symbol = self.bitassets[oid]
+            backing = self.get_asset(self.backing[symbol])
+            return {"id": oid,
+                    "options": {"short_backing_asset": backing["id"]},
+                    "current_feed": {"settlement_price": self.feeds.get(symbol)}}
+        if oid.startswith("1.7."):
+            return {"id": oid} if oid in self.orders else None
+        return dict(self.get_asset(oid))
+
+    def _split(self, market):
+        return market.split(self.market_separator)
+
+    def _units(self, amount, symbol):
+        return int(round(amount * 10 ** self.get_asset(symbol)["precision"]))
+
+    def _amount(self, units, symbol):
+        return units / 10 ** self.get_asset(symbol)["precision"]
+
+    def _get_price_filled(self, f, m):
+        """ Price of a fill in ``base`` per ``quote`` (same as
+            ``GrapheneExchange._get_price_filled``)
+        """
+        if f["op"]["receives"]["asset_id"] == m["base"]:
+            base, quote = f["op"]["receives"], f["op"]["pays"]
+        else:
+            base, quote = f["op"]["pays"], f["op"]["receives"]
+        quote_amount = self._amount(float(quote["amount"]), quote["asset_id"])
+        if quote_amount <= 0:
+            return None
+        return self._amount(float(base["amount"]), base["asset_id"]) / quote_amount
+
+    # Market data
+    def advance(self, block_number, timestamp, events=()):
+        """ Move the simulation to a new block and apply the market data
+            of that block
+
+            :param int block_number: Number of the block
+            :param float timestamp: Time of the block
+            :param list events: Market data (see class description)
+        """
+        self.block_number = block_number
+        self.time = timestamp
+        for oid in [oid for oid, o in self.orders.items() if o["expiration"] <= timestamp]:
+            self._remove(oid)
+        for event in events:
+            if event["type"] == "trade":
+                self.trade(event["market"], event["price"], event["amount"], event.get("side", "buy"))
+            elif event["type"] == "ticker":
+                self.set_book(event["market"], event["highestBid"], event["lowestAsk"])
+            elif event["type"] == "feed":
+                self.set_feed(event["market"], event["settlement_price"])
+            else:
+                raise SimulationError("Unknown event type %s" % event["type"])
+
+    def block(self):
+        """ Return the block notification (object ``2.1.0``) of the
+            current block
+        """
+        return {"id": "2.1.0", "head_block_number": self.block_number,
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(self.time))}
+
+    def set_feed(self, market, price):
+        quote, base = self._split(market)
+        if self.backing.get(quote) == base:
+            self.feeds[quote] = price
+        elif self.backing.get(base) == quote:
+            self.feeds[base] = 1 / price
+        else:
+            raise SimulationError("%s has no price feed" % market)
+
+    def set_book(self, market, bid, ask):
+        self.has_book.add(market)
+        ticker = self.tickers[market]
+        ticker["highestBid"], ticker["lowestAsk"] = bid, ask
+        for o in self._orders(market):
+            if ((o["type"] == "sell" and 0 < o["rate"] <= bid) or
+                    (o["type"] == "buy" and 0 < ask <= o["rate"])):
+                self._fill(o, o["amount"], o["rate"])
+
+    def trade(self, market, price, amount, side="buy"):
+        """ A trade of ``amount`` (quote) at ``price`` by a taker on
+            ``side``. Fills the orders of the account first.
+        """
+        if side == "buy":
+            orders = sorted((o for o in self._orders(market)
+                             if o["type"] == "sell" and o["rate"] <= price),
+                            key=lambda o: (o["rate"], o["seq"]))
+        else:
+            orders = sorted((o for o in self._orders(market)
+                             if o["type"] == "buy" and o["rate"] >= price),
+                            key=lambda o: (-o["rate"], o["seq"]))
+        remaining = amount
+        for o in orders:
+            if remaining <= 0:
+                break
+            filled = min(remaining, o["amount"])
+            self._fill(o, filled, o["rate"])
+            remaining -= filled
+        if remaining > 0:
+            self._record(market, price, remaining, None)
+        if market not in self.has_book:
+            self.tickers[market]["highestBid"] = self.tickers[market]["lowestAsk"] = price
+
+    def _orders(self, market):
+        return [o for o in list(self.orders.values()) if o["market"] == market]
+
+    def _record(self, market, price, amount, order):
+        """ Add a fill to the history of the market (one entry per side
+            as the history API does)
+        """
+        quote, base = self._split(market)
+        quote_asset, base_asset = self.get_asset(quote), self.get_asset(base)
+        quote_units = {"amount": self._units(amount, quote), "asset_id": quote_asset["id"]}
+        base_units = {"amount": self._units(amount * price, base), "asset_id": base_asset["id"]}
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(self.time))
+        history = self.history.setdefault(
+            frozenset([quote_asset["id"], base_asset["id"]]),
+            deque(maxlen=self.history_size))
+        sides = [(quote_units, base_units), (base_units, quote_units)]
+        for i, (pays, receives) in enumerate(sides):
+            self.fill_count += 1
+            mine = order is not None and (i == 0) == (order["type"] == "sell")
+            history.append({
+                "key": {"base": base_asset["id"], "quote": quote_asset["id"],
+                        "sequence": -self.fill_count},
+                "time": timestamp,
+                "op": {"fee": {"amount": 0, "asset_id": "1.3.0"},
+                       "order_id": order["orderNumber"] if mine else "1.7.0",
+                       "account_id": self.myAccount["id"] if mine else "1.2.0",
+                       "pays": pays,
+                       "receives": receives},
+            })
+        ticker = self.tickers[market]
+        ticker["last"] = price
+        ticker["quoteVolume"] += amount
+        ticker["baseVolume"] += amount * price
+
+    def _fill(self, order, amount, price):
+        quote, base = self._split(order["market"])
+        if order["type"] == "sell":
+            self.balances[base] += amount * price
+        else:
+            self.balances[quote] += amount
+            # Refund the difference if filled below the order's price
+            self.balances[base] += amount * (order["rate"] - price)
+        order["amount"] -= amount
+        self.account_fills.append({"time": self.time, "market": order["market"],
+                                   "type": order["type"], "price": price,
+                                   "amount": amount})
+        self._record(order["market"], price, amount, order)
+        if order["amount"] * 10 ** self.get_asset(quote)["precision"] < 1:
+            self._remove(order["orderNumber"])
+
+    def _remove(self, oid):
+        order = self.orders.pop(oid)
+        quote, base = self._split(order["market"])
+        if order["type"] == "sell":
+            self.balances[quote] += order["amount"]
+        else:
+            self.balances[base] += order["amount"] * order["rate"]
+
+    # Account data
+    def returnTicker(self):
+        r = {}
+        for market in self.markets:
+            data = dict(self.tickers[market])
+            quote, base = self._split(market)
+            if self.backing.get(quote) == base and quote in self.feeds:
+                data["settlement_price"] = self.feeds[quote]
+            elif self.backing.get(base) == quote and base in self.feeds:
+                data["settlement_price"] = 1 / self.feeds[base]
+            r[market] = data
+        return r
+
+    def returnOpenOrders(self):
+        r = {market: [] for market in self.markets}
+        for o in self.orders.values():
+            quote, base = self._split(o["market"])
+            r[o["market"]].append({
+                "orderNumber": o["orderNumber"],
+                "type": o["type"],
+                "rate": o["rate"],
+                "amount": o["amount"],
+                "total": o["amount"] * o["rate"],
+                "amount_to_sell": o["amount"] if o["type"] == "sell" else o["amount"] * o["rate"],
+            })
+        return r
+
+    def returnOpenOrdersIds(self):
+        return {market: [o["orderNumber"] for o in orders]
+                for market, orders in self.returnOpenOrders().items()}
+
+    def returnBalances(self):
+        return {symbol: amount for symbol, amount in self.balances.items() if amount > 0}
+
+    def list_debt_positions(self):
+        r = {}
+        for symbol, position in self.debts.items():
+            if not position["debt"] or symbol not in self.feeds:
+                continue
+            settlement_price = 1 / self.feeds[symbol]
+            r[symbol] = {"collateral_asset": self.backing[symbol],
+                         "collateral": position["collateral"],
+                         "debt": position["debt"],
+                         "call_price": position["collateral"] / position["debt"] / 1.75,
+                         "settlement_price": settlement_price,
+                         "ratio": position["collateral"] / position["debt"] * settlement_price}
+        return r
+
+    # Operations
+    def _take(self, symbol, amount):
+        if amount > self.balances.get(symbol, 0) + 1e-9:
+            raise SimulationError("Insufficient balance of %s: %f < %f" % (
+                symbol, self.balances.get(symbol, 0), amount))
+        self.balances[symbol] -= amount
+
+    def _place(self, market, side, rate, amount, expiration):
+        if market not in self.tickers:
+            raise SimulationError("Unknown market %s" % market)
+        quote, base = self._split(market)
+        amount = self._amount(int(amount * 10 ** self.get_asset(quote)["precision"]), quote)
+        if amount <= 0 or rate <= 0:
+            raise SimulationError("Invalid order %f @%f" % (amount, rate))
+        self._take(quote if side == "sell" else base,
+                   amount if side == "sell" else amount * rate)
+        self.order_count += 1
+        order = {"orderNumber": "1.7.%d" % self.order_count, "seq": self.order_count,
+                 "market": market, "type": side, "rate": rate, "amount": amount,
+                 "expiration": self.time + expiration}
+        self.orders[order["orderNumber"]] = order
+        ticker = self.tickers[market]
+        if side == "sell" and 0 < rate <= ticker["highestBid"]:
+            self._fill(order, amount, ticker["highestBid"])
+        elif side == "buy" and 0 < ticker["lowestAsk"] <= rate:
+            self._fill(order, amount, ticker["lowestAsk"])
+        return order["orderNumber"]
+
+    def sell(self, market, rate, amount, expiration=60 * 60 * 24):
+        return self._place(market, "sell", rate, amount, expiration)
+
+    def buy(self, market, rate, amount, expiration=60 * 60 * 24):
+        return self._place(market, "buy", rate, amount, expiration)
+
+    def cancel(self, orderNumber):
+        if orderNumber not in self.orders:
+            raise SimulationError("Order %s does not exist" % orderNumber)
+        self._remove(orderNumber)
+
+    def _update_debt(self, symbol, delta_debt, delta_collateral):
+        backing = self.backing[symbol]
+        position = self.debts.setdefault(symbol, {"debt": 0.0, "collateral": 0.0})
+        if position["debt"] + delta_debt < 0 or position["collateral"] + delta_collateral < 0:
+            raise SimulationError("Invalid debt update of %s" % symbol)
+        self._take(backing, delta_collateral)
+        self._take(symbol, -delta_debt)
+        position["debt"] += delta_debt
+        position["collateral"] += delta_collateral
+
+    def borrow(self, amount, symbol, collateral_ratio):
+        if symbol not in self.feeds:
+            raise SimulationError("%s has no price feed" % symbol)
+        self._update_debt(symbol, amount, amount * collateral_ratio * self.feeds[symbol])
+
+    def adjust_debt(self, delta_debt, symbol, new_collateral_ratio):
+        if symbol not in self.feeds:
+            raise SimulationError("%s has no price feed" % symbol)
+        position = self.debts.get(symbol, {"debt": 0.0, "collateral": 0.0})
+        debt = position["debt"] + delta_debt
+        collateral = debt * new_collateral_ratio * self.feeds[symbol]
+        self._update_debt(symbol, delta_debt, collateral - position["collateral"])
+
+    def apply_operations(self, operations):
+        """ Apply the operations of a builder transaction. Either all
+            operations are applied or none.
+        """
+        state = copy.deepcopy((self.balances, self.orders, self.debts, self.order_count))
+        try:
+            for op_id, op in operations:
+                if op_id == 1:
+                    sell = self.asset_ids[op["amount_to_sell"]["asset_id"]]
+                    receive = self.asset_ids[op["min_to_receive"]["asset_id"]]
+                    sell_amount = self._amount(op["amount_to_sell"]["amount"], sell)
+                    receive_amount = self._amount(op["min_to_receive"]["amount"], receive)
+                    # Relative to the wall clock the expiration was created with
+                    expiration = calendar.timegm(time.strptime(op["expiration"], "%Y-%m-%dT%H:%M:%S")) - time.time()
+                    market = sell + self.market_separator + receive
+                    if market in self.tickers:
+                        self.sell(market, receive_amount / sell_amount, sell_amount, expiration)
+                    else:
+                        market = receive + self.market_separator + sell
+                        self.buy(market, sell_amount / receive_amount, receive_amount, expiration)
+                elif op_id == 2:
+                    self.cancel(op["order"])
+                elif op_id == 3:
+                    symbol = self.asset_ids[op["delta_debt"]["asset_id"]]
+                    self._update_debt(symbol,
+                                      self._amount(op["delta_debt"]["amount"], symbol),
+                                      self._amount(op["delta_collateral"]["amount"],
+                                                   op["delta_collateral"]["asset_id"]))
+                else:
+                    raise SimulationError("Operation %d is not supported" % op_id)
+        except Exception:
+            self.balances, self.orders, self.debts, self.order_count = state
+            raise
+
+    def value(self, asset=None):
+        """ Value of the account (balances, open orders and debt
+            positions) denoted in ``asset`` (default: core asset) at the
+            last traded prices
+        """
+        asset = asset or self.core_asset
+        totals = dict(self.balances)
+        for o in self.orders.values():
+            quote, base = self._split(o["market"])
+            if o["type"] == "sell":
+                totals[quote] = totals.get(quote, 0) + o["amount"]
+            else:
+                totals[base] = totals.get(base, 0) + o["amount"] * o["rate"]
+        for symbol, position in self.debts.items():
+            totals[symbol] = totals.get(symbol, 0) - position["debt"]
+            backing = self.backing[symbol]
+            totals[backing] = totals.get(backing, 0) + position["collateral"]
+        value = 0
+        for symbol, amount in totals.items():
+            if amount:
+                value += amount * self.price(symbol, asset)
+        return value
+
+    def price(self, symbol, asset):
+        """ Last price of ``symbol`` denoted in ``asset``
+        """
+        if symbol == asset:
+            return 1.0
+        for market in self.markets:
+            quote, base = self._split(market)
+            last = self.tickers[market]["last"]
+            if last <= 0:
+                continue
+            if quote == symbol and base == asset:
+                return last
+            if quote == asset and base == symbol:
+                return 1 / last
+        if symbol in self.feeds and self.backing[symbol] == asset:
+            return self.feeds[symbol]
+        raise SimulationError("No price for %s in %s" % (symbol, asset))
@@ -0,0 +1,118 @@
+import calendar
+import time
+from types import MappingProxyType
+
+
+def freeze(data):
+    """ Return a read-only copy of ``data``. Dictionaries are turned
+        into mapping proxies and lists into tuples so that a snapshot
+        shared between several bots cannot be modified by any of them.
+    """
+    if isinstance(data, dict):
+        return MappingProxyType({key: freeze(value) for key, value in data.items()})
+    if isinstance(data, (list, tuple)):
+        return tuple(freeze(value) for value in data)
+    return data
+
+
+class BlockSnapshot():
+    """ Block-scoped view of the market and account data the bots read
+        from the DEX.
+
+        Every dataset is fetched lazily on first access and then kept
+        for the rest of the block, so that all bots that are notified
+        about the same block share one RPC call per dataset instead of
+        each bot pulling the same data again.
+
+        :param GrapheneExchange dex: The exchange to load the data from
+        :param json block: The block notification (object ``2.1.0``)
+                           the snapshot belongs to (optional)
+        :param OrderBooks books: Mirrored order books to take the
+                                 ticker from instead of
+                                 ``returnTicker`` (optional)
+
+        .. note:: The data is frozen (read-only). After the bot has
+                  changed its orders or debt positions, it needs to
+                  call ``invalidate()`` so that the affected datasets
+                  are reloaded on the next access.
+    """
+
+    #: Datasets and the ``GrapheneExchange`` calls that load them
+    datasets = {
+        "ticker": "returnTicker",
+        "open_orders": "returnOpenOrders",
+        "debt_positions": "list_debt_positions",
+        "balances": "returnBalances",
+    }
+
+    #: Datasets that change when the account places or cancels orders
+    #: or updates its debt positions
+    account_datasets = ["open_orders", "debt_positions", "balances"]
+
+    def __init__(self, dex, block=None, books=None):
+        self.dex = dex
+        self.books = books
+        self.block = block or {}
+        self.block_number = self.block.get("head_block_number")
+        if "time" in self.block:
+            self.time = calendar.timegm(time.strptime(self.block["time"], "%Y-%m-%dT%H:%M:%S"))
+        else:
+            self.time = time.time()
+        self._data = {}
+
+    def get(self, name):
+        """ Return the dataset ``name`` and load it if it hasn't been
+            loaded in this block yet
+
+            :param str name: Name of the dataset (see ``datasets``)
+        """
+        if name not in self._data:
+            if name == "ticker" and self.books is not None:
+                self._data[name] = freeze(self.books.ticker())
+            else:
+                self._data[name] = freeze(getattr(self.dex, self.datasets[name])())
+        return self._data[name]
+
+    def invalidate(self, *names):
+        """ Drop datasets so that they are reloaded on the next access.
+            Without arguments, all account related datasets are
+            dropped.
+        """
+        if not names:
+            names = self.account_datasets
+        for name in names:
+            self._data.pop(name, None)
+            if name == "open_orders":
+                self._data.pop("open_order_ids", None)
+
+    @property
+    def ticker(self):
+        """ ``dex.returnTicker()`` (or ``books.ticker()``) """
+        return self.get("ticker")
+
+    @property
+    def open_orders(self):
+        """ ``dex.returnOpenOrders()`` """
+        return self.get("open_orders")
+
+    @property
+    def open_order_ids(self):
+        """ Same as ``dex.returnOpenOrdersIds()`` but derived from
+            ``open_orders`` which requires the same RPC call
+        """
+        if "open_order_ids" not in self._data:
+            self._data["open_order_ids"] = freeze({
+                market: [o["orderNumber"] for o in orders]
+                for market, orders in self.open_orders.items()
+            })
+        return self._data["open_order_ids"]
+
+    @property
+    def debt_positions(self):
+        """ ``dex.list_debt_positions()`` """
+        return self.get("debt_positions")
+
+    @property
+    def balances(self):
+        """ ``dex.returnBalances()`` """
+        return self.get("balances")
@@ -0,0 +1,72 @@
+from contextlib import contextmanager
+from logger import get_logger
+import time
+
+log = get_logger("startup")
+
+
+def wait_for(probe, name, timeout=120, delay=0.1, max_delay=2.0):
+    """ Call ``probe()`` until it succeeds (returns without raising) and
+        return its result. The delay between two attempts starts at
+        ``delay`` seconds and doubles up to ``max_delay``.
+
+        :param function probe: Checks whether the service is ready
+        :param str name: Name of the service (for the log)
+        :param float timeout: Seconds after which the last error is
+                              raised
+    """
+    deadline = time.time() + timeout
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            return probe()
+        except Exception as e:
+            if time.time() + delay > deadline:
+                raise
+            if attempts == 1:
+                log.info("Waiting for %s: %s", name, e)
+        time.sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+
+class StartupTimer():
+    """ Measures the phases of the startup
+
+        .. code-block:: python
+
+            timer = StartupTimer()
+            with timer.phase("connect"):
+                dex = GrapheneExchange(...)
+            timer.report()
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.time() - start))
+
+    def report(self):
+        """ Print the duration of every phase
+        """
+        log.info("Startup took %.2fs (%s)", time.time() - self.start,
+                 ", ".join("%s %.2fs" % phase for phase in self.phases))
+
+
+def prefetch_markets(assets, bots, separator):
+    """ Load the assets and bitassets of the markets of all bots with
+        batched calls (see ``AssetCache.prefetch()``) so that the bots
+        verify their markets against the warm cache
+    """
+    symbols = set()
+    for bot in bots.values():
+        for market in bot.settings.get("markets", []):
+            symbols.update(market.split(separator))
+    assets.prefetch(sorted(symbols))
@@ -1,4 +1,11 @@
 from grapheneexchange import GrapheneExchange
+from snapshot import BlockSnapshot
+from assetcache import AssetCache
+from batch import TransactionBatch
+from bulkcancel import BulkCancel, CancelReport
+from ledger import AccountLedger
+from logger import get_logger
+from .orderindex import OrderIndex
 import json
 import os
 
@@ -23,8 +30,16 @@ class BaseStrategy():
                  distinguish its own orders from others!
     """
 
+    #: Receive the notifications of the bitassets (``2.4.x``) and call
+    #: orders (``1.8.x``) of the bot's markets (see
+    #: ``onCollateralNotice()``)
+    watch_collateral = False
+
     def __init__(self, *args, **kwargs):
         self.state = {"orders" : {}}
+        self.orders = OrderIndex()
+        self.snapshot = None
+        self.batch = None
 
         for arg in args :
             if isinstance(arg, GrapheneExchange):
@@ -35,9 +50,24 @@ class BaseStrategy():
         if "name" not in kwargs:
             raise MissingSettingsException("Missing parameter 'name'!")
 
-        self.filename = "data_%s.json" % self.name
+        if not hasattr(self, "assets"):
+            self.assets = AssetCache(self.dex)
+
+        if not hasattr(self, "fill_store"):
+            self.fill_store = None
+
+        if not hasattr(self, "ledger"):
+            self.ledger = AccountLedger(self.config.market_separator,
+                                        getattr(self.config, "ledger_reconcile_blocks", 100))
+        #: Ledger updates of the operations in the current batch
+        #: (``{operation index: (method, args)}``)
+        self.batch_ledger = {}
+
+        if not hasattr(self, "filename"):
+            self.filename = "data_%s.json" % self.name
+        self.log = get_logger("strategy.%s" % self.name)
         self.settings = self.config.bots[self.name]
-        self.opened_orders = []
+        self.opened_orders = {}
         self.restore()
 
         if "markets" not in self.settings:
@@ -52,19 +82,10 @@ class BaseStrategy():
             :rtype: number
 
         """
-        numCanceled = 0
-        curOrders = self.dex.returnOpenOrders()
-        for m in self.settings["markets"]:
-            if m in curOrders:
-                for o in curOrders[m]:
-                    if o["type"] is side or side is "both":
-                        try :
-                            print("Canceling %s" % o["orderNumber"])
-                            self.dex.cancel(o["orderNumber"])
-                            numCanceled += 1
-                        except:
-                            print("An error has occured when trying to cancel order %s!" % o)
-        return numCanceled
+        curOrders = self.getSnapshot().open_orders
+        return len(self.bulk_cancel(
+            o["orderNumber"] for m in self.settings["markets"] if m in curOrders
+            for o in curOrders[m] if o["type"] == side or side == "both").canceled)
 
     def cancel_mine(self, side="both") :
         """ Cancel only the orders of this particular bot in all markets
@@ -74,20 +95,15 @@ class BaseStrategy():
             :return: number of canceld orders
             :rtype: number
         """
-        curOrders = self.dex.returnOpenOrders()
-        state = self.getState()
-        numCanceled = 0
-        for o in state["orders"]:
-            for m in self.settings["markets"]:
-                if o in curOrders[m] :
-                    if o["type"] is side or side is "both":
-                        try :
-                            print("Canceling %s" % o["orderNumber"])
-                            self.dex.cancel(o["orderNumber"])
-                            numCanceled += 1
-                        except:
-                            print("An error has occured when trying to cancel order %s!" % o["orderNumber"])
-        return numCanceled
+        curOrders = self.getSnapshot().open_orders
+        targets = []
+        for m in self.settings["markets"]:
+            if m not in curOrders:
+                continue
+            mine = self.orders.ids(m)
+            targets.extend(o["orderNumber"] for o in curOrders[m]
+                           if o["orderNumber"] in mine and (o["type"] == side or side == "both"))
+        return len(self.bulk_cancel(targets).canceled)
 
     def cancel_this_markets(self, side="both") :
         """ Cancel all orders in all markets of that are served by this
@@ -97,18 +113,57 @@ class BaseStrategy():
             :return: number of canceld orders
             :rtype: number
         """
-        orders = self.dex.returnOpenOrders()
-        numCanceled = 0
-        for m in self.settings["markets"]:
-            for o in orders[m]:
-                if o["type"] is side or side is "both":
-                    try :
-                        print("Canceling %s" % o["orderNumber"])
-                        self.dex.cancel(o["orderNumber"])
-                        numCanceled += 1
-                    except:
-                        print("An error has occured when trying to cancel order %s!" % o["orderNumber"])
-        return numCanceled
+        orders = self.getSnapshot().open_orders
+        return len(self.bulk_cancel(
+            o["orderNumber"] for m in self.settings["markets"]
+            for o in orders[m] if o["type"] == side or side == "both").canceled)
+
+    def bulk_cancel(self, orderNumbers):
+        """ Cancel many orders right away (regardless of the current
+            batch) with batched and concurrent transactions (see
+            ``BulkCancel``)
+
+            :param list orderNumbers: The order ids (``1.7.x``)
+            :rtype: CancelReport
+        """
+        bulk = BulkCancel.configured(self.dex, self.assets, self.config)
+        for orderNumber in orderNumbers:
+            bulk.add(orderNumber)
+        if not len(bulk):
+            return CancelReport()
+        report = bulk.run()
+        for orderNumber in report.canceled:
+            self.ledger.cancelled(orderNumber)
+        self.getSnapshot().invalidate()
+        return report
+
+    def cancel(self, order, market=None):
+        """ Cancel a single order (or add the cancelation to the current
+            batch, see ``beginBatch()``)
+
+            :param order: Order as returned by ``returnOpenOrders`` or
+                          the order id (``1.7.x``)
+            :param str market: Market of the order (optional, allows to
+                               account for the funds freed by the
+                               cancelation)
+        """
+        if isinstance(order, str):
+            orderNumber, release = order, None
+        else:
+            orderNumber, release = order["orderNumber"], None
+            if market:
+                quote, base = market.split(self.config.market_separator)
+                if order["type"] == "sell":
+                    release = {quote: order["amount"]}
+                else:
+                    release = {base: order["total"]}
+        if self.batch is not None:
+            self.batch_ledger[len(self.batch)] = ("cancelled", (orderNumber,))
+            self.batch.cancel(orderNumber, release)
+        else:
+            self.dex.cancel(orderNumber)
+            self.ledger.cancelled(orderNumber)
+            self.getSnapshot().invalidate()
 
     def cancel_all_sell_orders(self):
         """ alias for ``self.cancel_all("sell")``
@@ -154,6 +209,7 @@ class BaseStrategy():
         """ Return the stored state of the bot. This includes the
             ``orders`` that have been placed by this bot
         """
+        self.state["orders"] = self.orders.to_state()
         return self.state
 
     def setState(self, key, value):
@@ -170,32 +226,98 @@ class BaseStrategy():
             :param json state: the new state that overwrites the current state
         """
         self.state = state
+        self.orders = OrderIndex(state.get("orders"))
+
+    def beginBatch(self):
+        """ Collect all orders, cancelations and debt updates of this bot
+            until ``commitBatch()`` is called and broadcast them as a
+            single transaction. Can be turned off with
+            ``batch_transactions = False`` in the configuration.
+        """
+        if getattr(self.config, "batch_transactions", True):
+            self.batch = TransactionBatch(self.dex, self.assets)
+
+    def commitBatch(self):
+        """ Broadcast the operations collected since ``beginBatch()``
+
+            :return: outcome of every operation (see ``TransactionBatch.broadcast()``)
+            :rtype: list
+        """
+        batch, self.batch = self.batch, None
+        updates, self.batch_ledger = self.batch_ledger, {}
+        if not batch:
+            return []
+        results = batch.broadcast()
+        for i, result in enumerate(results):
+            if result["error"]:
+                self.log.warning("Operation '%s' failed: %s", result["operation"], result["error"])
+            elif i in updates:
+                method, args = updates[i]
+                getattr(self.ledger, method)(*args)
+        if results:
+            self.getSnapshot().invalidate()
+        return results
+
+    def getBalances(self):
+        """ Return the free balances of the account (kept by the
+            account ledger) including the changes of the operations that
+            are pending in the current batch. A shard of a bot (see
+            ``supervisor.shards()``) only gets its ``funds_shares``.
+        """
+        self.ledger.sync(self.getSnapshot())
+        balances = self.ledger.balances()
+        shares = self.settings.get("funds_shares")
+        if shares:
+            balances = {symbol: amount * shares.get(symbol, 1)
+                        for symbol, amount in balances.items()}
+        if not self.batch or not self.batch.balance_deltas:
+            return balances
+        balances = dict(balances)
+        for symbol, delta in self.batch.balance_deltas.items():
+            balances[symbol] = balances.get(symbol, 0) + delta
+        return balances
+
+    def getSnapshot(self):
+        """ Return the snapshot of the current block that is shared by
+            all bots. Outside of the block loop (e.g. in ``init()``) a
+            fresh snapshot is taken on first use.
+        """
+        if self.snapshot is None:
+            self.snapshot = BlockSnapshot(self.dex)
+        return self.snapshot
+
+    def setSnapshot(self, snapshot):
+        """ Set the snapshot of the current block
+
+            :param BlockSnapshot snapshot: the new snapshot
+        """
+        self.snapshot = snapshot
 
     def store(self):
         """ Evaluate the changes (orders) made by the bot and store the
             state on disk.
         """
-        state = self.getState()
-        myorders = state["orders"]
-        curOrders = self.dex.returnOpenOrdersIds()
+        curOrders = self.getSnapshot().open_order_ids
         for market in self.settings["markets"] :
-            if market not in myorders:
-                myorders[market] = []
+            mine = self.orders.ids(market)
             if market in curOrders:
-                for orderid in curOrders[market] :
-                    if market not in self.opened_orders or \
-                            orderid not in self.opened_orders[market] :
-                        myorders[market].append(orderid)
-                        self.orderPlaced(orderid)
+                _, placed = self.orders.diff(
+                    market, set(curOrders[market]),
+                    self.opened_orders.get(market, set()))
+                for orderid in placed - mine:
+                    self.orders.add(market, orderid)
+                    self.orderPlaced(orderid)
 
-        state["orders"] = myorders
+        state = self.getState()
+        if not self.filename:
+            return
         with open(self.filename, 'w') as fp:
             json.dump(state, fp)
 
     def restore(self):
         """ Restore the data stored on the disk
         """
-        if os.path.isfile(self.filename) :
+        if self.filename and os.path.isfile(self.filename) :
             with open(self.filename, 'r') as fp:
                 state = json.load(fp)
                 self.setFullState(state)
@@ -206,20 +328,21 @@ class BaseStrategy():
             longer open (i.e. fully filled)
         """
         #: Load Open Orders for the markets and store them for later
-        self.opened_orders = self.dex.returnOpenOrdersIds()
+        snapshot = self.getSnapshot()
+        self.opened_orders = {market: set(ids) for market, ids in snapshot.open_order_ids.items()}
 
         #: Have orders been matched?
-        old_orders = self.getState()["orders"]
-        cur_orders = self.dex.returnOpenOrdersIds()
         for market in self.settings["markets"] :
-            if market in old_orders:
-                for orderid in old_orders[market] :
-                    if orderid not in cur_orders[market] :
-                        # Remove it from the state
-                        self.state["orders"][market].remove(orderid)
-                        # Execute orderFilled call
-                        if notify :
-                            self.orderFilled(orderid)
+            if market not in self.opened_orders:
+                continue
+            filled, _ = self.orders.diff(market, self.opened_orders[market])
+            for orderid in filled:
+                # Remove it from the state
+                self.orders.remove(market, orderid)
+                # Execute orderFilled call
+                if notify :
+                    self.orderFilled(orderid)
+            self.orders.update_records(market, snapshot.open_orders[market])
 
     def sell(self, market, price, amount, expiration=60*60*24):
         """ Places a sell order in a given market (sell ``quote``, buy
@@ -244,8 +367,15 @@ class BaseStrategy():
                 That way you can multiply prices with `1.05` to get a +5%.
         """
         quote, base = market.split(self.config.market_separator)
-        print(" - Selling %f %s for %s @%f %s/%s" % (amount, quote, base, price, base, quote))
-        self.dex.sell(market, price, amount, expiration)
+        self.log.info("Selling %f %s for %s @%f %s/%s", amount, quote, base, price, base, quote,
+                      extra={"market": market, "type": "sell", "rate": price, "amount": amount})
+        if self.batch is not None:
+            self.batch_ledger[len(self.batch)] = ("placed", (market, "sell", price, amount))
+            self.batch.sell(market, price, amount, expiration)
+        else:
+            self.dex.sell(market, price, amount, expiration)
+            self.ledger.placed(market, "sell", price, amount)
+            self.getSnapshot().invalidate()
 
     def buy(self, market, price, amount, expiration=60*60*24):
         """ Places a buy order in a given market (buy ``quote``, sell
@@ -270,25 +400,67 @@ class BaseStrategy():
                 That way you can multiply prices with `1.05` to get a +5%.
         """
         quote, base = market.split(self.config.market_separator)
-        print(" - Buying %f %s with %s @%f %s/%s" % (amount, quote, base, price, base, quote))
-        self.dex.buy(market, price, amount, expiration)
+        self.log.info("Buying %f %s with %s @%f %s/%s", amount, quote, base, price, base, quote,
+                      extra={"market": market, "type": "buy", "rate": price, "amount": amount})
+        if self.batch is not None:
+            self.batch_ledger[len(self.batch)] = ("placed", (market, "buy", price, amount))
+            self.batch.buy(market, price, amount, expiration)
+        else:
+            self.dex.buy(market, price, amount, expiration)
+            self.ledger.placed(market, "buy", price, amount)
+            self.getSnapshot().invalidate()
+
+    def borrow(self, amount, symbol, collateral_ratio, settlement_price):
+        """ Borrow ``amount`` of the bitasset ``symbol`` at a given
+            collateral ratio
+
+            :param float amount: Amount to borrow (denoted in ``symbol``)
+            :param str symbol: Asset to borrow
+            :param float collateral_ratio: Collateral ratio to borrow at
+            :param float settlement_price: Feed price denoted in the
+                                           backing asset per ``symbol``
+                                           (used for batched borrows)
+        """
+        if self.batch is not None:
+            self.batch.borrow(amount, symbol, collateral_ratio, settlement_price)
+        else:
+            self.dex.borrow(amount, symbol, collateral_ratio)
+            self.getSnapshot().invalidate()
+
+    def verify_markets(self):
+        """ Call ``verify_market()`` for every market of the bot that
+            has not been verified recently (the verified markets are
+            kept in the asset cache)
+        """
+        for market in self.settings["markets"]:
+            key = "%s %s" % (self.__class__.__name__, market)
+            if self.assets.is_verified(key):
+                continue
+            self.verify_market(market)
+            self.assets.mark_verified(key)
+
+    def verify_market(self, market):
+        """ Check that the bot can serve ``market``, raise an exception
+            otherwise
+        """
+        pass
 
     def init(self) :
         """ Initialize the bot's individual settings
         """
-        print("Init. Please define `%s.init()`" % self.name)
+        self.log.info("Init. Please define `%s.init()`", self.name)
 
     def tick(self) :
         """ Tick every block
         """
-        print("New block. Please define `%s.tick()`" % self.name)
+        self.log.info("New block. Please define `%s.tick()`", self.name)
 
     def orderFilled(self, oid):
         """ An order has been fully filled
 
             :param str oid: The order object id
         """
-        print("Order Filled. Please define `%s.orderFilled(%s)`" % (self.name, oid))
+        self.log.info("Order Filled. Please define `%s.orderFilled(%s)`", self.name, oid)
 
 #    def orderMatched(self, oid):
 #        """ An order has been machted / partially filled
@@ -302,4 +474,13 @@ class BaseStrategy():
 
             :param str oid: The order object id
         """
-        print("New Order. Please define `%s.orderPlaced(%s)`" % (self.name, oid))
+        self.log.info("New Order. Please define `%s.orderPlaced(%s)`", self.name, oid)
+
+    def onCollateralNotice(self, notice):
+        """ A bitasset (``2.4.x``) or a call order (``1.8.x``) of the
+            bot's markets has changed (only with ``watch_collateral``)
+
+            :param notice: The changed object or the id of a removed
+                           call order
+        """
+        pass
@@ -0,0 +1,150 @@
+class CollateralMonitor():
+    """ Keeps the debt positions of an account and the settlement prices
+        of their bitassets locally and tells which positions have left
+        the range between two collateral ratios
+
+        :param list symbols: Bitassets whose positions are monitored
+        :param float lower_threshold: Lowest acceptable collateral ratio
+        :param float upper_threshold: Highest acceptable collateral ratio
+
+        The collateral ratio of a position is ``collateral / debt *
+        settlement_price`` (the settlement price denoted in debt per
+        collateral as in ``list_debt_positions``). Instead of computing
+        the ratios on every check, the settlement prices at which each
+        position crosses the thresholds are computed whenever the
+        position changes, so that ``crossed()`` merely compares the
+        current settlement price against them.
+
+        The monitor is loaded from ``list_debt_positions`` (``load()``)
+        and kept current from the notifications of the call orders
+        (``1.8.x``) of the account and of the bitasset data (``2.4.x``)
+        that carries the settlement price (``notice()``).
+
+        .. code-block:: python
+
+            monitor = CollateralMonitor(["USD"], 2.3, 2.7)
+            monitor.load(dex.list_debt_positions())
+            monitor.notice(bitasset_notice, assets, account_id)
+            for symbol in monitor.crossed():
+                ...
+    """
+
+    def __init__(self, symbols, lower_threshold, upper_threshold):
+        self.symbols = set(symbols)
+        self.lower_threshold = lower_threshold
+        self.upper_threshold = upper_threshold
+        #: ``{symbol: {"collateral_asset", "collateral", "debt"}}``
+        self.positions = {}
+        #: Settlement price per bitasset (debt per collateral)
+        self.feeds = {}
+        #: Settlement prices at which the positions cross the lower and
+        #: the upper threshold (``{symbol: (lower, upper)}``)
+        self.bounds = {}
+        #: Symbols of the call orders (``{call order id: symbol}``)
+        self.call_orders = {}
+        #: Positions that were adjusted and whose update has not been
+        #: seen yet
+        self.pending = set()
+
+    def load(self, debt_positions):
+        """ Replace the positions and settlement prices with those of
+            ``list_debt_positions``
+        """
+        self.positions = {}
+        self.bounds = {}
+        self.pending = set()
+        for symbol, position in debt_positions.items():
+            if symbol not in self.symbols:
+                continue
+            self.feeds[symbol] = position["settlement_price"]
+            self.set_position(symbol, position["collateral_asset"],
+                              position["collateral"], position["debt"])
+
+    def set_position(self, symbol, collateral_asset, collateral, debt):
+        """ Store a position and compute its bounds
+        """
+        self.pending.discard(symbol)
+        if not debt:
+            self.positions.pop(symbol, None)
+            self.bounds.pop(symbol, None)
+            return
+        self.positions[symbol] = {"collateral_asset": collateral_asset,
+                                  "collateral": collateral, "debt": debt}
+        self.bounds[symbol] = (self.lower_threshold * debt / collateral if collateral else float("inf"),
+                               self.upper_threshold * debt / collateral if collateral else float("inf"))
+
+    def ratio(self, symbol):
+        """ Current collateral ratio of the position of ``symbol``
+        """
+        position = self.positions[symbol]
+        return position["collateral"] / position["debt"] * self.feeds[symbol]
+
+    def crossed(self):
+        """ Symbols of the positions whose collateral ratio is below the
+            lower or above the upper threshold (and that are not being
+            adjusted already)
+        """
+        return [symbol for symbol, (lower, upper) in self.bounds.items()
+                if symbol in self.feeds and symbol not in self.pending and
+                not lower <= self.feeds[symbol] <= upper]
+
+    def adjusting(self, symbol):
+        """ Skip ``symbol`` in ``crossed()`` until its position changes
+        """
+        self.pending.add(symbol)
+
+    def _price(self, price, assets, debt_id):
+        """ Price of a graphene price object in debt per collateral
+        """
+        if price["base"]["asset_id"] == debt_id:
+            debt, collateral = price["base"], price["quote"]
+        else:
+            debt, collateral = price["quote"], price["base"]
+        debt_amount = float(debt["amount"]) / 10 ** assets.get_asset(debt["asset_id"])["precision"]
+        collateral_amount = float(collateral["amount"]) / 10 ** assets.get_asset(collateral["asset_id"])["precision"]
+        if not collateral_amount:
+            return None
+        return debt_amount / collateral_amount
+
+    def notice(self, notice, assets, account_id):
+        """ Apply the notification of a bitasset (``2.4.x``, settlement
+            price) or of a call order (``1.8.x``) of ``account_id``
+
+            :param AssetCache assets: Asset metadata
+            :return: The symbol of the affected position (``None`` if the
+                     notification does not affect any)
+        """
+        oid = notice.get("id", "")
+        if oid.startswith("2.4.") and "current_feed" in notice:
+            symbol = assets.bitasset_symbol(oid)
+            if symbol not in self.symbols:
+                return None
+            debt_id = assets.get_asset(symbol)["id"]
+            price = self._price(notice["current_feed"]["settlement_price"], assets, debt_id)
+            if not price:
+                return None
+            self.feeds[symbol] = price
+            return symbol
+        if oid.startswith("1.8.") and notice.get("borrower") == account_id:
+            debt = notice["call_price"]["quote"]
+            collateral = notice["call_price"]["base"]
+            debt_asset = assets.get_asset(debt["asset_id"])
+            collateral_asset = assets.get_asset(collateral["asset_id"])
+            if debt_asset["symbol"] not in self.symbols:
+                return None
+            self.call_orders[oid] = debt_asset["symbol"]
+            self.set_position(debt_asset["symbol"], collateral_asset["symbol"],
+                              int(notice["collateral"]) / 10 ** collateral_asset["precision"],
+                              int(notice["debt"]) / 10 ** debt_asset["precision"])
+            return debt_asset["symbol"]
+        return None
+
+    def removed(self, oid):
+        """ Drop the position of a closed call order
+
+            :return: The symbol of the position (``None`` if unknown)
+        """
+        symbol = self.call_orders.pop(oid, None)
+        if symbol is not None:
+            self.set_position(symbol, None, 0, 0)
+        return symbol
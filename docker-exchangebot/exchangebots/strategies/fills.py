@@ -0,0 +1,262 @@
+import calendar
+import json
+import time
+from collections import deque
+
+
+class FillPriceEstimator():
+    """ Running aggregates over the fills of one market that allow to
+        derive the time weighted price of ``price_filled_orders()``
+        without re-scanning the fills on every query.
+
+        Fills are grouped into buckets of one second (the resolution of
+        the fill history) that carry the volume and the volume weighted
+        price sum of all fills in that second. Appending a fill is
+        O(1), expiring fills is amortized O(1) and the total volume and
+        the volume weighted average price are available in O(1).
+
+        The time weight ``1 / (time_weight_factor * seconds_ago)``
+        depends on the time of the query and, unlike an exponential
+        decay, cannot be split into a factor of ``now`` and a factor of
+        the time of a fill. The weighted price is therefore derived from
+        a second list of buckets that get coarser with their age: a
+        bucket is merged with the buckets before it as long as it spans
+        at most ``1 / resolution`` of its age, and counts as if all its
+        fills happened at their volume weighted mean time. There are
+        O(``resolution`` * log(``filled_order_age``)) of these buckets
+        (about 200 for a window of a day), ``price()`` costs one step
+        per bucket and is cached until either the query time or the
+        fills change. The error of the weight of a bucket is below
+        ``1 / (4 * resolution ** 2)`` (0.1%), the buckets of the last
+        ``resolution`` seconds are exact.
+
+        .. note:: ``time_weight_factor`` is part of both, the numerator
+                  and the denominator of the weighted average and thus
+                  cancels out. Fills of the current second are weighted
+                  as if they were one second old (instead of dividing
+                  by zero).
+    """
+
+    #: Minimum ratio of the age of a time bucket to its span
+    resolution = 16
+
+    def __init__(self):
+        #: ``[time, volume, volume * price]`` per second, oldest first
+        self.buckets = deque()
+        #: ``[first, last, volume, volume * price, volume * time,
+        #: seconds]`` of the time buckets, oldest first; every time
+        #: bucket holds the next ``seconds`` of ``buckets``
+        self.time_buckets = deque()
+        self.volume = 0
+        self.price_volume = 0.0
+        self._cache = None
+
+    def append(self, timestamp, price, volume, key=None):
+        """ Add a fill that is not older than the newest fill added
+
+            :param int timestamp: Time of the fill (unix timestamp)
+            :param float price: Price of the fill
+            :param number volume: Volume of the fill
+            :param str key: Identity of the fill (unused)
+        """
+        if self.buckets and self.buckets[-1][0] == timestamp:
+            bucket = self.buckets[-1]
+            bucket[1] += volume
+            bucket[2] += volume * price
+            bucket = self.time_buckets[-1]
+            bucket[2] += volume
+            bucket[3] += volume * price
+            bucket[4] += volume * timestamp
+        else:
+            self.buckets.append([timestamp, volume, volume * price])
+            self.time_buckets.append([timestamp, timestamp, volume, volume * price,
+                                      volume * timestamp, 1])
+        self.volume += volume
+        self.price_volume += volume * price
+        self._cache = None
+
+    def expire(self, oldest):
+        """ Drop all fills older than ``oldest``
+
+            :param float oldest: unix timestamp of the oldest fill to keep
+        """
+        while self.buckets and self.buckets[0][0] < oldest:
+            timestamp, volume, price_volume = self.buckets.popleft()
+            self.volume -= volume
+            self.price_volume -= price_volume
+            bucket = self.time_buckets[0]
+            bucket[5] -= 1
+            if bucket[5]:
+                bucket[0] = self.buckets[0][0]
+                bucket[2] -= volume
+                bucket[3] -= price_volume
+                bucket[4] -= volume * timestamp
+            else:
+                self.time_buckets.popleft()
+            self._cache = None
+        if not self.buckets:
+            # Don't carry float rounding errors into the next fills
+            self.volume = 0
+            self.price_volume = 0.0
+
+    def vwap(self):
+        """ Volume weighted average price of all fills (or ``None``)
+        """
+        if not self.volume:
+            return None
+        return self.price_volume / self.volume
+
+    def _coarsen(self, now):
+        """ Merge the time buckets that span at most ``1 / resolution``
+            of their age at ``now``
+        """
+        merged = []
+        for bucket in self.time_buckets:
+            limit = (now - bucket[1]) / self.resolution
+            while merged and bucket[1] - merged[-1][0] <= limit:
+                older = merged.pop()
+                bucket = [older[0], bucket[1]] + [x + y for x, y in zip(older[2:], bucket[2:])]
+            merged.append(bucket)
+        if len(merged) < len(self.time_buckets):
+            self.time_buckets = deque(merged)
+
+    def price(self, now):
+        """ Time weighted price of all fills at time ``now`` (or
+            ``None`` if there are no fills)
+
+            :param float now: unix timestamp of the query
+        """
+        if self._cache is not None and self._cache[0] == now:
+            return self._cache[1]
+        self._coarsen(now)
+        price_weight_total = 0.0
+        weight_total = 0.0
+        for _, _, volume, price_volume, time_volume, _ in self.time_buckets:
+            if not volume:
+                continue
+            seconds_ago = max(now - time_volume / volume, 1)
+            price_weight_total += price_volume / seconds_ago
+            weight_total += volume / seconds_ago
+        price = price_weight_total / weight_total if weight_total else None
+        self._cache = (now, price)
+        return price
+
+
+class FillTracker():
+    """ Incrementally ingests the fill history of a single market.
+
+        The tracker remembers the newest fill it has seen and only
+        parses fills that are newer than that. Because the history API
+        has no "since" parameter, the tracker asks for a small page
+        once it has caught up and only widens the page (up to the
+        maximum of the API) if the whole page turned out to be new.
+
+        Fills older than ``max_age`` seconds are dropped. The fills
+        within that window are kept in a ``FillPriceEstimator`` (or in
+        the ``estimator`` given, e.g. ``FillStore.estimator()``).
+
+        :param GrapheneExchange dex: The exchange to load the fills from
+        :param str quote_id: Object id of the quote asset
+        :param str base_id: Object id of the base asset
+        :param int max_age: Maximum age (in seconds) a fill is kept for
+        :param estimator: Receives the fills (``append()``,
+                          ``expire()``) and prices them
+    """
+
+    #: Number of fills requested once the tracker has caught up
+    page_size = 50
+
+    #: Maximum number of fills the history API returns per call
+    max_page_size = 1000
+
+    def __init__(self, dex, quote_id, base_id, max_age, estimator=None):
+        self.dex = dex
+        self.quote_id = quote_id
+        self.base_id = base_id
+        self.market = {"base": base_id, "quote": quote_id}
+        self.max_age = max_age
+
+        #: Running aggregates of the fills within ``max_age``
+        self.estimator = estimator or FillPriceEstimator()
+
+        #: Time of the newest fill seen (as returned by the API) and the
+        #: keys of all fills seen within that second
+        self.newest_time = None
+        self.newest_keys = set()
+
+    def update(self, now=None):
+        """ Pull the fills that are newer than the ones seen so far and
+            drop the expired ones
+
+            :param float now: Current (block) time as unix timestamp
+            :return: number of new fills
+            :rtype: number
+        """
+        if now is None:
+            now = time.time()
+        cutoff = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(now - self.max_age))
+        limit = self.max_page_size if self.newest_time is None else self.page_size
+        while True:
+            history = self.dex.ws.get_fill_order_history(
+                self.quote_id, self.base_id, limit, api="history")
+            new, complete = self._new_fills(history, cutoff)
+            if complete or len(history) < limit or limit >= self.max_page_size:
+                break
+            limit = min(limit * 4, self.max_page_size)
+
+        # History comes newest first, the estimator expects oldest first
+        for order in reversed(new):
+            fill = self.parse(order)
+            self.estimator.append(fill["time"], fill["price"], fill["volume"], self._key(order))
+        if new:
+            newest_time = new[0]["time"]
+            if newest_time != self.newest_time:
+                self.newest_time = newest_time
+                self.newest_keys = set()
+            self.newest_keys.update(
+                self._key(o) for o in new if o["time"] == newest_time)
+
+        self.expire(now)
+        return len(new)
+
+    def _key(self, order):
+        """ Identity of a fill, used to tell apart fills that happened
+            in the same second
+        """
+        return json.dumps(order.get("key", order["op"]), sort_keys=True)
+
+    def _new_fills(self, history, cutoff):
+        """ Return the fills of ``history`` that have not been seen yet
+            (newest first) and whether the page reached known or
+            expired fills
+        """
+        new = []
+        for order in history:
+            # Timestamps are ISO formated and thus compare as strings
+            if order["time"] < cutoff:
+                return new, True
+            if self.newest_time is not None:
+                if order["time"] < self.newest_time:
+                    return new, True
+                if (order["time"] == self.newest_time and
+                        self._key(order) in self.newest_keys):
+                    continue
+            new.append(order)
+        return new, len(new) < len(history)
+
+    def parse(self, order):
+        """ Turn a fill from the history API into a price record
+
+            :param json order: Fill as returned by ``get_fill_order_history``
+        """
+        op = order["op"]
+        return {
+            "price": self.dex._get_price_filled(order, self.market),
+            "time": calendar.timegm(time.strptime(order["time"], "%Y-%m-%dT%H:%M:%S")),
+            "volume": op['pays']['amount'] if op['pays']['asset_id'] == self.quote_id else op['receives']['amount']
+        }
+
+    def expire(self, now):
+        """ Drop all fills older than ``max_age`` seconds
+        """
+        self.estimator.expire(now - self.max_age)
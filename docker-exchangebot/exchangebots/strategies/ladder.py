@@ -0,0 +1,153 @@
+import numpy as np
+
+
+class Ladder():
+    """ Computes the orders of multi-level buy/sell walls for many
+        markets at once
+
+        :param int levels: Number of orders per side
+        :param float spread: Distance (in percent) between the innermost
+                             sell and buy orders (``spread_percentage``)
+        :param float spacing: Distance (in percent of the base price)
+                              between two levels of a side
+        :param str distribution: How the amount of a side is divided
+                                 across its levels: ``flat`` (equal
+                                 amounts), ``linear`` or ``exponential``
+        :param float factor: For ``linear`` and ``exponential``, the
+                             amount of the outermost level relative to
+                             the innermost level
+
+        All markets and levels are computed as arrays of shape
+        ``(markets, levels)`` in a single pass, per-market loops only
+        remain for turning the result into order dictionaries.
+
+        .. code-block:: python
+
+            ladder = Ladder(10, 2, 0.5, "exponential", 3)
+            orders = ladder.orders(["EUR : BTS"], prices, sell_funds,
+                                   buy_funds, minimums, precisions)
+    """
+
+    distributions = ["flat", "linear", "exponential"]
+
+    def __init__(self, levels=1, spread=2, spacing=1, distribution="flat", factor=1.0):
+        if distribution not in self.distributions:
+            raise ValueError("Unknown level distribution '%s'" % distribution)
+        self.levels = max(1, int(levels))
+        self.spread = spread
+        self.spacing = spacing
+        self.distribution = distribution
+        self.factor = factor
+
+        steps = np.arange(self.levels)
+        #: Offset of every level from the base price (fraction)
+        self.offsets = self.spread / 200 + self.spacing / 100 * steps
+        #: Share of every level in the amount of its side
+        self.weights = self._weights(steps)
+
+    def _weights(self, steps):
+        position = steps / max(1, self.levels - 1)
+        if self.distribution == "linear":
+            weights = 1 + (self.factor - 1) * position
+        elif self.distribution == "exponential":
+            weights = self.factor ** position
+        else:
+            weights = np.ones(self.levels)
+        return weights / weights.sum()
+
+    def prices(self, base_prices):
+        """ Prices of all levels
+
+            :param numpy.array base_prices: Price per market
+            :return: ``(sell, buy)`` with shape ``(markets, levels)``,
+                     buy prices that would not be positive are ``nan``
+        """
+        base_prices = np.asarray(base_prices, dtype=float)[:, None]
+        sell = base_prices * (1 + self.offsets)
+        buy = base_prices * (1 - self.offsets)
+        buy[buy <= 0] = np.nan
+        return sell, buy
+
+    def amounts(self, sell_prices, buy_prices, sell_funds, buy_funds,
+                symmetric=False, caps=None):
+        """ Amounts (in quote) of all levels
+
+            :param numpy.array sell_funds: Quote per market for the sell
+                                           side (0 for none)
+            :param numpy.array buy_funds: Base per market for the buy side
+                                          (0 for none)
+            :param bool symmetric: Put the same amount of quote on both
+                                   sides (of markets that have funds for
+                                   both)
+            :param numpy.array caps: Maximum total amount (quote) per side
+                                     and market (``inf`` for none)
+            :return: ``(sell, buy)`` with shape ``(markets, levels)``
+
+            The weights of the levels divide the quote of the sell side
+            and the base of the buy side, so that every buy level spends
+            its share of the base at its own price.
+        """
+        sell_funds = np.asarray(sell_funds, dtype=float)
+        buy_funds = np.asarray(buy_funds, dtype=float)
+        # Quote every buy level buys with its share of the base
+        buy_levels = buy_funds[:, None] * self.weights / buy_prices
+        buy_levels[~np.isfinite(buy_levels)] = 0
+        buy_totals = buy_levels.sum(axis=1)
+
+        sell_totals = sell_funds
+        if symmetric:
+            both = (sell_funds > 0) & (buy_totals > 0)
+            common = np.minimum(sell_funds, buy_totals)
+            sell_totals = np.where(both, common, sell_totals)
+            target_buy = np.where(both, common, buy_totals)
+        else:
+            target_buy = buy_totals
+        if caps is not None:
+            caps = np.asarray(caps, dtype=float)
+            sell_totals = np.minimum(sell_totals, caps)
+            target_buy = np.minimum(target_buy, caps)
+
+        buy_scale = np.divide(target_buy, buy_totals, out=np.zeros_like(buy_totals),
+                              where=buy_totals > 0)
+        return sell_totals[:, None] * self.weights, buy_levels * buy_scale[:, None]
+
+    def orders(self, markets, base_prices, sell_funds, buy_funds, minimums,
+               precisions, symmetric=False, caps=None):
+        """ The orders of all markets
+
+            :param list markets: The markets
+            :param list base_prices: Price per market (``None`` or 0 for
+                                     markets without a price)
+            :param list sell_funds: Quote per market for the sell side
+            :param list buy_funds: Base per market for the buy side
+            :param list minimums: Minimum amount (quote) of an order per
+                                  market
+            :param list precisions: Precision of the quote per market
+            :return: ``{market: [{"type", "rate", "amount"}]}`` (without
+                     markets that have no price). Amounts are rounded
+                     down to the precision of the quote, levels below
+                     the minimum are left out.
+            :rtype: dict
+        """
+        base_prices = np.array([p or np.nan for p in base_prices], dtype=float)
+        sell_prices, buy_prices = self.prices(base_prices)
+        sell, buy = self.amounts(sell_prices, buy_prices, sell_funds, buy_funds,
+                                 symmetric, caps)
+
+        scale = 10.0 ** np.asarray(precisions, dtype=float)[:, None]
+        sell = np.floor(sell * scale + 1e-9) / scale
+        buy = np.floor(buy * scale + 1e-9) / scale
+        minimums = np.asarray(minimums, dtype=float)[:, None]
+        sell_ok = (sell >= minimums) & (sell > 0) & np.isfinite(sell_prices)
+        buy_ok = (buy >= minimums) & (buy > 0) & np.isfinite(buy_prices)
+
+        result = {}
+        for i, market in enumerate(markets):
+            if np.isnan(base_prices[i]):
+                continue
+            orders = [{"type": "sell", "rate": float(r), "amount": float(a)}
+                      for r, a in zip(sell_prices[i][sell_ok[i]], sell[i][sell_ok[i]])]
+            orders.extend({"type": "buy", "rate": float(r), "amount": float(a)}
+                          for r, a in zip(buy_prices[i][buy_ok[i]], buy[i][buy_ok[i]]))
+            result[market] = orders
+        return result
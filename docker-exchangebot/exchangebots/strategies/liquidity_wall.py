@@ -1,7 +1,11 @@
-import math
 from datetime import datetime
 import time
+import logging
 from .basestrategy import BaseStrategy, MissingSettingsException
+from .fills import FillTracker
+from .pricing import PriceEngine
+from .reconcile import OrderReconciler
+from .ladder import Ladder
 
 
 class LiquiditySellBuyWalls(BaseStrategy):
@@ -14,10 +18,17 @@ class LiquiditySellBuyWalls(BaseStrategy):
         * **minimum_amounts**: the minimum amount an order has to be
         * **target_price**: target_price to place walls around (floating number or "feed")
         * **spread_percentage**: Another "offset". Allows a spread. The lowest orders will be placed here
+        * **levels**: Number of orders per side (default: 1)
+        * **level_spacing_percentage**: Distance between two levels of a side (default: 1)
+        * **level_distribution**: How the amount of a side is divided across its levels: "flat", "linear" or "exponential" (default: "flat")
+        * **level_factor**: Amount of the outermost level relative to the innermost level for "linear" and "exponential" (default: 1)
+        * **maximum_amounts**: the maximum total amount of the orders of one side (quote, optional)
         * **allowed_spread_percentage**: The allowed spread an order may have before it gets replaced
+        * **allowed_amount_percentage**: How much (%) the amount of an order may differ from the desired amount before it gets replaced
         * **volume_percentage**: The amount of funds (%) you want to use
         * **expiration**: Expiration time of the order in seconds
         * **ratio**: The desired collateral ratio (same as maintain_collateral_ratio.py)
+        * **replace_orders**: Place and replace the walls on every tick (default: False, only the target prices are logged)
 
 
         * **skip_blocks**: Runs the bot logic only every x blocks
@@ -32,7 +43,12 @@ class LiquiditySellBuyWalls(BaseStrategy):
                                  "minimum_amounts" : ["USD" : 0.2]
                                  "target_price" : "feed",
                                  "spread_percentage" : 5,
+                                 "levels" : 10,
+                                 "level_spacing_percentage" : 0.5,
+                                 "level_distribution" : "exponential",
+                                 "level_factor" : 3,
                                  "allowed_spread_percentage" : 2.5,
+                                 "allowed_amount_percentage" : 10,
                                  "volume_percentage" : 10,
                                  "symmetric_sides" : True,
                                  "expiration" : 60 * 60 * 6
@@ -43,10 +59,10 @@ class LiquiditySellBuyWalls(BaseStrategy):
 
     """
 
-    block_counter = -1
-
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.fill_trackers = {}
+        self.price_engine = PriceEngine(self)
 
     def init(self):
         """ Set default settings
@@ -72,6 +88,38 @@ class LiquiditySellBuyWalls(BaseStrategy):
         if "skip_blocks" not in self.settings:
             self.settings["skip_blocks"] = 20
 
+        if "allowed_amount_percentage" not in self.settings:
+            self.settings["allowed_amount_percentage"] = 10
+
+        if "levels" not in self.settings:
+            self.settings["levels"] = 1
+
+        if "level_spacing_percentage" not in self.settings:
+            self.settings["level_spacing_percentage"] = 1
+
+        if "level_distribution" not in self.settings:
+            self.settings["level_distribution"] = "flat"
+
+        if "level_factor" not in self.settings:
+            self.settings["level_factor"] = 1.0
+
+        if "maximum_amounts" not in self.settings:
+            self.settings["maximum_amounts"] = {}
+
+        if "replace_orders" not in self.settings:
+            self.settings["replace_orders"] = False
+
+        self.ladder = Ladder(
+            self.settings["levels"],
+            self.settings["spread_percentage"],
+            self.settings["level_spacing_percentage"],
+            self.settings["level_distribution"],
+            self.settings["level_factor"])
+
+        self.reconciler = OrderReconciler(
+            self.settings["allowed_spread_percentage"] / 2,
+            self.settings["allowed_amount_percentage"])
+
         if "ratio" not in self.settings:
             raise MissingSettingsException("ratio")
 
@@ -84,154 +132,187 @@ class LiquiditySellBuyWalls(BaseStrategy):
         if "expiration" not in self.settings:
             self.settings["expiration"] = 60*60*24*7
 
-        """ Verify that the markets are against the assets
-        """
-        for market in self.settings["markets"]:
-            quote_name, base_name = market.split(self.dex.market_separator)
-            quote = self.dex.rpc.get_asset(quote_name)
-            base = self.dex.rpc.get_asset(base_name)
-            if "bitasset_data_id" not in quote:
-                raise ValueError(
-                    "The quote asset %s is not a bitasset "
-                    "and thus can't be borrowed" % quote_name
-                )
-            collateral_asset_id = self.dex.getObject(
-                quote["bitasset_data_id"]
-            )["options"]["short_backing_asset"]
-            assert collateral_asset_id == base["id"], Exception(
-                "Collateral asset of %s doesn't match" % quote_name
-            )
-
-        self.update_data()
+        self.verify_markets()
 
         """ Check if there are no existing debt positions, creating the initial positions if none exist
         """
         if self.settings['borrow']:
+            self.ticker = self.getSnapshot().ticker
+            self.debt_positions = self.getSnapshot().debt_positions
             if len(self.debt_positions) == 0:
                 self.place_initial_debt_positions()
 
-        # Execute 1 tick before the websocket is activated
-        self.tick()
+        # The first tick follows in the first block (see ``BlockScheduler``)
+
+    def verify_market(self, market):
+        """ Verify that the market is against the asset backing the quote
+        """
+        quote_name, base_name = market.split(self.dex.market_separator)
+        quote = self.assets.get_asset(quote_name)
+        base = self.assets.get_asset(base_name)
+        if "bitasset_data_id" not in quote:
+            raise ValueError(
+                "The quote asset %s is not a bitasset "
+                "and thus can't be borrowed" % quote_name
+            )
+        collateral_asset_id = self.assets.backing_asset_id(quote_name)
+        assert collateral_asset_id == base["id"], Exception(
+            "Collateral asset of %s doesn't match" % quote_name
+        )
 
     def update_data(self):
-        self.ticker = self.dex.returnTicker()
-        self.open_orders = self.dex.returnOpenOrders()
-        self.debt_positions = self.dex.list_debt_positions()
-        self.balances = self.dex.returnBalances()
+        """ Take the market and account data from the block snapshot
+            that is shared by all bots
+        """
+        snapshot = self.getSnapshot()
+        self.ticker = snapshot.ticker
+        self.open_orders = snapshot.open_orders
+        self.debt_positions = snapshot.debt_positions
+        self.balances = self.getBalances()
         self.filled_orders = self.get_filled_orders()
+        self.price_engine.reset()
 
     def tick(self):
-        self.block_counter += 1
-        if (self.block_counter % self.settings["skip_blocks"]) == 0:
-            print("%s | Amount of blocks since bot has been started: %d" % (datetime.now(), self.block_counter))
-            self.update_data()
-            print("bid ask SILVER : BTS", self.price_bid_ask("SILVER : BTS"))
-            print("feed SILVER : BTS", self.price_feed("SILVER : BTS"))
-            print("filled SILVER : BTS", self.price_filled_orders("SILVER : BTS"))
-            print("last SILVER : BTS", self.price_last("SILVER : BTS"))
-            print("avg weighted SILVER : BTS", self.get_price("SILVER : BTS"))
-            #for market in self.settings["markets"]:
-                #self.check_and_replace(market)
-
-    def check_and_replace(self, market):
+        """ Called by the scheduler every ``skip_blocks`` blocks
+        """
+        self.update_data()
+        if not self.settings["replace_orders"]:
+            for market in self.settings["markets"]:
+                self.log.info("Target price of %s: %s", market, self.get_price(market),
+                              extra={"market": market})
+            return
+        walls = self.desired_walls(self.get_available_funds())
+        for market in self.settings["markets"]:
+            self.check_and_replace(market, walls)
+
+    def check_and_replace(self, market, walls=None):
+        """ Bring the open orders of ``market`` in line with the desired
+            orders. Orders within ``allowed_spread_percentage`` / 2 of the
+            desired price and ``allowed_amount_percentage`` of the desired
+            amount stay on the book, all others are replaced.
+
+            :param dict walls: The desired orders of all markets (see
+                               ``desired_walls()``)
+        """
+        replaced = False
         if market in self.open_orders:
-            if len(self.open_orders[market]) == 0:
-                self.place_orders(market)
-            if len(self.open_orders[market]) == 1:
-                if self.open_orders[market][0]['type'] == "sell":
-                    self.place_orders(market, only_buy=True)
-                elif self.open_orders[market][0]['type'] == "buy":
-                    self.place_orders(market, only_sell=True)
-            for o in self.open_orders[market]:
-                order_feed_spread = math.fabs((o["rate"] - self.ticker[market]["settlement_price"]) / self.ticker[market]["settlement_price"] * 100)
-                print("%s | Order: %s is %.3f%% away from feed" % (datetime.now(), o['orderNumber'], order_feed_spread))
-                if order_feed_spread <= self.settings["allowed_spread_percentage"] / 2 or order_feed_spread >= (self.settings["allowed_spread_percentage"] + self.settings["spread_percentage"]) / 2:
-                    self.cancel_orders(market)
-                    self.place_orders(market)
-                    return True
+            if walls is None:
+                walls = self.desired_walls(self.get_available_funds())
+            desired = walls.get(market)
+            if desired is not None:
+                keep, cancel, create = self.reconciler.reconcile(desired, self.open_orders[market])
+                if self.log.isEnabledFor(logging.DEBUG):
+                    for o in keep:
+                        self.log.debug("Order: %s is kept at %f", o['orderNumber'], o['rate'])
+                for o in cancel:
+                    try:
+                        self.log.info("Cancelling %s", o["orderNumber"])
+                        self.cancel(o, market)
+                    except Exception:
+                        self.log.exception("An error has occured when trying to cancel order %s!", o["orderNumber"])
+                self.create_orders(market, create)
+                replaced = bool(cancel or create)
         if self.settings['borrow']:
             symbol, base = market.split(self.dex.market_separator)
             if symbol not in self.debt_positions:
                 debt_amounts = self.get_debt_amounts()
                 amount = debt_amounts[symbol]
-                print("%s | Placing debt position for %s of %4.f" % (datetime.now(), symbol, amount))
-                self.dex.borrow(amount, symbol, self.settings["ratio"])
-            return False
+                self.log.info("Placing debt position for %s of %4.f", symbol, amount)
+                self.borrow(amount, symbol, self.settings["ratio"], self.ticker[market]['settlement_price'])
+        return replaced
 
     def orderFilled(self, oid):
-        print("%s | Order %s filled or cancelled" % (datetime.now(), oid))
+        self.log.info("Order %s filled or cancelled", oid)
 
     def orderPlaced(self, oid):
-        print("%s | Order %s placed." % (datetime.now(), oid))
+        self.log.info("Order %s placed.", oid)
 
     def place_orders(self, market='all', only_sell=False, only_buy=False):
-        if market != "all":
-            balances = self.dex.returnBalances()
-            asset_ids = []
-            amounts = {}
-            for single_market in self.settings["markets"]:
-                quote, base = single_market.split(self.config.market_separator)
-                asset_ids.append(base)
-                asset_ids.append(quote)
-            assets_unique = list(set(asset_ids))
-            for a in assets_unique:
-                if a in balances:
-                    amounts[a] = balances[a] * self.settings["volume_percentage"] / 100 / asset_ids.count(a)
-
-            base_price = self.get_price(market)
-            if not base_price:
-                print("%s | No price for %s" % (datetime.now(), market))
-                return
-
-            buy_price = base_price * (1.0 - self.settings["spread_percentage"] / 200)
-            sell_price = base_price * (1.0 + self.settings["spread_percentage"] / 200)
-
-            quote, base = market.split(self.config.market_separator)
-            if quote in amounts and not only_buy:
-                if "symmetric_sides" in self.settings and self.settings["symmetric_sides"] and not only_sell:
-                    amount = min([amounts[quote], amounts[base] / buy_price]) if base in amounts else amounts[quote]
-                    if amount >= self.settings['minimum_amounts'][quote]:
-                        self.sell(market, sell_price, amount, self.settings["expiration"])
-                else :
-                    amount = amounts[quote]
-                    if amount >= self.settings['minimum_amounts'][quote]:
-                        self.sell(market, sell_price, amount, self.settings["expiration"])
-            if base in amounts and not only_sell:
-                if "symmetric_sides" in self.settings and self.settings["symmetric_sides"] and not only_buy:
-                    amount = min([amounts[quote], amounts[base] / buy_price]) if quote in amounts else amounts[base] / buy_price
-                    if amount >= self.settings['minimum_amounts'][quote]:
-                        self.buy(market, buy_price, amount, self.settings["expiration"])
-                else:
-                    amount = amounts[base] / buy_price
-                    if amount >= self.settings['minimum_amounts'][quote]:
-                        self.buy(market, buy_price, amount, self.settings["expiration"])
-        else:
-            for market in self.settings["markets"]:
-                self.place_orders(market)
+        walls = self.desired_walls(self.getBalances(), only_sell, only_buy)
+        for m in self.settings["markets"]:
+            if market in ("all", m) and m in walls:
+                self.create_orders(m, walls[m])
+
+    def create_orders(self, market, orders):
+        """ Place the given desired orders
+        """
+        for o in orders:
+            if o["type"] == "sell":
+                self.sell(market, o["rate"], o["amount"], self.settings["expiration"])
+            else:
+                self.buy(market, o["rate"], o["amount"], self.settings["expiration"])
+
+    def get_available_funds(self):
+        """ Free balances plus the funds that are locked in the open
+            orders of the bot's markets, i.e. the funds the walls can be
+            built from if all orders are replaced
+        """
+        funds = dict(self.getBalances())
+        for market in self.settings["markets"]:
+            for symbol, amount in self.ledger.committed_in(market).items():
+                funds[symbol] = funds.get(symbol, 0) + amount
+        return funds
+
+    def desired_walls(self, balances, only_sell=False, only_buy=False):
+        """ Return the orders that should be on the books of all markets
+            of the bot, computed in one pass (see ``Ladder``)
+
+            :param json balances: Funds to place the orders from. Every
+                                  asset is divided equally between the
+                                  markets it is traded in.
+            :return: ``{market: [{"type", "rate", "amount"}]}`` (without
+                     the markets that have no price)
+            :rtype: dict
+        """
+        markets = self.settings["markets"]
+        pairs = [m.split(self.config.market_separator) for m in markets]
+        counts = {}
+        for quote, base in pairs:
+            counts[quote] = counts.get(quote, 0) + 1
+            counts[base] = counts.get(base, 0) + 1
+        amounts = {a: balances[a] * self.settings["volume_percentage"] / 100 / counts[a]
+                   for a in counts if a in balances}
+
+        prices = []
+        for market in markets:
+            price = self.get_price(market)
+            if not price:
+                self.log.warning("No price for %s", market)
+            prices.append(price)
+
+        return self.ladder.orders(
+            markets, prices,
+            [0 if only_buy else amounts.get(quote, 0) for quote, base in pairs],
+            [0 if only_sell else amounts.get(base, 0) for quote, base in pairs],
+            [self.settings["minimum_amounts"][quote] for quote, base in pairs],
+            [self.assets.get_asset(quote)["precision"] for quote, base in pairs],
+            self.settings["symmetric_sides"] and not only_sell and not only_buy,
+            [self.settings["maximum_amounts"].get(quote, float("inf")) for quote, base in pairs])
 
     def cancel_orders(self, market='all'):
         """ Cancel all orders for all markets or a specific market
         """
-        print("%s | Cancelling orders for %s market(s)" % (datetime.now(), market))
+        self.log.info("Cancelling orders for %s market(s)", market)
 
         if market != 'all':
             for order in self.open_orders[market]:
                 try:
-                    print("Cancelling %s" % order["orderNumber"])
-                    self.dex.cancel(order["orderNumber"])
-                except Exception as e:
-                    print("An error has occured when trying to cancel order %s!" % order)
-                    print(e)
+                    self.log.info("Cancelling %s", order["orderNumber"])
+                    self.cancel(order, market)
+                except Exception:
+                    self.log.exception("An error has occured when trying to cancel order %s!", order["orderNumber"])
         else:
             for market in self.settings["markets"]:
                 self.cancel_orders(market)
 
     def place_initial_debt_positions(self):
         debt_amounts = self.get_debt_amounts()
-        print("%s | No debt positions, placing them... " % datetime.now())
-        for symbol, amount in debt_amounts.items():
-            print("%s | Placing debt position for %s of %4.f" % (datetime.now(), symbol, amount))
-            self.dex.borrow(amount, symbol, self.settings["ratio"])
+        self.log.info("No debt positions, placing them... ")
+        for m in self.settings["markets"]:
+            symbol = m.split(self.config.market_separator)[0]
+            amount = debt_amounts[symbol]
+            self.log.info("Placing debt position for %s of %4.f", symbol, amount)
+            self.borrow(amount, symbol, self.settings["ratio"], self.ticker[m]['settlement_price'])
 
     def get_debt_amounts(self,):
         total_bts = self.get_total_bts()
@@ -243,13 +324,10 @@ class LiquiditySellBuyWalls(BaseStrategy):
         return quote_amounts
 
     def get_total_bts(self):
-        total_collateral = sum([value['collateral'] for key, value in self.debt_positions.items() if value['collateral_asset'] == "BTS"])
-        order_list = []
-        for market in self.open_orders:
-            order_list.extend(self.open_orders[market])
-        bts_on_orderbook = sum([order['total'] for order in order_list if order['type'] == 'buy'])
-        total_bts = total_collateral + self.balances["BTS"] + bts_on_orderbook
-        return total_bts
+        """ Free BTS plus the BTS in buy orders and debt collateral
+        """
+        self.ledger.sync(self.getSnapshot())
+        return self.ledger.total("BTS")
 
     def formatTimeFromNow(self, secs=0):
         """ Properly Format Time that is `x` seconds in the future
@@ -261,42 +339,33 @@ class LiquiditySellBuyWalls(BaseStrategy):
         return datetime.utcfromtimestamp(time.time() + int(secs)).strftime('%Y-%m-%dT%H:%M:%S')
 
     def get_filled_orders(self):
+        """ Update the fill trackers of all markets and return their
+            price estimators
+        """
+        now = self.getSnapshot().time
         filled_orders_markets = {}
         for market in self.settings["markets"]:
-            quote_symbol, base_symbol = market.split(self.config.market_separator)
-            base_id = self.dex.rpc.get_asset(base_symbol)['id']
-            quote_id = self.dex.rpc.get_asset(quote_symbol)['id']
-            m = {"base": base_id, "quote": quote_id}
-            filled_orders = self.dex.ws.get_fill_order_history(quote_id, base_id, 1000, api="history")
-            price_list = []
-            for order in filled_orders:
-                timestamp = datetime.strptime(order['time'], "%Y-%m-%dT%H:%M:%S")
-                seconds_ago = (datetime.now() - timestamp).total_seconds()
-                op = order['op']
-                if seconds_ago <= self.settings["filled_order_age"]:
-                    price_data = {
-                        "price": self.dex._get_price_filled(order, m),
-                        "seconds_ago": (datetime.now() - timestamp).total_seconds(),
-                        "volume": op['pays']['amount'] if op['pays']['asset_id'] == quote_id else op['receives']['amount']
-                    }
-                    price_list.append(price_data)
-            filled_orders_markets[market] = price_list
+            if market not in self.fill_trackers:
+                m = self.assets.market_ids(market, self.config.market_separator)
+                self.fill_trackers[market] = FillTracker(
+                    self.dex, m["quote"], m["base"], self.settings["filled_order_age"],
+                    self.fill_store.estimator(m["quote"], m["base"]) if self.fill_store else None)
+            tracker = self.fill_trackers[market]
+            tracker.update(now)
+            filled_orders_markets[market] = tracker.estimator
         return filled_orders_markets
 
     def price_filled_orders(self, market):
-        price_list = self.filled_orders[market]
-        price_weight_total = sum([order['volume'] * (1 / (self.settings["time_weight_factor"] * order['seconds_ago'])) * order['price'] for order in price_list])
-        weight_total = sum([order['volume'] * (1 / (self.settings["time_weight_factor"] * order['seconds_ago'])) for order in price_list])
-        volume_total = sum([order['volume'] for order in price_list])
-        try:
-            price = (price_weight_total / weight_total)
-        except ZeroDivisionError:
+        """ Time weighted price of the fills of the last
+            ``filled_order_age`` seconds, if their volume exceeds
+            ``minimum_volume``
+        """
+        estimator = self.filled_orders[market]
+        # The price first, a stored estimator then has the volume as well
+        price = estimator.price(self.getSnapshot().time)
+        if estimator.volume < self.settings["minimum_volume"]:
             return None
-        else:
-            if volume_total >= self.settings["minimum_volume"]:
-                return price
-            else:
-                return None
+        return price
 
     def price_feed(self, market):
         if "settlement_price" in self.ticker[market]:
@@ -304,8 +373,10 @@ class LiquiditySellBuyWalls(BaseStrategy):
         else:
             raise Exception("Pair %s does not have a settlement price!" % market)
 
-    def price_target(self, market):
-        return float(self.settings['target_price']) * (1 + self.settings["target_price_offset_percentage"] / 100)
+    def price_target(self, market, target_price=None):
+        if target_price is None:
+            target_price = self.settings['target_price']
+        return float(target_price) * (1 + self.settings["target_price_offset_percentage"] / 100)
 
     def price_bid_ask(self, market):
         return (self.ticker[market]['highestBid'] + self.ticker[market]['lowestAsk']) / 2
@@ -314,28 +385,10 @@ class LiquiditySellBuyWalls(BaseStrategy):
         return self.ticker[market]['last']
 
     def get_price(self, market, target_price=None):
-        if not target_price:
+        """ Return the price given by ``target_price`` (defaults to the
+            ``target_price`` setting). Every price source is only
+            evaluated once per market and tick.
+        """
+        if target_price is None:
             target_price = self.settings['target_price']
-        if isinstance(target_price, float) or isinstance(target_price, int):
-            return self.price_target
-        elif (isinstance(target_price, str) and
-            target_price is "settlement_price" or
-            target_price is "feed" or
-            target_price is "price_feed"):
-            return self.price_feed(market)
-        elif (isinstance(target_price, str) and
-            target_price is "filled_orders"):
-            return self.price_filled_orders(market)
-        elif (isinstance(target_price, str) and
-            target_price is "bid_ask" or
-            target_price is "gap"):
-            return self.price_bid_ask(market)
-        elif (isinstance(target_price, str) and
-            target_price is "last"):
-            return self.price_last(market)
-
-        if isinstance(target_price, dict):
-            price_weight_sum = sum([self.get_price(market, target_price=target) * weight for target, weight in target_price.items() if self.get_price(market, target_price=target) > 0])
-            weight_sum = sum([weight for target, weight in target_price.items() if self.get_price(market, target_price=target) > 0])
-            return price_weight_sum / weight_sum
-
+        return self.price_engine.price(market, target_price)
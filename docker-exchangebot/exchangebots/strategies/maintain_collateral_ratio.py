@@ -1,6 +1,6 @@
 from .basestrategy import BaseStrategy, MissingSettingsException
+from .collateral import CollateralMonitor
 from pprint import pprint
-from datetime import datetime
 
 class MaintainCollateralRatio(BaseStrategy):
     """ Maintain the collateral ration of a debt position
@@ -23,6 +23,16 @@ class MaintainCollateralRatio(BaseStrategy):
                                 point, an adjustment is initiated
         Only used if run in continuous mode (e.g. with ``run_conf.py``):
         * **skip_blocks**: Checks the collateral ratio only every x blocks
+        * **resync_ticks**: Reloads the debt positions every x ticks
+                            (default: 20)
+
+        The debt positions and settlement prices are kept current from
+        the notifications of the call orders and the bitassets (see
+        ``CollateralMonitor``), a check merely compares the settlement
+        price against the precomputed prices at which the positions
+        cross the thresholds. Without notifications (in the worker
+        processes of the supervisor, ``config.notifications``), they are
+        reloaded on every tick.
         .. code-block:: python
             from strategies.maintain_collateral_ratio import MaintainCollateralRatio
             bots["Collateral"] = {"bot" : MaintainCollateralRatio,
@@ -34,59 +44,87 @@ class MaintainCollateralRatio(BaseStrategy):
                                   }
     """
 
-    block_counter = 0
+    watch_collateral = True
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.monitor = None
+        self.ticks = 0
 
     def init(self):
-        """ Verify that the markets are against the assets
+        """ Verify that the markets are against the assets and load the
+            debt positions, the first tick follows in the first block
+            (see ``BlockScheduler``)
         """
-        for m in self.settings["markets"]:
-            quote_name, base_name = m.split(self.dex.market_separator)
-            quote = self.dex.rpc.get_asset(quote_name)
-            base  = self.dex.rpc.get_asset(base_name)
-            if "bitasset_data_id" not in quote:
-                raise ValueError(
-                    "The quote asset %s is not a bitasset "
-                    "and thus has no collateral to maintain!" % quote_name
-                )
-            collateral_asset_id = self.dex.getObject(
-                quote["bitasset_data_id"]
-            )["options"]["short_backing_asset"]
-            assert collateral_asset_id == base["id"], Exception(
-                "Collateral asset of %s doesn't match" % quote_name
-            )
+        self.verify_markets()
+
+        if "resync_ticks" not in self.settings:
+            self.settings["resync_ticks"] = 20
 
-        """ After startup, execute one tick()
+        self.monitor = CollateralMonitor(
+            [m.split(self.dex.market_separator)[0] for m in self.settings["markets"]],
+            self.settings["lower_threshold"],
+            self.settings["upper_threshold"])
+        self.load_positions()
+
+    def load_positions(self):
+        """ Load the debt positions and settlement prices
         """
-        self.tick()
+        debts = self.getSnapshot().debt_positions
+        self.monitor.load(debts)
+        for symbol in sorted(self.monitor.symbols):
+            if symbol not in debts:
+                self.log.warning("You don't have any %s debt", symbol)
+        self.ticks = 0
+
+    def onCollateralNotice(self, notice):
+        """ Apply a new settlement price or a changed call order
+        """
+        if self.monitor is None:
+            return
+        if isinstance(notice, str):
+            self.monitor.removed(notice)
+        else:
+            self.monitor.notice(notice, self.assets, self.dex.myAccount["id"])
+
+    def verify_market(self, market):
+        """ Verify that the market is against the asset backing the quote
+        """
+        quote_name, base_name = market.split(self.dex.market_separator)
+        quote = self.assets.get_asset(quote_name)
+        base  = self.assets.get_asset(base_name)
+        if "bitasset_data_id" not in quote:
+            raise ValueError(
+                "The quote asset %s is not a bitasset "
+                "and thus has no collateral to maintain!" % quote_name
+            )
+        collateral_asset_id = self.assets.backing_asset_id(quote_name)
+        assert collateral_asset_id == base["id"], Exception(
+            "Collateral asset of %s doesn't match" % quote_name
+        )
 
     def adjust_collateral(self, symbol):
         """ Actually adjust the collateral ratio
         """
-        print("%s | Adjusting %s collateral to %f" % (datetime.now(), symbol, self.settings["target_ratio"]))
+        self.log.info("Adjusting %s collateral to %f", symbol, self.settings["target_ratio"])
         self.dex.adjust_debt(0, symbol, self.settings["target_ratio"])
+        self.getSnapshot().invalidate()
 
     def tick(self):
         """ We can check every block if the collateral ratio goes belos
             the lower threshold or above the upper threshold and
             initiate an adjustment
         """
-        self.block_counter += 1
-        if (self.block_counter % self.settings["skip_blocks"]) == 0:
-            debts = self.dex.list_debt_positions()
-            for m in self.settings["markets"]:
-                quote_symbol = m.split(self.dex.market_separator)[0]
-                if quote_symbol not in debts:
-                    print("[Warning] You don't have any %s debt" % quote_symbol)
-                    continue
-                debt = debts[quote_symbol]
-                if (debt["ratio"] < self.settings["lower_threshold"] or
-                        debt["ratio"] > self.settings["upper_threshold"]):
-                    self.adjust_collateral(
-                        quote_symbol
-                    )
+        self.ticks += 1
+        if (self.ticks >= self.settings["resync_ticks"] or
+                not getattr(self.config, "notifications", True)):
+            self.load_positions()
+        for symbol in self.monitor.crossed():
+            self.log.info("Collateral ratio of %s is %f", symbol, self.monitor.ratio(symbol),
+                          extra={"ratio": self.monitor.ratio(symbol)})
+            self.adjust_collateral(symbol)
+            # Until the changed call order shows up (or the next resync)
+            self.monitor.adjusting(symbol)
 
     def orderFilled(self, oid):
         """ Do nothing """
@@ -0,0 +1,67 @@
+class OrderIndex():
+    """ Index of the orders that have been placed by a bot.
+
+        Keeps a set of order ids per market and a dictionary from order
+        id to the order record (as returned by ``returnOpenOrders``) so
+        that filled and newly placed orders can be derived with set
+        operations instead of list scans.
+
+        :param json orders: Order ids per market as stored in the state
+                            of the bot (``{market: [orderid, ...]}``)
+    """
+
+    def __init__(self, orders=None):
+        self.markets = {}
+        self.records = {}
+        for market, ids in (orders or {}).items():
+            self.markets[market] = set(ids)
+
+    def ids(self, market):
+        """ Return the set of order ids of a market
+        """
+        return self.markets.setdefault(market, set())
+
+    def add(self, market, orderid, record=None):
+        """ Add an order to the index
+        """
+        self.ids(market).add(orderid)
+        if record is not None:
+            self.records[orderid] = record
+
+    def remove(self, market, orderid):
+        """ Remove an order from the index
+        """
+        self.ids(market).discard(orderid)
+        self.records.pop(orderid, None)
+
+    def update_records(self, market, orders):
+        """ Store the records of all indexed orders that are contained in
+            ``orders``
+
+            :param list orders: Open orders of the market as returned by
+                                ``returnOpenOrders``
+        """
+        ids = self.ids(market)
+        for order in orders:
+            if order["orderNumber"] in ids:
+                self.records[order["orderNumber"]] = order
+
+    def diff(self, market, current, previous=None):
+        """ Compare the index with the currently open orders of a market
+
+            :param set current: Ids of the currently open orders
+            :param set previous: Ids of the orders that were open before
+                                 (optional)
+            :return: ``(filled, placed)``: indexed orders that are no
+                     longer open, and open orders that were not open
+                     before (empty if ``previous`` is ``None``)
+            :rtype: tuple of sets
+        """
+        filled = self.ids(market) - current
+        placed = current - previous if previous is not None else set()
+        return filled, placed
+
+    def to_state(self):
+        """ Return the index in the format stored in the bot's state
+        """
+        return {market: sorted(ids) for market, ids in self.markets.items()}
@@ -0,0 +1,91 @@
+class PriceEngine():
+    """ Evaluates the price sources of a ``target_price`` setting for a
+        strategy and caches every source per market until ``reset()``
+        is called (i.e. until the next snapshot).
+
+        :param BaseStrategy strategy: Strategy that provides the
+                                      ``price_*`` methods
+
+        ``target_price`` can either be a single source, a fixed price
+        (number), or a dictionary of sources and their weights, e.g.:
+
+        .. code-block:: python
+
+            "target_price": {
+                "filled_orders": 2,
+                "last": 1,
+                "feed": 0,
+                "gap" : 0.1,
+            }
+
+        In the latter case, the weighted average of all sources that
+        returned a positive price is used. Sources with a weight of 0
+        are not evaluated at all. Sources that returned no price
+        (``None``) are cached as such and not evaluated again.
+    """
+
+    #: Names (and aliases) of the price sources and the methods of the
+    #: strategy that evaluate them
+    sources = {
+        "feed": "price_feed",
+        "settlement_price": "price_feed",
+        "price_feed": "price_feed",
+        "filled_orders": "price_filled_orders",
+        "bid_ask": "price_bid_ask",
+        "gap": "price_bid_ask",
+        "last": "price_last",
+    }
+
+    def __init__(self, strategy):
+        self.strategy = strategy
+        self.prices = {}
+
+    def reset(self):
+        """ Drop all cached prices
+        """
+        self.prices = {}
+
+    def source_price(self, market, source):
+        """ Return the price of a single source
+
+            :param str market: Market
+            :param source: Name of the price source or a fixed price
+            :raises ValueError: if the price source is unknown
+        """
+        if isinstance(source, (int, float)):
+            key = (market, "target", source)
+        elif source in self.sources:
+            key = (market, self.sources[source])
+        else:
+            raise ValueError("Unknown price source '%s'" % source)
+        if key not in self.prices:
+            if key[1] == "target":
+                self.prices[key] = self.strategy.price_target(market, source)
+            else:
+                self.prices[key] = getattr(self.strategy, key[1])(market)
+        return self.prices[key]
+
+    def price(self, market, target_price):
+        """ Return the price of ``target_price`` (a single source, a
+            fixed price or a weighted dictionary of sources)
+
+            :param str market: Market
+            :param target_price: The price source(s)
+            :return: price or ``None`` if no source returned a price
+        """
+        if not isinstance(target_price, dict):
+            return self.source_price(market, target_price)
+
+        price_weight_sum = 0.0
+        weight_sum = 0.0
+        for source, weight in target_price.items():
+            if not weight:
+                continue
+            price = self.source_price(market, source)
+            if price is None or price <= 0:
+                continue
+            price_weight_sum += price * weight
+            weight_sum += weight
+        if not weight_sum:
+            return None
+        return price_weight_sum / weight_sum
@@ -0,0 +1,111 @@
+import numpy as np
+
+
+class OrderReconciler():
+    """ Compares the orders a strategy wants to have on the book with the
+        orders that are currently open and derives the minimal set of
+        cancels and creates.
+
+        :param float price_tolerance: Deviation of the price (in percent
+                                      of the desired price) an open order
+                                      may have and still be kept
+        :param float amount_tolerance: Deviation of the amount (in
+                                       percent of the desired amount) an
+                                       open order may have and still be
+                                       kept
+
+        Desired orders are given as ``{"type": "buy"|"sell", "rate":
+        price, "amount": amount}`` (amount denoted in the quote asset),
+        open orders as returned by ``returnOpenOrders``.
+
+        .. code-block:: python
+
+            reconciler = OrderReconciler(1.25, 10)
+            keep, cancel, create = reconciler.reconcile(desired, open_orders)
+    """
+
+    #: Up to this many pairs of desired and open orders, the orders are
+    #: compared one by one instead of as arrays
+    small = 16
+
+    def __init__(self, price_tolerance, amount_tolerance):
+        self.price_tolerance = price_tolerance
+        self.amount_tolerance = amount_tolerance
+
+    def deviation(self, value, target):
+        """ Deviation of ``value`` from ``target`` in percent
+        """
+        if not target:
+            return float("inf")
+        return abs(value - target) / target * 100
+
+    def deviations(self, values, targets):
+        """ Deviations of all ``values`` from all ``targets`` in percent
+            (shape ``(targets, values)``)
+        """
+        values = np.asarray(values, dtype=float)[None, :]
+        targets = np.asarray(targets, dtype=float)[:, None]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            deviations = np.abs(values - targets) / targets * 100
+        deviations[np.broadcast_to(targets == 0, deviations.shape)] = float("inf")
+        return deviations
+
+    def acceptable(self, order, desired):
+        """ Can ``order`` stay on the book in place of ``desired``?
+        """
+        return (order["type"] == desired["type"] and
+                self.deviation(order["rate"], desired["rate"]) <= self.price_tolerance and
+                self.deviation(order["amount"], desired["amount"]) <= self.amount_tolerance)
+
+    def reconcile(self, desired, current):
+        """ Match the open orders against the desired orders
+
+            :param list desired: Orders that should be on the book
+            :param list current: Currently open orders
+            :return: ``(keep, cancel, create)``: open orders that are kept,
+                     open orders that have to be canceled and desired
+                     orders that have to be placed
+            :rtype: tuple of lists
+        """
+        if not desired or not current:
+            return [], list(current), list(desired)
+        if len(desired) * len(current) <= self.small:
+            return self._reconcile_pairwise(desired, current)
+        # Deviations of every open order (columns) from every desired
+        # order (rows)
+        price_dev = self.deviations([o["rate"] for o in current], [d["rate"] for d in desired])
+        amount_dev = self.deviations([o["amount"] for o in current], [d["amount"] for d in desired])
+        acceptable = ((price_dev <= self.price_tolerance) &
+                      (amount_dev <= self.amount_tolerance) &
+                      (np.array([o["type"] for o in current])[None, :] ==
+                       np.array([d["type"] for d in desired])[:, None]))
+
+        unmatched = np.ones(len(current), dtype=bool)
+        keep = []
+        create = []
+        for i, d in enumerate(desired):
+            candidates = np.flatnonzero(acceptable[i] & unmatched)
+            if not len(candidates):
+                create.append(d)
+                continue
+            # Closest price first, then closest amount
+            best = candidates[np.lexsort((amount_dev[i, candidates], price_dev[i, candidates]))[0]]
+            unmatched[best] = False
+            keep.append(current[best])
+        return keep, [o for o, u in zip(current, unmatched) if u], create
+
+    def _reconcile_pairwise(self, desired, current):
+        unmatched = list(current)
+        keep = []
+        create = []
+        for d in desired:
+            candidates = [o for o in unmatched if self.acceptable(o, d)]
+            if not candidates:
+                create.append(d)
+                continue
+            best = min(candidates, key=lambda o: (
+                self.deviation(o["rate"], d["rate"]),
+                self.deviation(o["amount"], d["amount"])))
+            unmatched.remove(best)
+            keep.append(best)
+        return keep, unmatched, create
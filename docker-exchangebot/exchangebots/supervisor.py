@@ -0,0 +1,322 @@
+""" Run the bots in several worker processes
+
+    The supervisor partitions ``config.bots`` (and, with the bot setting
+    ``markets_per_worker``, the markets of a single bot) across
+    ``config.workers`` worker processes. Every worker runs ``bot.init()``
+    for its share of the bots with its own connections to the wallet and
+    the witness node. A single feed process subscribes to the blocks and
+    hands every block notification to all workers. Crashed workers (and
+    a crashed feed) are restarted.
+
+    The workers only receive the blocks, none of the market, account or
+    asset notifications, so they run with ``order_books`` off (the
+    ticker is fetched every block) and ``config.notifications = False``,
+    which tells the bots to reload what they would otherwise follow from
+    the notifications.
+
+    Bots that trade the same market always end up in the same worker.
+    Additionally, every worker holds a file lock for each
+    account/market pair it trades while it is running, so that a worker
+    that is restarted waits for its predecessor and a second supervisor
+    on the same host cannot trade the same markets.
+
+    .. code-block:: python
+
+        import config
+        from supervisor import Supervisor
+        Supervisor(config, 4).run()
+"""
+from grapheneapi.graphenewsprotocol import GrapheneWebsocketProtocol
+from grapheneapi.grapheneclient import GrapheneClient
+from logger import get_logger
+import logger
+import multiprocessing
+import queue
+import fcntl
+import time
+import os
+
+log = get_logger("supervisor")
+
+
+class MarketLocks():
+    """ Exclusive file locks on account/market pairs
+
+        :param str directory: Directory of the lock files
+        :param str account: Name of the account
+        :param list markets: The markets (``"QUOTE : BASE"``)
+        :param str separator: Market separator
+    """
+
+    def __init__(self, directory, account, markets, separator):
+        self.directory = directory
+        self.files = {}
+        self.names = sorted(set(
+            "%s_%s" % (account, "_".join(sorted(s.strip() for s in m.split(separator))))
+            for m in markets))
+
+    def acquire(self, timeout=60):
+        """ Lock all pairs, wait up to ``timeout`` seconds for locks held
+            by other processes
+
+            :raises Exception: if a pair could not be locked in time
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        deadline = time.time() + timeout
+        for name in self.names:
+            fp = open(os.path.join(self.directory, name + ".lock"), "w")
+            while True:
+                try:
+                    fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.time() > deadline:
+                        fp.close()
+                        self.release()
+                        raise Exception("%s is traded by another process" % name)
+                    time.sleep(0.5)
+            fp.write(str(os.getpid()))
+            fp.flush()
+            self.files[name] = fp
+
+    def release(self):
+        for fp in self.files.values():
+            fcntl.flock(fp, fcntl.LOCK_UN)
+            fp.close()
+        self.files = {}
+
+
+def shards(bots, separator):
+    """ Split the bots into units that can run in different processes
+
+        :param dict bots: ``config.bots``
+        :param str separator: Market separator
+        :return: ``{name: settings}``. Bots with the setting
+                 ``markets_per_worker`` are split into shards
+                 ``name.0``, ``name.1``, ... of at most that many markets
+                 (every shard keeps its own state file).
+        :rtype: dict
+
+        The shards of a bot share the funds of the account: every shard
+        gets the setting ``funds_shares`` with the part of the free
+        balance of each asset it may use, which is the part of the bot's
+        markets trading the asset that the shard trades (see
+        ``BaseStrategy.getBalances()``).
+    """
+    def assets(markets):
+        counts = {}
+        for market in markets:
+            for symbol in market.split(separator):
+                counts[symbol.strip()] = counts.get(symbol.strip(), 0) + 1
+        return counts
+
+    units = {}
+    for name, settings in bots.items():
+        size = settings.get("markets_per_worker")
+        if not size or len(settings["markets"]) <= size:
+            units[name] = settings
+            continue
+        markets = settings["markets"]
+        total = assets(markets)
+        for i in range(0, len(markets), size):
+            shard = dict(settings)
+            shard["markets"] = markets[i:i + size]
+            counts = assets(shard["markets"])
+            shard["funds_shares"] = {symbol: counts.get(symbol, 0) / n
+                                     for symbol, n in total.items()}
+            units["%s.%d" % (name, i // size)] = shard
+    return units
+
+
+def partition(bots, workers, separator):
+    """ Distribute the bots across ``workers`` workers. Bots that share a
+        market are kept together, the groups are balanced by their
+        number of markets.
+
+        :param dict bots: ``config.bots`` (see ``shards()``)
+        :return: One ``{name: settings}`` per worker (without empty
+                 workers)
+        :rtype: list
+    """
+    units = shards(bots, separator)
+    # Union-find over the bots, joined by their markets
+    parent = {name: name for name in units}
+
+    def find(name):
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+
+    owner = {}
+    for name, settings in units.items():
+        for market in settings["markets"]:
+            pair = frozenset(s.strip() for s in market.split(separator))
+            if pair in owner:
+                parent[find(name)] = find(owner[pair])
+            else:
+                owner[pair] = name
+
+    groups = {}
+    for name in units:
+        groups.setdefault(find(name), []).append(name)
+
+    def weight(names):
+        return sum(len(units[n]["markets"]) for n in names)
+
+    # Largest groups first, each into the least loaded worker
+    loads = [[0, {}] for _ in range(workers)]
+    for names in sorted(groups.values(), key=weight, reverse=True):
+        load = min(loads, key=lambda l: l[0])
+        load[0] += weight(names)
+        load[1].update({n: units[n] for n in sorted(names)})
+    return [bots for _, bots in loads if bots]
+
+
+class FeedProtocol(GrapheneWebsocketProtocol):
+    """ Subscribes to the blocks and hands them to the workers
+    """
+
+    #: One queue per worker
+    queues = []
+
+    def onBlock(self, data):
+        for q in self.queues:
+            q.put(data)
+
+    def onRegisterDatabase(self):
+        log.info("Block feed initialized")
+
+
+def _feed(config, queues):
+    logger.setup(config)
+    for key in ("witness_url", "witness_user", "witness_password"):
+        if hasattr(config, key):
+            setattr(FeedProtocol, key, getattr(config, key))
+    FeedProtocol.queues = queues
+    GrapheneClient(FeedProtocol).run()
+
+
+def _worker(config, index, bots, blocks):
+    import bot
+
+    config.bots = bots
+    # Without notifications the order books would never change
+    config.notifications = False
+    config.order_books = False
+    # Every worker serves its own metrics and writes its own cassette
+    if getattr(config, "metrics_port", None):
+        config.metrics_port += index
+    if getattr(config, "cassette_mode", None):
+        config.cassette = "worker%d.%s" % (index, config.cassette)
+
+    markets = [m for settings in bots.values() for m in settings["markets"]]
+    locks = MarketLocks(getattr(config, "lock_dir", "locks"), config.account,
+                        markets, config.market_separator)
+    logger.setup(config)
+    locks.acquire(getattr(config, "lock_timeout", 60))
+    log.info("Worker %d running %s", index, ", ".join(sorted(bots)))
+
+    # Forked processes exit without running the ``atexit`` handlers
+    try:
+        bot.init(config)
+        while True:
+            data = blocks.get()
+            # Skip to the newest block if this worker fell behind, the
+            # scheduler coalesces the missed ticks
+            try:
+                while True:
+                    data = blocks.get_nowait()
+            except queue.Empty:
+                pass
+            bot.process_block(data)
+    except Exception:
+        log.exception("Worker %d failed", index)
+        raise
+    finally:
+        logger.shutdown()
+
+
+class Supervisor():
+    """ Starts the feed and the workers and restarts them when they exit
+
+        :param module config: The configuration (``config.py``)
+        :param int workers: Number of worker processes
+        :param float restart_delay: Seconds to wait before a crashed
+                                    process is restarted (doubled for
+                                    every crash in a row)
+        :param float max_restart_delay: Upper limit of the delay
+    """
+
+    #: Seconds a process needs to run to reset its restart delay
+    healthy_after = 60
+
+    def __init__(self, config, workers, restart_delay=1, max_restart_delay=60):
+        if getattr(config, "cassette_mode", None) == "replay":
+            raise ValueError("Cassettes can only be replayed in a single process")
+        self.config = config
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.assignments = partition(config.bots, workers, config.market_separator)
+        # The workers inherit the configuration (a module) instead of
+        # receiving a pickled copy
+        self.context = multiprocessing.get_context("fork")
+        self.queues = [self.context.Queue() for _ in self.assignments]
+        #: ``{name: {"process", "started", "exited", "crashes"}}``
+        self.processes = {}
+        #: Number of restarts per process
+        self.restarts = {}
+
+    def _target(self, name):
+        if name == "feed":
+            return _feed, (self.config, self.queues)
+        index = int(name.split(":")[1])
+        return _worker, (self.config, index, self.assignments[index], self.queues[index])
+
+    def start(self, name, crashes=0):
+        target, args = self._target(name)
+        process = self.context.Process(target=target, args=args, name=name, daemon=True)
+        process.start()
+        self.processes[name] = {"process": process, "started": time.time(),
+                                "exited": None, "crashes": crashes}
+
+    def check(self):
+        """ Restart the processes that have exited (after their restart
+            delay)
+        """
+        for name, p in list(self.processes.items()):
+            if p["process"].is_alive():
+                continue
+            if p["exited"] is None:
+                p["exited"] = time.time()
+                if p["exited"] - p["started"] >= self.healthy_after:
+                    p["crashes"] = 0
+                log.warning("%s exited with %s", name, p["process"].exitcode)
+            delay = min(self.restart_delay * 2 ** p["crashes"], self.max_restart_delay)
+            if time.time() - p["exited"] < delay:
+                continue
+            self.restarts[name] = self.restarts.get(name, 0) + 1
+            log.warning("Restarting %s (%d restarts)", name, self.restarts[name])
+            self.start(name, p["crashes"] + 1)
+
+    def stop(self):
+        for p in self.processes.values():
+            p["process"].terminate()
+        for p in self.processes.values():
+            p["process"].join(5)
+
+    def run(self, interval=1):
+        """ Run the feed and the workers until interrupted
+        """
+        for index, bots in enumerate(self.assignments):
+            log.info("Worker %d: %s", index, ", ".join(sorted(bots)))
+            self.start("worker:%d" % index)
+        self.start("feed")
+        try:
+            while True:
+                time.sleep(interval)
+                self.check()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
@@ -0,0 +1,12 @@
+""" The bots import their modules flat (``import ledger``), so the tests
+    run with ``exchangebots`` on the path:
+
+    .. code-block:: sh
+
+        cd docker-exchangebot/exchangebots
+        python -m pytest -q tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
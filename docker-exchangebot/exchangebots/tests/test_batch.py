@@ -0,0 +1,133 @@
+from batch import TransactionBatch
+import pytest
+
+
+class FakeWallet():
+    """ Builder transaction calls of the cli_wallet. Transactions that
+        contain an operation ``reject`` returns an error for are
+        rejected as a whole.
+    """
+
+    def __init__(self, reject=lambda op: None):
+        self.reject = reject
+        self.handles = {}
+        self.next_handle = 0
+        self.broadcasts = []
+
+    def begin_builder_transaction(self):
+        self.next_handle += 1
+        self.handles[self.next_handle] = []
+        return self.next_handle
+
+    def add_operation_to_builder_transaction(self, handle, op):
+        self.handles[handle].append(op)
+
+    def set_fees_on_builder_transaction(self, handle, fee_asset):
+        pass
+
+    def sign_builder_transaction(self, handle, broadcast):
+        operations = self.handles[handle]
+        for op in operations:
+            error = self.reject(op)
+            if error:
+                raise Exception(error)
+        self.broadcasts.append(operations)
+        return {"operations": operations}
+
+    def remove_builder_transaction(self, handle):
+        del self.handles[handle]
+
+
+class FakeExchange():
+    market_separator = " : "
+    safe_mode = False
+    myAccount = {"id": "1.2.100"}
+
+    def __init__(self, wallet):
+        self.rpc = wallet
+
+
+class FakeAssets():
+    assets = {"BTS": {"id": "1.3.0", "symbol": "BTS", "precision": 5},
+              "USD": {"id": "1.3.121", "symbol": "USD", "precision": 4,
+                      "bitasset_data_id": "2.4.21"}}
+
+    def get_asset(self, name):
+        for asset in self.assets.values():
+            if name in (asset["symbol"], asset["id"]):
+                return asset
+        raise KeyError(name)
+
+    def backing_asset_id(self, name):
+        return "1.3.0"
+
+
+def reject_order(order):
+    def reject(op):
+        if op[0] == TransactionBatch.limit_order_cancel and op[1]["order"] == order:
+            return "Unable to find order %s" % order
+    return reject
+
+
+def test_one_transaction_for_all_operations():
+    wallet = FakeWallet()
+    batch = TransactionBatch(FakeExchange(wallet), FakeAssets())
+    batch.cancel("1.7.1")
+    batch.sell("USD : BTS", 300, 2)
+    batch.buy("USD : BTS", 290, 1)
+    batch.borrow(10, "USD", 2.5, 300)
+    results = batch.broadcast()
+
+    assert len(wallet.broadcasts) == 1
+    assert [op[0] for op in wallet.broadcasts[0]] == [2, 1, 1, 3]
+    assert [r["error"] for r in results] == [None] * 4
+    assert not wallet.handles
+    assert len(batch) == 0
+
+
+def test_sell_amounts_in_asset_precision():
+    wallet = FakeWallet()
+    batch = TransactionBatch(FakeExchange(wallet), FakeAssets())
+    batch.sell("USD : BTS", 300, 2)
+    op = batch.operations[0]["op"][1]
+    assert op["amount_to_sell"] == {"amount": 20000, "asset_id": "1.3.121"}
+    assert op["min_to_receive"] == {"amount": 60000000, "asset_id": "1.3.0"}
+
+
+def test_balance_deltas_of_pending_operations():
+    batch = TransactionBatch(FakeExchange(FakeWallet()), FakeAssets())
+    batch.sell("USD : BTS", 300, 2)
+    batch.buy("USD : BTS", 290, 1)
+    assert batch.balance_deltas == {"USD": -2, "BTS": -290}
+
+
+def test_failing_operation_is_isolated():
+    wallet = FakeWallet(reject_order("1.7.2"))
+    batch = TransactionBatch(FakeExchange(wallet), FakeAssets())
+    for order in ("1.7.1", "1.7.2", "1.7.3"):
+        batch.cancel(order)
+    results = batch.broadcast()
+
+    assert [r["operation"] for r in results] == ["cancel 1.7.1", "cancel 1.7.2", "cancel 1.7.3"]
+    assert results[0]["error"] is None and results[2]["error"] is None
+    assert "1.7.2" in results[1]["error"]
+    # The rejected transaction, then one transaction per operation
+    assert [[op[1]["order"] for op in ops] for ops in wallet.broadcasts] == [["1.7.1"], ["1.7.3"]]
+    assert not wallet.handles
+
+
+def test_rejected_transaction_raises_without_isolation():
+    wallet = FakeWallet(reject_order("1.7.2"))
+    batch = TransactionBatch(FakeExchange(wallet), FakeAssets())
+    batch.cancel("1.7.1")
+    batch.cancel("1.7.2")
+    with pytest.raises(Exception, match="1.7.2"):
+        batch.broadcast(isolate=False)
+    assert not wallet.broadcasts
+    assert not wallet.handles
+
+
+def test_empty_batch_broadcasts_nothing():
+    wallet = FakeWallet()
+    assert TransactionBatch(FakeExchange(wallet), FakeAssets()).broadcast() == []
+    assert wallet.next_handle == 0
@@ -0,0 +1,54 @@
+import pytest
+
+pytest.importorskip("grapheneexchange")
+
+import benchmark  # noqa: E402
+
+
+@pytest.mark.parametrize("name", ["walls", "collateral"])
+def test_scenario_measures_every_phase(name):
+    result = benchmark.Scenario(name, 2, 3, 2, 3).run()
+    assert (result["scenario"], result["markets"], result["blocks"]) == (name, 2, 3)
+    phases = result["seconds_per_block"]
+    assert set(phases) == {"snapshot", "loadMarket", "tick", "store", "block"}
+    assert all(phase["mean"] >= 0 for phase in phases.values())
+    assert phases["block"]["max"] >= phases["block"]["p50"]
+    assert result["rpc_per_block"]
+
+
+def test_scenario_measures_memory():
+    result = benchmark.Scenario("walls", 1, 0, 1, 2).run(measure_memory=True)
+    assert result["peak_memory"] > 0
+    assert "seconds_per_block" not in result
+    assert set(result["allocated_blocks_per_block"]) == {"mean", "p50", "p95", "max"}
+
+
+def test_run_reports_every_combination():
+    report = benchmark.run(["walls", "collateral"], [1, 2], 2, 1, 2)
+    assert [(r["scenario"], r["markets"]) for r in report["results"]] == [
+        ("walls", 1), ("walls", 2), ("collateral", 1), ("collateral", 2)]
+    assert all("peak_memory" in r and "seconds_per_block" in r for r in report["results"])
+    assert report["python"]
+
+
+def test_call_counter_counts_rpc_and_ws_calls():
+    class Target():
+        def __init__(self):
+            self.rpc = self
+            self.value = 1
+
+        def get_objects(self, ids):
+            return ids
+
+    calls = benchmark.Counter()
+    proxy = benchmark.CallCounter(Target(), calls)
+    proxy.get_objects([1])
+    proxy.rpc.get_objects([2])
+    assert proxy.value == 1
+    assert calls == {"get_objects": 1, "rpc.get_objects": 1}
+
+
+def test_percentile():
+    assert benchmark.percentile([], 50) is None
+    assert benchmark.percentile([3, 1, 2], 50) == 2
+    assert benchmark.percentile(range(101), 95) == 95
@@ -0,0 +1,72 @@
+from strategies.fills import FillPriceEstimator
+import random
+import pytest
+
+START = 1700000000
+
+
+def exact_price(fills, now):
+    weights = [(price, volume / max(now - timestamp, 1)) for timestamp, price, volume in fills]
+    return sum(p * w for p, w in weights) / sum(w for _, w in weights)
+
+
+def random_fills(seconds, seed=1):
+    rng = random.Random(seed)
+    price = 300.0
+    fills = []
+    for timestamp in range(START, START + seconds):
+        if rng.random() < 0.5:
+            price *= 1 + rng.gauss(0, 0.002)
+            fills.append((timestamp, price, rng.uniform(0.1, 10)))
+    return fills
+
+
+def test_recent_fills_are_exact():
+    estimator = FillPriceEstimator()
+    fills = [(START, 100.0, 1.0), (START + 3, 200.0, 2.0), (START + 10, 400.0, 1.0)]
+    for fill in fills:
+        estimator.append(*fill)
+    assert estimator.price(START + 10) == pytest.approx(exact_price(fills, START + 10), rel=1e-12)
+    assert estimator.vwap() == pytest.approx(900 / 4)
+    assert estimator.volume == 4
+
+
+def test_query_cost_is_bounded_by_the_time_buckets():
+    estimator = FillPriceEstimator()
+    fills = random_fills(2 * 24 * 60 * 60)
+    for fill in fills:
+        estimator.append(*fill)
+    now = fills[-1][0] + 3
+    price = estimator.price(now)
+    assert len(estimator.buckets) > 80000
+    assert len(estimator.time_buckets) < 300
+    assert price == pytest.approx(exact_price(fills, now), rel=1e-4)
+
+
+def test_expire_keeps_the_aggregates_exact():
+    estimator = FillPriceEstimator()
+    fills = random_fills(6 * 60 * 60, seed=2)
+    for i, fill in enumerate(fills):
+        estimator.append(*fill)
+        if i % 500 == 0:
+            estimator.price(fill[0])
+    oldest = START + 2 * 60 * 60
+    estimator.expire(oldest)
+    kept = [f for f in fills if f[0] >= oldest]
+    now = fills[-1][0] + 60
+    assert estimator.volume == pytest.approx(sum(v for _, _, v in kept))
+    assert sum(b[2] for b in estimator.time_buckets) == pytest.approx(estimator.volume)
+    assert sum(b[5] for b in estimator.time_buckets) == len(estimator.buckets)
+    assert estimator.price(now) == pytest.approx(exact_price(kept, now), rel=1e-4)
+
+    estimator.expire(now + 1)
+    assert estimator.price(now + 1) is None
+    assert not estimator.time_buckets and estimator.volume == 0
+
+
+def test_price_is_cached_per_query_time():
+    estimator = FillPriceEstimator()
+    estimator.append(START, 100.0, 1.0)
+    assert estimator.price(START + 5) == 100.0
+    estimator.append(START + 5, 200.0, 1.0)
+    assert estimator.price(START + 5) == pytest.approx((100 / 5 + 200) / (1 / 5 + 1))
@@ -0,0 +1,85 @@
+from fillstore import FillStore
+from strategies.fills import FillPriceEstimator
+import random
+import pytest
+
+START = 1700000000
+
+
+@pytest.fixture
+def store():
+    store = FillStore(":memory:", retention=3600)
+    yield store
+    store.close()
+
+
+def fills(count, seed=1, step=7):
+    rng = random.Random(seed)
+    return [(START + i * step, 300 + rng.random(), rng.random() * 10, "fill %d" % i)
+            for i in range(count)]
+
+
+def test_fills_are_stored_once(store):
+    assert store.add("A", fills(10)) == 10
+    assert store.add("A", fills(10)) == 0
+    assert store.add("B", fills(10)) == 10
+    assert store.newest("A") == START + 9 * 7
+    assert store.newest("C") is None
+
+
+def test_aggregates_of_a_window(store):
+    store.add("A", [(START, 100, 1, "a"), (START + 10, 200, 3, "b"), (START + 20, 400, 1, "c")])
+    store.add("B", [(START + 10, 1, 100, "d")])
+    result = store.aggregates("A", START + 10, now=START + 30)
+    assert result["count"] == 2
+    assert result["volume"] == 4
+    assert result["vwap"] == pytest.approx((200 * 3 + 400) / 4)
+    # Weighted by volume / seconds ago
+    weights = [3 / 20, 1 / 10]
+    assert result["price"] == pytest.approx((200 * weights[0] + 400 * weights[1]) / sum(weights))
+
+
+def test_aggregates_without_fills(store):
+    assert store.aggregates("A", START, now=START) == {
+        "count": 0, "volume": 0, "vwap": None, "price": None}
+
+
+def test_estimator_matches_the_in_memory_estimator(store):
+    memory = FillPriceEstimator()
+    stored = store.estimator("1.3.121", "1.3.0")
+    for timestamp, price, volume, key in fills(500):
+        memory.append(timestamp, price, volume)
+        stored.append(timestamp, price, volume, key)
+    now = START + 500 * 7
+    memory.expire(now - 1800)
+    stored.expire(now - 1800)
+    assert stored.price(now) == pytest.approx(memory.price(now))
+    assert stored.volume == pytest.approx(memory.volume)
+    assert stored.vwap() == pytest.approx(memory.vwap())
+
+
+def test_candles(store):
+    start = START - START % 60
+    store.add("A", [(start, 10, 1, "a"), (start + 30, 12, 1, "b"), (start + 59, 11, 2, "c"),
+                    (start + 60, 20, 1, "d"), (start + 130, 5, 4, "e")])
+    assert store.candles("A", start, 60) == [
+        (start, 10, 12, 10, 11, 4, pytest.approx((10 + 12 + 22) / 4)),
+        (start + 60, 20, 20, 20, 20, 1, 20),
+        (start + 120, 5, 5, 5, 5, 4, 5),
+    ]
+
+
+def test_candles_open_within_the_window(store):
+    store.add("A", [(START, 1, 1, "a"), (START + 5, 2, 1, "b")])
+    # The window starts within the first candle
+    candles = store.candles("A", START + 1, 3600)
+    assert len(candles) == 1
+    assert candles[0][1] == 2 and candles[0][4] == 2
+
+
+def test_prune(store):
+    store.add("A", fills(10, step=600))
+    assert store.prune(now=START + 3600 + 3000) == 5
+    assert store.aggregates("A", 0, now=START + 6000)["count"] == 5
+    store.maybe_prune(now=START + 3600 + 3000 + 10)
+    assert store.last_prune == START + 3600 + 3000
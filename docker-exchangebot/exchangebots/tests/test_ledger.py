@@ -0,0 +1,118 @@
+from ledger import AccountLedger
+import pytest
+
+MARKET = "USD : BTS"
+
+
+class Snapshot():
+    """ The datasets of a block the ledger reads """
+
+    def __init__(self, open_orders, balances=None, debt_positions=None):
+        self.open_orders = {MARKET: open_orders}
+        self.debt_positions = debt_positions or {}
+        self._balances = balances
+        self.balance_fetches = 0
+
+    @property
+    def balances(self):
+        self.balance_fetches += 1
+        return self._balances
+
+
+def sell(number, amount, rate=300):
+    return {"orderNumber": number, "type": "sell", "rate": rate,
+            "amount": amount, "total": amount * rate}
+
+
+@pytest.fixture
+def ledger():
+    ledger = AccountLedger(" : ")
+    ledger.sync(Snapshot([], {"BTS": 1000, "USD": 10}))
+    return ledger
+
+
+def test_first_sync_reconciles(ledger):
+    assert ledger.balances() == {"BTS": 1000, "USD": 10}
+    assert ledger.total("USD") == 10
+
+
+def test_placed_order_is_pending_until_it_shows_up(ledger):
+    ledger.placed(MARKET, "sell", 300, 2)
+    assert ledger.free["USD"] == 8
+    assert ledger.pending["USD"] == 2
+    assert ledger.committed_in(MARKET) == {}
+
+    ledger.sync(Snapshot([]))
+    assert ledger.pending["USD"] == 2
+
+    ledger.sync(Snapshot([sell("1.7.1", 2)]))
+    assert ledger.free == {"BTS": 1000, "USD": 8}
+    assert ledger.pending["USD"] == 0
+    assert ledger.committed_in(MARKET) == {"USD": 2}
+    assert ledger.total("USD") == 10
+
+
+def test_fill_on_placement_is_credited_when_the_order_shows_up(ledger):
+    ledger.placed(MARKET, "sell", 300, 2)
+    ledger.sync(Snapshot([sell("1.7.1", 1.5)]))
+    assert ledger.free == {"BTS": 1150, "USD": 8}
+    assert ledger.committed["USD"] == 1.5
+
+
+def test_partial_fill_and_fill_of_open_orders(ledger):
+    ledger.placed(MARKET, "sell", 300, 2)
+    ledger.sync(Snapshot([sell("1.7.1", 2)]))
+    ledger.sync(Snapshot([sell("1.7.1", 1)]))
+    assert ledger.free["BTS"] == 1300
+    assert ledger.committed["USD"] == 1
+    ledger.sync(Snapshot([]))
+    assert ledger.free["BTS"] == 1600
+    assert ledger.committed["USD"] == 0
+
+
+def test_canceled_order_returns_its_funds(ledger):
+    ledger.placed(MARKET, "sell", 300, 2)
+    ledger.sync(Snapshot([sell("1.7.1", 2)]))
+    ledger.cancelled("1.7.1")
+    ledger.sync(Snapshot([]))
+    assert ledger.free == {"BTS": 1000, "USD": 10}
+    assert ledger.committed["USD"] == 0
+
+
+def test_orders_of_others_are_committed_when_they_show_up(ledger):
+    ledger.sync(Snapshot([sell("1.7.9", 3)]))
+    assert ledger.free["USD"] == 7
+    assert ledger.committed_in(MARKET) == {"USD": 3}
+
+
+def test_unseen_placement_is_reconciled_instead_of_assumed_filled(ledger):
+    ledger.placed(MARKET, "sell", 300, 2)
+    for _ in range(ledger.placement_blocks - 1):
+        snapshot = Snapshot([], {"BTS": 1600, "USD": 8})
+        ledger.sync(snapshot)
+        assert snapshot.balance_fetches == 0
+        # Neither credited nor free again
+        assert ledger.free == {"BTS": 1000, "USD": 8}
+
+    snapshot = Snapshot([], {"BTS": 1600, "USD": 8})
+    ledger.sync(snapshot)
+    assert snapshot.balance_fetches == 1
+    assert ledger.free == {"BTS": 1600, "USD": 8}
+    assert ledger.placing == [] and ledger.pending == {}
+
+
+def test_placement_is_matched_by_rate_and_amount(ledger):
+    ledger.placed(MARKET, "sell", 300, 5)
+    ledger.placed(MARKET, "sell", 300, 1)
+    ledger.sync(Snapshot([sell("1.7.1", 1)]))
+    # The order of 1 showed up, the order of 5 is still pending
+    assert [p["for_sale"] for p in ledger.placing] == [5]
+    assert ledger.free["BTS"] == 1000
+    assert ledger.pending["USD"] == 5
+
+
+def test_debt_positions_move_funds(ledger):
+    ledger.sync(Snapshot([], debt_positions={
+        "USD": {"collateral_asset": "BTS", "collateral": 500, "debt": 1}}))
+    assert ledger.free == {"BTS": 500, "USD": 11}
+    assert ledger.collateral["BTS"] == 500 and ledger.debt["USD"] == 1
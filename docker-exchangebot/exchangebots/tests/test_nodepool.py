@@ -0,0 +1,170 @@
+from nodepool import NodePool, RoutedWebsocket
+import nodepool
+import pytest
+
+
+class RPCError(Exception):
+    """ An error returned by a node """
+
+
+class Clock():
+    """ Time that only advances while a fake node answers """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+
+class FakeConnection():
+    """ Connection to a witness node that answers after ``delay`` seconds """
+
+    def __init__(self, network, url):
+        self.network = network
+        self.url = url
+        self.closed = False
+
+    def _answer(self):
+        node = self.network.nodes[self.url]
+        if node.get("down"):
+            raise ConnectionError("%s is down" % self.url)
+        self.network.clock.now += node["delay"]
+        self.network.calls.append(self.url)
+
+    def get_dynamic_global_properties(self):
+        self._answer()
+        return {"head_block_number": self.network.nodes[self.url]["head"]}
+
+    def get_objects(self, ids):
+        self._answer()
+        if ids == ["bad"]:
+            raise RPCError("unknown object")
+        return [{"id": i, "node": self.url} for i in ids]
+
+    def close(self):
+        self.closed = True
+
+
+class Network():
+    def __init__(self, **nodes):
+        self.clock = Clock()
+        self.nodes = {url: dict(node) for url, node in nodes.items()}
+        self.calls = []
+        self.connects = []
+
+    def connect(self, url):
+        self.connects.append(url)
+        if self.nodes[url].get("down"):
+            raise ConnectionError("cannot connect to %s" % url)
+        return FakeConnection(self, url)
+
+
+@pytest.fixture
+def network(monkeypatch):
+    network = Network(slow={"delay": 0.3, "head": 100},
+                      fast={"delay": 0.05, "head": 100},
+                      medium={"delay": 0.1, "head": 100})
+    monkeypatch.setattr(nodepool, "time", network.clock)
+    return network
+
+
+def pool_of(network, **kwargs):
+    return NodePool(list(network.nodes), connect=network.connect, rpc_error=RPCError, **kwargs)
+
+
+def test_nodes_are_ranked_by_latency(network):
+    pool = pool_of(network)
+    pool.probe()
+    assert [node.url for node in pool.ranked()] == ["fast", "medium", "slow"]
+    assert pool.nodes[1].latency == pytest.approx(0.05)
+    network.calls.clear()
+    assert pool.get_objects(["2.1.0"]) == [{"id": "2.1.0", "node": "fast"}]
+    assert network.calls == ["fast"]
+
+
+def test_lagging_node_is_skipped(network):
+    network.nodes["fast"]["head"] = 90
+    pool = pool_of(network, max_lag=3)
+    pool.probe()
+    assert pool.nodes[1].lag == 10
+    assert pool.best().url == "medium"
+    assert pool.lagging("fast")
+    assert not pool.lagging("medium")
+    network.nodes["fast"]["head"] = 99
+    pool.probe()
+    assert pool.best().url == "fast"
+
+
+def test_failover_on_connection_error(network):
+    pool = pool_of(network)
+    pool.probe()
+    network.nodes["fast"]["down"] = True
+    assert pool.get_objects(["2.1.0"])[0]["node"] == "medium"
+    fast = pool.nodes[1]
+    assert not fast.healthy and fast.failures == 1
+    assert pool.best().url == "medium"
+    assert pool.lagging("fast")
+
+    # The next probe reconnects the node once it is back
+    network.nodes["fast"]["down"] = False
+    pool.probe()
+    assert fast.healthy and pool.best().url == "fast"
+
+
+def test_node_errors_are_raised_without_failover(network):
+    pool = pool_of(network)
+    pool.probe()
+    network.calls.clear()
+    with pytest.raises(RPCError):
+        pool.get_objects(["bad"])
+    assert network.calls == ["fast"]
+    assert all(node.healthy for node in pool.nodes)
+
+
+def test_all_nodes_down(network):
+    for node in network.nodes.values():
+        node["down"] = True
+    pool = pool_of(network)
+    with pytest.raises(Exception, match="No witness node is reachable"):
+        pool.ready()
+    with pytest.raises(ConnectionError):
+        pool.get_objects(["2.1.0"])
+
+
+def test_ready_with_one_node_up(network):
+    network.nodes["fast"]["down"] = True
+    network.nodes["medium"]["down"] = True
+    pool = pool_of(network)
+    pool.ready()
+    assert pool.best().url == "slow"
+
+
+class FakeWebsocket():
+    """ The subscription side of ``GrapheneWebsocket`` """
+
+    def __init__(self):
+        self.url = "wss://old/ws"
+        self.connected = 0
+
+    def connect(self):
+        self.connected += 1
+
+    def run_forever(self):
+        return "subscribed"
+
+
+def test_routed_websocket(network):
+    pool = pool_of(network)
+    pool.probe()
+    ws = FakeWebsocket()
+    routed = RoutedWebsocket(ws, pool)
+    assert routed.run_forever() == "subscribed"
+    assert routed.get_objects(["1.2.0"])[0]["node"] == "fast"
+
+    routed.objectMap = {}
+    assert ws.objectMap == {}
+
+    routed.switch("wss://node.example:8090/ws")
+    assert (ws.url, ws.host, ws.port, ws.ssl) == ("wss://node.example:8090/ws", "node.example", 8090, True)
+    assert ws.connected == 1
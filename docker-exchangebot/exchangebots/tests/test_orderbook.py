@@ -0,0 +1,124 @@
+from orderbook import OrderBooks
+import orderbook
+import pytest
+
+ASSETS = {"BTS": {"id": "1.3.0", "symbol": "BTS", "precision": 5},
+          "USD": {"id": "1.3.121", "symbol": "USD", "precision": 4}}
+
+
+class FakeAssets():
+    def get_asset(self, name):
+        return ASSETS[name]
+
+    def backing_asset_id(self, name):
+        return "1.3.0"
+
+
+def bid(number, price, amount):
+    """ Limit order buying ``amount`` USD at ``price`` BTS """
+    bts = int(round(amount * price * 1e5))
+    return {"id": "1.7.%d" % number, "for_sale": bts,
+            "sell_price": {"base": {"amount": bts, "asset_id": "1.3.0"},
+                           "quote": {"amount": int(round(amount * 1e4)), "asset_id": "1.3.121"}}}
+
+
+def ask(number, price, amount):
+    """ Limit order selling ``amount`` USD at ``price`` BTS """
+    usd = int(round(amount * 1e4))
+    return {"id": "1.7.%d" % number, "for_sale": usd,
+            "sell_price": {"base": {"amount": usd, "asset_id": "1.3.121"},
+                           "quote": {"amount": int(round(amount * price * 1e5)), "asset_id": "1.3.0"}}}
+
+
+class FakeWebsocket():
+    def __init__(self, orders):
+        self.orders = orders
+        self.loads = 0
+
+    def get_limit_orders(self, quote, base, limit):
+        self.loads += 1
+        bids = [o for o in self.orders if o["sell_price"]["base"]["asset_id"] == base]
+        asks = [o for o in self.orders if o["sell_price"]["base"]["asset_id"] == quote]
+        return bids[:limit] + asks[:limit]
+
+    def get_fill_order_history(self, quote, base, limit, api=None):
+        return []
+
+
+class FakeExchange():
+    def __init__(self, orders):
+        self.ws = FakeWebsocket(orders)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    class Clock():
+        now = 1000.0
+
+        def time(self):
+            return self.now
+    clock = Clock()
+    monkeypatch.setattr(orderbook, "time", clock)
+    return clock
+
+
+def books_of(orders, **kwargs):
+    dex = FakeExchange(orders)
+    return OrderBooks(dex, FakeAssets(), ["USD : BTS"], " : ", **kwargs), dex
+
+
+def test_books_are_stale_until_seeded(clock):
+    books, dex = books_of([bid(1, 299, 1), ask(2, 301, 1)])
+    assert books.stale()
+    books.seed()
+    assert not books.stale()
+    assert (books["USD : BTS"].highest_bid, books["USD : BTS"].lowest_ask) == (299, 301)
+
+
+def test_books_are_stale_after_the_interval(clock):
+    books, dex = books_of([bid(1, 299, 1)], reseed_interval=60)
+    books.seed()
+    clock.now += 59
+    assert not books.stale()
+    clock.now += 1
+    assert books.stale()
+
+
+def test_invalidated_books_are_stale(clock):
+    books, dex = books_of([bid(1, 299, 1)])
+    books.seed()
+    books.invalidate()
+    assert books.stale()
+
+
+def test_reseed_drops_the_orders_missed_meanwhile(clock):
+    orders = [bid(1, 299, 1), bid(2, 298, 1), ask(3, 301, 1)]
+    books, dex = books_of(orders)
+    books.seed()
+    # Order 1 is filled while the notifications are lost
+    del orders[0]
+    assert books["USD : BTS"].highest_bid == 299
+    books.invalidate()
+    books.seed()
+    assert books["USD : BTS"].highest_bid == 298
+    assert dex.ws.loads == 2
+
+
+def test_side_cut_off_at_depth_is_stale_once_consumed(clock):
+    orders = [ask(i, 300 + i, 1) for i in range(10)] + [bid(100 + i, 299 - i, 1) for i in range(2)]
+    books, dex = books_of(orders, depth=4)
+    books.seed()
+    assert books.truncated["USD : BTS"] == {"asks"}
+    book = books["USD : BTS"]
+    # The bids are complete, consuming them does not need a reload
+    books.apply(["1.7.100", "1.7.101"])
+    assert not books.stale()
+    books.apply(["1.7.0"])
+    assert not books.stale()
+    books.apply(["1.7.1", "1.7.2"])
+    assert book.lowest_ask == 303
+    assert books.stale()
+    orders[:] = orders[3:10]
+    books.seed()
+    assert book.prices["asks"] == [303, 304, 305, 306]
+    assert not books.stale()
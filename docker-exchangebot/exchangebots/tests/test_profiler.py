@@ -0,0 +1,57 @@
+from profiler import BlockProfiler
+import pytest
+
+
+def layered_stats(layers, width):
+    """ pstats data of a call graph in which every function calls all
+        functions of the next layer (``width ** layers`` paths)
+    """
+    stats = {}
+    root = ("bot.py", 1, "onBlock")
+    stats[root] = (1, 1, 0.0, float(width), {})
+    previous = [root]
+    for layer in range(layers):
+        current = [("layer.py", layer * width + i, "f%d_%d" % (layer, i)) for i in range(width)]
+        for function in current:
+            share = 1.0 / len(previous)
+            ct = sum(stats[caller][3] for caller in previous) / width
+            tt = ct if layer == layers - 1 else ct / 2
+            stats[function] = (1, 1, tt, ct, {caller: (1, 1, tt * share, ct * share)
+                                             for caller in previous})
+        previous = current
+    return stats
+
+
+def test_collapse_is_bounded_and_keeps_the_time():
+    stats = layered_stats(12, 10)
+    profiler = BlockProfiler(min_share=0.001)
+    stacks = profiler._collapse(stats)
+    assert 0 < len(stacks) < 10000
+    assert sum(stacks.values()) == pytest.approx(stats[("bot.py", 1, "onBlock")][3] * 1e6, rel=1e-3)
+
+
+def test_collapse_of_a_call_chain():
+    main = ("bot.py", 1, "main")
+    tick = ("bot.py", 10, "tick")
+    fetch = ("api.py", 5, "fetch")
+    stats = {
+        main: (1, 1, 0.1, 1.0, {}),
+        tick: (2, 2, 0.3, 0.9, {main: (2, 2, 0.3, 0.9)}),
+        fetch: (4, 4, 0.6, 0.6, {tick: (4, 4, 0.6, 0.6)}),
+    }
+    assert BlockProfiler()._collapse(stats) == {
+        "bot.py:main:1": 100000,
+        "bot.py:main:1;bot.py:tick:10": 300000,
+        "bot.py:main:1;bot.py:tick:10;api.py:fetch:5": 600000,
+    }
+
+
+def test_recursion_is_not_counted_twice():
+    main = ("bot.py", 1, "main")
+    walk = ("bot.py", 20, "walk")
+    stats = {
+        main: (1, 1, 0.0, 1.0, {}),
+        walk: (1, 5, 1.0, 1.0, {main: (1, 1, 0.2, 1.0), walk: (4, 4, 0.8, 0.8)}),
+    }
+    stacks = BlockProfiler()._collapse(stats)
+    assert sum(stacks.values()) == 1000000
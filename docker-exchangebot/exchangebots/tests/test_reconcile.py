@@ -0,0 +1,68 @@
+from strategies.reconcile import OrderReconciler
+import random
+import pytest
+
+
+def order(number, type, rate, amount):
+    return {"orderNumber": number, "type": type, "rate": rate, "amount": amount}
+
+
+def desire(type, rate, amount):
+    return {"type": type, "rate": rate, "amount": amount}
+
+
+def test_orders_within_tolerance_are_kept():
+    reconciler = OrderReconciler(1, 10)
+    current = [order("1.7.1", "sell", 101.5, 10), order("1.7.2", "buy", 99.5, 10.5)]
+    desired = [desire("sell", 101, 10), desire("buy", 99, 10)]
+    keep, cancel, create = reconciler.reconcile(desired, current)
+    assert keep == current
+    assert cancel == [] and create == []
+
+
+def test_orders_off_price_amount_or_side_are_replaced():
+    reconciler = OrderReconciler(1, 10)
+    current = [order("1.7.1", "sell", 103, 10),   # price off
+               order("1.7.2", "sell", 101, 12),   # amount off
+               order("1.7.3", "sell", 99, 10)]    # wrong side
+    desired = [desire("sell", 101, 10), desire("buy", 99, 10)]
+    keep, cancel, create = reconciler.reconcile(desired, current)
+    assert keep == []
+    assert cancel == current
+    assert create == desired
+
+
+def test_closest_order_is_kept_and_duplicates_canceled():
+    reconciler = OrderReconciler(1, 10)
+    current = [order("1.7.1", "sell", 100.8, 10), order("1.7.2", "sell", 100.1, 10)]
+    keep, cancel, create = reconciler.reconcile([desire("sell", 100, 10)], current)
+    assert [o["orderNumber"] for o in keep] == ["1.7.2"]
+    assert [o["orderNumber"] for o in cancel] == ["1.7.1"]
+    assert create == []
+
+
+def test_nothing_desired_or_nothing_open():
+    reconciler = OrderReconciler(1, 10)
+    current = [order("1.7.1", "sell", 100, 10)]
+    assert reconciler.reconcile([], current) == ([], current, [])
+    assert reconciler.reconcile([desire("buy", 99, 1)], []) == ([], [], [desire("buy", 99, 1)])
+
+
+def test_zero_target_is_never_acceptable():
+    reconciler = OrderReconciler(1, 10)
+    keep, cancel, create = reconciler.reconcile(
+        [desire("sell", 0, 10)], [order("1.7.1", "sell", 0, 10)])
+    assert keep == [] and len(cancel) == 1 and len(create) == 1
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_arrays_and_pairwise_agree(seed):
+    """ Many orders are matched with numpy, few one by one """
+    rng = random.Random(seed)
+    reconciler = OrderReconciler(1, 10)
+    desired = [desire(rng.choice(["buy", "sell"]), rng.uniform(95, 105), rng.uniform(5, 15))
+               for _ in range(20)]
+    current = [order("1.7.%d" % i, rng.choice(["buy", "sell"]), rng.uniform(95, 105), rng.uniform(5, 15))
+               for i in range(20)]
+    assert len(desired) * len(current) > reconciler.small
+    assert reconciler.reconcile(desired, current) == reconciler._reconcile_pairwise(desired, current)
@@ -0,0 +1,90 @@
+from router import NotificationRouter
+from strategies.orderindex import OrderIndex
+
+IDS = {"USD": "1.3.121", "EUR": "1.3.120", "BTS": "1.3.0"}
+
+
+class FakeAssets():
+    def market_ids(self, market, separator):
+        quote, base = market.split(separator)
+        return {"quote": IDS[quote], "base": IDS[base]}
+
+    def get_asset(self, asset_id):
+        return {"id": asset_id}
+
+
+class FakeBot():
+    watch_collateral = False
+
+    def __init__(self, *markets):
+        self.settings = {"markets": list(markets)}
+        self.orders = OrderIndex()
+        self.loads = 0
+
+    def loadMarket(self):
+        self.loads += 1
+
+    def store(self):
+        pass
+
+
+def price(base, quote):
+    return {"base": {"amount": 1, "asset_id": IDS[base]},
+            "quote": {"amount": 1, "asset_id": IDS[quote]}}
+
+
+def make_router():
+    bots = {"usd": FakeBot("USD : BTS"),
+            "eur": FakeBot("EUR : BTS"),
+            "both": FakeBot("USD : BTS", "EUR : BTS")}
+    return NotificationRouter(bots, FakeAssets(), " : "), bots
+
+
+def test_limit_order_marks_the_bots_of_its_market():
+    router, bots = make_router()
+    notice = {"id": "1.7.5", "seller": "1.2.1", "sell_price": price("BTS", "USD")}
+    assert router.route_account(notice) == {"usd", "both"}
+    assert router.dirty == {"usd", "both"}
+
+
+def test_balance_marks_the_bots_of_its_asset():
+    router, bots = make_router()
+    assert router.route_account({"id": "2.5.1", "owner": "1.2.1", "asset_type": "1.3.120"}) == {"eur", "both"}
+    assert router.route_account({"id": "2.5.2", "owner": "1.2.1", "asset_type": "1.3.0"}) == {"usd", "eur", "both"}
+
+
+def test_account_and_statistics_mark_no_bot():
+    router, bots = make_router()
+    assert router.route_account({"id": "1.2.1", "name": "bot"}) == set()
+    assert router.route_account({"id": "2.6.1", "owner": "1.2.1"}) == set()
+    assert router.dirty == set()
+
+
+def test_removed_order_marks_the_bots_of_its_market():
+    router, bots = make_router()
+    bots["eur"].orders.add("EUR : BTS", "1.7.9")
+    assert router.route_removed("1.7.9") == {"eur", "both"}
+    assert router.route_removed("1.7.10") == set()
+    assert router.dirty == {"eur", "both"}
+
+
+def test_flush_refreshes_every_dirty_bot_once():
+    router, bots = make_router()
+    router.route_market({"id": "1.7.1", "sell_price": price("USD", "BTS")})
+    router.route_market({"id": "1.7.2", "sell_price": price("BTS", "USD")})
+    assert router.flush() == {"usd", "both"}
+    assert (bots["usd"].loads, bots["eur"].loads, bots["both"].loads) == (1, 0, 1)
+    assert router.dirty == set()
+
+
+def test_touch_and_take():
+    router, bots = make_router()
+    router.touch(["USD : BTS"], "usd")
+    assert router.dirty == {"both"}
+    assert router.take("both")
+    assert not router.take("both")
+    router.dirty.add("usd")
+    router.touch(["USD : BTS"], "usd")
+    assert router.dirty == {"usd", "both"}
+    router.touch_all()
+    assert router.dirty == {"usd", "eur", "both"}